@@ -20,10 +20,9 @@ from app.db.schemas import (
 )
 from collections import defaultdict
 import uuid
-import httpx
 import time
 import os
-import requests
+import orjson
 import json
 import psutil
 import asyncio
@@ -31,12 +30,20 @@ import traceback
 
 from app.config.model_mappings import get_internal_model, get_public_model, is_valid_model
 from app.dependencies.api_key_dep import get_current_api_key
-from app.core.rag import query_collection
+from app.core.generation_scheduler import (
+    PRIORITY_API,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    GenerationOverloaded,
+    generation_scheduler,
+)
+from app.core.ollama_client import OllamaHTTPError, ollama
+from app.core.rag import query_collections, resolve_collections
 from app.data_processing.embed_dataset import retrieve_context
 
 from app.core.llm_inference import (
     generate_with_streaming_async,
-    select_optimal_model,
+    route_model,
     add_to_history,
     get_history_messages,
     is_math_question,
@@ -102,55 +109,57 @@ async def openai_chat_completions(
         for msg in request.messages
     ]
     
-    async with httpx.AsyncClient(timeout=120.0) as client:
-        try:
-            response = await client.post(
-                "http://127.0.0.1:11434/api/chat",
-                json={
-                    "model": internal_model,
-                    "messages": ollama_messages,
-                    "stream": request.stream,
-                    "options": {
-                        "temperature": request.temperature,
-                        "num_predict": request.max_tokens
-                    }
-                }
-            )
-            response.raise_for_status()
-            result = response.json()
-            
-            return {
-                "id": f"chatcmpl-{secrets.token_hex(8)}",
-                "object": "chat.completion",
-                "created": int(datetime.utcnow().timestamp()),
-                "model": request.model,
-                "choices": [
-                    {
-                        "index": 0,
-                        "message": {
-                            "role": "assistant",
-                            "content": result.get("message", {}).get("content", "")
-                        },
-                        "finish_reason": "stop"
-                    }
-                ],
-                "usage": {
-                    "prompt_tokens": 0,
-                    "completion_tokens": 0,
-                    "total_tokens": 0
+    try:
+        result = await ollama.chat(
+            internal_model,
+            ollama_messages,
+            options={
+                "temperature": request.temperature,
+                "num_predict": request.max_tokens
+            },
+            timeout=120.0,
+            priority=PRIORITY_API,
+            user=f"api-key-{api_key.id}",
+        )
+
+        return {
+            "id": f"chatcmpl-{secrets.token_hex(8)}",
+            "object": "chat.completion",
+            "created": int(datetime.utcnow().timestamp()),
+            "model": request.model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {
+                        "role": "assistant",
+                        "content": result.get("message", {}).get("content", "")
+                    },
+                    "finish_reason": "stop"
                 }
+            ],
+            "usage": {
+                "prompt_tokens": result.get("prompt_eval_count", 0),
+                "completion_tokens": result.get("eval_count", 0),
+                "total_tokens": result.get("prompt_eval_count", 0) + result.get("eval_count", 0)
             }
-            
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Ollama error: {e.response.text}"
-            )
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Internal error: {str(e)}"
-            )
+        }
+
+    except GenerationOverloaded as e:
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except OllamaHTTPError as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ollama error: {e.body}"
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Internal error: {str(e)}"
+        )
 
 @router.get("/v1/models")
 async def list_models(api_key = Depends(get_current_api_key)):
@@ -547,6 +556,26 @@ async def send_message(
         user_id = "guest"
 
     chat_id = body.chat_id
+    is_greeting_msg = is_greeting(body.message)
+
+    is_math_q = is_math_question(body.message)
+    is_code_q = is_coding_question(body.message)
+    response_style = body.response_style or "balanced"
+
+    # Best model expected to meet the style's latency target; the rest are TTFT fallbacks
+    route: list[str] = []
+    if not is_greeting_msg:
+        route = route_model(
+            is_math_or_coding=(is_math_q or is_code_q),
+            style=response_style,
+            prompt_chars=len(body.message) + sum(len(m["content"]) for m in get_history_messages(user_id)[-6:]),
+        )
+        # Shed load before the stream starts, so the client gets a real 503 + Retry-After
+        if route:
+            try:
+                generation_scheduler.check(route[0], PRIORITY_INTERACTIVE)
+            except GenerationOverloaded as e:
+                raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
     if not is_guest:
         if not chat_id or not is_valid_uuid(chat_id):
@@ -559,10 +588,9 @@ async def send_message(
         if not chat_id or not chat_id.startswith("guest-"):
             chat_id = generate_guest_id()
 
-    is_greeting_msg = is_greeting(body.message)
-
     async def token_stream():
         full_response_tokens: list[str] = []
+        model_used: dict = {}
         sources_citation = ""
 
         try:
@@ -596,15 +624,10 @@ async def send_message(
                 return
 
             # ── MODEL SELECTION ────────────────────────────────────
-            is_math_q = is_math_question(body.message)
-            is_code_q = is_coding_question(body.message)
-
-            model = select_optimal_model(is_math_or_coding=(is_math_q or is_code_q))
-            if not model:
+            if not route:
                 yield f"data: {json.dumps({'type': 'error', 'content': 'No suitable model available'})}\n\n"
                 return
-
-            response_style = body.response_style or "balanced"
+            model = route[0]
 
             options = adjust_model_options_for_style(
                 base_options={
@@ -672,11 +695,12 @@ async def send_message(
                         traceback.print_exc()
 
             # ── RAG ────────────────────────────────────────────────
-            if body.collection_id:
+            collection_ids = resolve_collections(body.collection_id, body.collection_ids, body.collection_group)
+            if collection_ids:
                 try:
                     retrieved = await asyncio.to_thread(
-                        query_collection,
-                        body.collection_id,
+                        query_collections,
+                        collection_ids,
                         body.message,
                         k=5,
                     )
@@ -778,6 +802,10 @@ THIS OVERRIDES YOUR BASE SYSTEM PROMPT.
                 model=model,
                 options=options,
                 contexts=contexts,
+                user_id=user_id if not is_guest else chat_id,
+                fallbacks=route[1:],
+                style=response_style,
+                used=model_used,
             ):
                 if await request.is_disconnected():
                     log("INFO", "Client disconnected")
@@ -827,7 +855,7 @@ THIS OVERRIDES YOUR BASE SYSTEM PROMPT.
                     user_message=body.message,
                     bot_reply=final_answer,
                     created_at=datetime.utcnow(),
-                    model_used=model,
+                    model_used=model_used.get("model", model),
                     response_style=response_style,
                 )
                 db.add(entry)
@@ -865,9 +893,10 @@ async def generate_chat_title(
         conversation_preview = conversation_preview[:500] + "..."
     
     try:
-        from app.core.llm_inference import generate_with_streaming
-        
-        model = "qwen2.5:3b"
+        from app.core.llm_inference import generate_with_streaming, select_title_model
+
+        # Reuse a loaded small model instead of evicting the chat model for a title
+        model = select_title_model()
         
         messages_for_llm = [
             {
@@ -886,13 +915,7 @@ async def generate_chat_title(
             "num_ctx": 2048,
         }
         
-        title = await asyncio.get_event_loop().run_in_executor(
-            None,
-            generate_with_streaming,
-            messages_for_llm,
-            model,
-            options
-        )
+        title = await generate_with_streaming(messages_for_llm, model, options, priority=PRIORITY_BACKGROUND)
         
         if title:
             title = title.strip().strip('"').strip("'").strip()
@@ -923,25 +946,16 @@ async def send_stream(
     prompt = build_prompt(body.message, [], 'normal', False, False, False)
 
     async def event_generator():
-        payload = {
-            "model": os.getenv("OCTO_LLM_MODEL", "qwen2.5:0.5b"),
-            "prompt": prompt,
-            "stream": True,
-            "options": {"num_predict": 900},
-        }
-
-        with requests.post(
-            f"{os.getenv('OLLAMA_HOST', 'http://127.0.0.1:11434')}/api/generate",
-            json=payload,
-            stream=True,
-        ) as r:
-            for line in r.iter_lines():
-                if not line:
-                    continue
-                data = line.decode("utf-8")
-                if '"response"' in data:
-                    token = data.split('"response":"')[-1].split('"')[0]
-                    yield f"data: {token}\n\n"
+        async for chunk in ollama.generate_stream(
+            os.getenv("OCTO_LLM_MODEL", "qwen2.5:0.5b"),
+            prompt,
+            options={"num_predict": 900},
+            user=(user or {}).get("id"),
+        ):
+            if chunk.get("response"):
+                # JSON-escaped without the quotes, so newlines cannot break the SSE frame
+                token = orjson.dumps(chunk["response"]).decode("utf-8")[1:-1]
+                yield f"data: {token}\n\n"
 
     return StreamingResponse(
         event_generator(),
@@ -1031,6 +1045,58 @@ def get_ai_stats(db: Session = Depends(get_db)):
             "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
         }
 
+@router.get("/stats/embeddings")
+def get_embedding_stats():
+    """Micro-batch scheduler histograms and query-embedding cache counters."""
+    from app.core.embeddings import get_embedding_service
+
+    return get_embedding_service().stats()
+
+@router.get("/stats/resources")
+async def get_resource_stats(limit: int = 300):
+    """Latest RAM / CPU / Ollama model sample and the recent sample history."""
+    from app.core.resource_monitor import resource_monitor
+
+    return resource_monitor.stats(limit=max(0, limit))
+
+@router.get("/stats/generation")
+async def get_generation_stats():
+    """Generation slots, queue depths, shed requests and queue-wait histograms."""
+    return generation_scheduler.stats()
+
+@router.get("/stats/models")
+async def get_model_residency_stats():
+    """Hot set, loaded models, per-model keep_alive, runner options and cold loads."""
+    from app.core.model_residency import model_residency
+
+    return model_residency.stats()
+
+@router.get("/stats/router")
+async def get_model_router_stats():
+    """Rolling TTFT / tokens/s / failure statistics per model and the latency targets."""
+    from app.core.model_router import model_router
+
+    return model_router.summary()
+
+@router.post("/models/calibrate")
+async def calibrate_models(models: str | None = None, user=Depends(get_current_user)):
+    """Profile installed text models (or the comma-separated `models`) in the background."""
+    from app.core.llm_inference import is_text_generation_model
+    from app.core.model_router import model_router
+    from app.core.resource_monitor import resource_monitor
+
+    if models:
+        targets = [m.strip() for m in models.split(",") if m.strip()]
+    else:
+        snapshot = resource_monitor.snapshot
+        installed = snapshot.installed_models if snapshot is not None else ()
+        targets = [m for m in installed if is_text_generation_model(m)]
+    if not targets:
+        raise HTTPException(status_code=404, detail="No models to calibrate")
+    if not model_router.start_calibration(targets):
+        raise HTTPException(status_code=409, detail="Calibration already running")
+    return {"status": "started", "models": targets}
+
 @router.get("/knowledge-memory-status")
 def get_knowledge_memory_status(
     db: Session = Depends(get_db),
@@ -1081,6 +1147,10 @@ def submit_feedback(
     )
     db.add(db_feedback)
     db.commit()
+
+    # Re-rank weight changes immediately; the vector itself is untouched
+    if feedback.knowledge_id:
+        learning_system.refresh_confidence(db, feedback.knowledge_id)
     return {"ok": True}
 
 @router.post("/feedback/submit-answer")
@@ -1,68 +1,102 @@
 # app/api/file_router.py
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, Form, Header
-from typing import List 
+from fastapi.responses import StreamingResponse
+from typing import Callable, Iterable, Iterator, List, Optional
 from app.db.deps import get_current_user_optional
 from sqlalchemy.orm import Session
 from app.db.database import get_db
-from pypdf import PdfReader
 from docx import Document
 from PIL import Image
-import pytesseract
 import io
 import os
-import requests
+import json
+import asyncio
 import time
 import uuid
 
 # === NEW: RAG IMPORTS ===
-from app.core.rag import create_collection
+from app.core.rag import collection_exists, create_collection, create_group
+from app.core.ingestion import JobContext, PermanentJobError, ingestion_queue
+from app.core.generation_scheduler import PRIORITY_BACKGROUND, GenerationOverloaded
+from app.core.ollama_client import OllamaTimeout, ollama
+from app.data_processing.extraction import EXTRACT_TIME_BUDGET, iter_pdf_pages, ocr_image
+from app.data_processing.partitions import GUEST_CHAT_PREFIX, upload_owner
+from app.data_processing.content_store import (
+    collection_id_for,
+    load_vectors,
+    read_analysis,
+    read_text,
+    save_vectors,
+    store_blob,
+    write_analysis,
+    write_text,
+)
 
 router = APIRouter()
 
 # 🔥 FIXED: Use fast text model instead of moondream (10x faster, no timeout)
-OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
 LLM_MODEL = os.getenv("OCTO_LLM_MODEL_GENERATE", "gemma3:4b")  # 🔥 CHANGED: Was "moondream"
 
-def extract_text_from_file(content: bytes, ext: str, filename: str) -> str:
-    """Extract text from various file formats"""
-    texts = []
-    
+# Chunks per embed_new_content() call while ingesting (progress granularity)
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "256"))
+# Upper bound for /upload?wait=true before the job id is returned instead
+INGEST_WAIT_TIMEOUT = float(os.getenv("INGEST_WAIT_TIMEOUT", "170"))
+
+IMAGE_EXTENSIONS = ["jpg", "jpeg", "png", "webp", "bmp", "tiff"]
+TEXT_EXTENSIONS = ["txt", "md", "py", "js", "json", "html", "css", "java", "cpp", "c", "go", "rs", "rb", "php"]
+SUPPORTED_EXTENSIONS = {"pdf", "docx", "doc", *IMAGE_EXTENSIONS, *TEXT_EXTENSIONS}
+
+def iter_extracted_text(
+    file_path: str,
+    ext: str,
+    filename: str,
+    progress: Optional[Callable[[float], None]] = None,
+    report: Optional[dict] = None,
+) -> Iterator[str]:
+    """
+    Extract text from various file formats. PDFs come page by page from
+    the parallel extractor (scanned pages are OCR'd), so the caller can
+    chunk while later pages are still being read. `report["complete"]` is
+    False when part of the document could not be read (budget, OCR error).
+    """
+    report = report if report is not None else {}
+    report["complete"] = True
     try:
         if ext == "pdf":
-            reader = PdfReader(io.BytesIO(content))
-            for page in reader.pages:
-                txt = page.extract_text() or ""
+            pages = {}
+            for _, txt in iter_pdf_pages(file_path, progress=progress, report=pages):
                 if txt.strip():
-                    texts.append(txt)
-        
-        elif ext in ["docx", "doc"]:
+                    yield txt
+            report["complete"] = not pages["skipped"]
+            return
+
+        with open(file_path, "rb") as f:
+            content = f.read()
+
+        if ext in ["docx", "doc"]:
             doc = Document(io.BytesIO(content))
-            texts.extend([p.text for p in doc.paragraphs if p.text.strip()])
+            yield "\n\n".join(p.text for p in doc.paragraphs if p.text.strip())
         
-        elif ext in ["jpg", "jpeg", "png", "webp", "bmp", "tiff"]:
+        elif ext in IMAGE_EXTENSIONS:
             try:
                 img = Image.open(io.BytesIO(content)).convert("RGB")
-                ocr_text = pytesseract.image_to_string(img, lang="eng")
-                if ocr_text.strip():
-                    texts.append(ocr_text.strip())
+                ocr_text = ocr_image(img, timeout=EXTRACT_TIME_BUDGET)
+                if ocr_text:
+                    yield ocr_text
                 else:
-                    texts.append("[Image with no readable text detected]")
+                    yield "[Image with no readable text detected]"
             except Exception as e:
-                texts.append(f"[Could not process image: {str(e)}]")
+                report["complete"] = False
+                yield f"[Could not process image: {str(e)}]"
         
-        elif ext in ["txt", "md", "py", "js", "json", "html", "css", "java", "cpp", "c", "go", "rs", "rb", "php"]:
+        elif ext in TEXT_EXTENSIONS:
             try:
-                texts.append(content.decode("utf-8", errors="ignore"))
+                yield content.decode("utf-8", errors="ignore")
             except Exception:
-                texts.append(content.decode("latin-1", errors="ignore"))
+                yield content.decode("latin-1", errors="ignore")
         
         else:
             raise HTTPException(400, f"Unsupported file type: .{ext}")
-        
-        if not texts:
-            raise HTTPException(400, "No text could be extracted from the file")
-        
-        return "\n\n".join(texts)
     
     except HTTPException:
         raise
@@ -70,8 +104,20 @@ def extract_text_from_file(content: bytes, ext: str, filename: str) -> str:
         raise HTTPException(500, f"Error extracting text: {str(e)}")
 
 
-def analyze_with_ollama(content: str, filename: str, query: str = None) -> str:    
+def analyze_with_ollama(
+    content: str,
+    filename: str,
+    query: str = None,
+    content_hash: str = None,
+    user_id: str = None,
+) -> str:    
     
+    # Same document, same question → same analysis
+    if content_hash:
+        cached = read_analysis(content_hash, LLM_MODEL, query)
+        if cached is not None:
+            return cached
+
     try:
         # 🔥 FIXED: Reduced from 7000 to 4000 (prevents 90s timeout)
         truncated_content = content[:4000]
@@ -108,49 +154,195 @@ Include:
 Be accurate, thorough, and well-organized."""
 
         # Optimized for speed and quality on llama3.2:3b + CPU
-        response = requests.post(
-            f"{OLLAMA_HOST}/api/generate",
-            json={
-                "model": LLM_MODEL,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.3,
-                    "num_predict": -1,
-                    "num_ctx": 8192,
-                    "top_k": 30,
-                    "top_p": 0.8,
-                    "repeat_penalty": 1.05,
-                }
+        # Runs in an ingestion worker thread; the request itself goes through the shared pool
+        result = ollama.call(
+            "generate",
+            LLM_MODEL,
+            prompt,
+            options={
+                "temperature": 0.3,
+                "num_predict": -1,
+                "num_ctx": 8192,
+                "top_k": 30,
+                "top_p": 0.8,
+                "repeat_penalty": 1.05,
             },
-            timeout=90
+            timeout=90,
+            priority=PRIORITY_BACKGROUND,
+            user=user_id,
         )
         
-        if response.status_code != 200:
-            raise Exception(f"Ollama error: {response.status_code} {response.text}")
-        
-        result = response.json()
-        return result.get("response", "No response from AI").strip()
+        answer = result.get("response", "No response from AI").strip()
+        if content_hash and result.get("response"):
+            write_analysis(content_hash, LLM_MODEL, query, answer)
+        return answer
         
-    except requests.exceptions.Timeout:
+    except OllamaTimeout:
         return f"Analysis took too long (timeout), but '{filename}' was uploaded and saved. You can ask follow-up questions!"
     
     except Exception as e:
         return f"File '{filename}' processed successfully, but AI analysis failed ({str(e)[:80]}).\n\nThe content is saved — ask me specific questions about it!"
 
 
+# ================================================================
+# Background ingestion (see app/core/ingestion.py)
+# ================================================================
+def _chunk_upload_stream(pieces: Iterable[str], chunk_size: int = 850, overlap: int = 120) -> Iterator[str]:
+    """
+    Fixed-size chunks with a small overlap over the pieces joined by blank
+    lines (the same windows as chunking the joined text), produced while
+    the pieces are still arriving. Short/empty chunks are dropped.
+    """
+    step = chunk_size - overlap
+    buffer, first = "", True
+    for piece in pieces:
+        buffer += piece if first else "\n\n" + piece
+        first = False
+        while len(buffer) >= chunk_size:
+            yield buffer[:chunk_size]
+            buffer = buffer[step:]
+    while buffer:
+        yield buffer[:chunk_size]
+        buffer = buffer[step:]
+
+
+def _run_upload_job(job: dict, ctx: JobContext) -> dict:
+    """extract → chunk → embed (overlapping, page by page) → analyze for one /files/upload file."""
+    from app.data_processing.embed_dataset import embed_new_content
+
+    payload = job["payload"]
+    filename = job["filename"]
+    digest = payload.get("content_hash")
+    extracted = {"fraction": 0.0}
+    report = {}
+
+    def on_pages(fraction: float) -> None:
+        extracted["fraction"] = fraction
+        ctx.progress("extract", fraction)
+
+    # Known document: text and embeddings come from the content-addressed cache
+    cached_text = read_text(digest) if digest else None
+    vector_cache = load_vectors(digest) if digest else None
+    cached_vectors = len(vector_cache) if vector_cache is not None else 0
+
+    texts = []
+
+    def pieces():
+        if cached_text is not None:
+            source = [cached_text]
+        else:
+            source = iter_extracted_text(job["file_path"], payload["ext"], filename, progress=on_pages, report=report)
+        for piece in source:
+            texts.append(piece)
+            yield piece
+
+    start_time = time.time()
+    chunk_count, added_count = 0, 0
+    batch = []
+
+    def flush():
+        nonlocal added_count
+        ctx.progress("embed", extracted["fraction"])
+        # Goes to this user's (or guest chat's) partition only; file name / upload id are stored as metadata
+        added_count += embed_new_content(
+            batch, source=filename, owner=payload.get("owner") or job["user_id"], upload_id=payload["file_id"],
+            vector_cache=vector_cache,
+        )
+        batch.clear()
+
+    ctx.progress("extract")
+    try:
+        # Every chunk is indexed (no per-file cap), in batches as the pages come in
+        for chunk in _chunk_upload_stream(pieces()):
+            chunk = chunk.strip()
+            if len(chunk) < 70:
+                continue
+            chunk_count += 1
+            batch.append(chunk)
+            if len(batch) >= INGEST_EMBED_BATCH:
+                flush()
+    except HTTPException as e:
+        if e.status_code < 500:
+            raise PermanentJobError(e.detail)
+        raise
+
+    extracted_text = "\n\n".join(texts)
+    if not extracted_text.strip():
+        raise PermanentJobError("No text could be extracted from the file")
+
+    if batch:
+        flush()
+    print(f"Embedded {added_count} chunks from '{filename}' in {time.time() - start_time:.2f}s")
+
+    if digest:
+        # A truncated extraction is not cached: the next upload gets another chance
+        if cached_text is None and report.get("complete"):
+            write_text(digest, extracted_text)
+        if vector_cache is not None and len(vector_cache) > cached_vectors:
+            save_vectors(digest, vector_cache)
+
+    ctx.progress("analyze")
+    ai_analysis = analyze_with_ollama(
+        extracted_text, filename, payload.get("query"), content_hash=digest, user_id=job.get("user_id"),
+    )
+
+    return {
+        "status": "success",
+        "file": filename,
+        "file_id": payload["file_id"],
+        "chat_id": payload.get("chat_id"),
+        "message": ai_analysis,
+        "answer": ai_analysis,
+        "text_length": len(extracted_text),
+        "chunks_embedded": chunk_count,
+        "has_query": bool(payload.get("query") and payload["query"].strip()),
+    }
+
+
+def _run_rag_job(job: dict, ctx: JobContext) -> dict:
+    """extract → chunk → embed → index for one /files/upload-rag file."""
+    collection_id = job["payload"]["collection_id"]
+    if collection_exists(collection_id):
+        # Same document indexed meanwhile (collection ids are content-addressed)
+        return {"filename": job["filename"], "collection_id": collection_id}
+    try:
+        collection_id = create_collection(
+            [{"filename": job["filename"], "path": job["file_path"]}],
+            collection_id=job["payload"]["collection_id"],
+            progress=ctx.progress,
+        )
+    except ValueError as e:
+        raise PermanentJobError(str(e))  # nothing readable in the file
+    return {"filename": job["filename"], "collection_id": collection_id}
+
+
+ingestion_queue.register("upload", _run_upload_job)
+ingestion_queue.register("rag", _run_rag_job)
+
+
+def _job_links(job_id) -> dict:
+    return {
+        "job_id": str(job_id),
+        "progress_url": f"/files/jobs/{job_id}",
+        "events_url": f"/files/jobs/{job_id}/events",
+    }
+
+
 @router.post("/upload")
 async def upload_file(
     file: UploadFile = File(...),
     query: str = Form(None),
     chat_id: str = Form(None),  # NEW: Optional chat_id parameter
+    wait: bool = Form(False),   # wait for the job (without blocking other requests) and return its result
     authorization: str = Header(None),
     db: Session = Depends(get_db),
 ):
     """
-    Upload file, save to disk + DB, extract text, analyze with Ollama,
-    and embed content into vector database for future retrieval.
-    Files persist after server restart.
+    Upload file, save to disk + DB and queue it for background ingestion
+    (extract text, embed into the user's partition, analyze with Ollama).
+    Returns a job id at once; poll /files/jobs/{job_id} or stream
+    /files/jobs/{job_id}/events. Files and queued jobs persist after
+    server restart.
     """
     
     # Get user ID from token (fallback to guest)
@@ -170,6 +362,9 @@ async def upload_file(
     # Get file info
     filename = file.filename
     ext = os.path.splitext(filename)[1].lower().lstrip(".")
+
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(400, f"Unsupported file type: .{ext}")
     
     # Validate file size (max 10MB)
     max_size = 10 * 1024 * 1024
@@ -181,37 +376,17 @@ async def upload_file(
     if len(content) == 0:
         raise HTTPException(400, "File is empty")
     
-    # === STEP 1: Save file permanently on disk ===
-    UPLOAD_DIR = "uploads"
-    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    # === STEP 1: Save file permanently on disk (once per distinct content) ===
+    digest, file_path = store_blob(content)
     
-    unique_filename = f"{uuid.uuid4().hex}_{filename}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
-    
-    with open(file_path, "wb") as f:
-        f.write(content)
-    
-    # === STEP 2: Extract text from file ===
+    # === STEP 2: Record the upload and queue its processing ===
     try:
-        extracted_text = extract_text_from_file(content, ext, filename)
-        
-        if not extracted_text or not extracted_text.strip():
-            raise HTTPException(400, "Could not extract any text from the file")
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(500, f"Error processing file: {str(e)}")
-    
-    # === STEP 3: Process (analyze + save to DB + embed) ===
-    try:
-        # Analyze with Ollama
-        ai_analysis = analyze_with_ollama(extracted_text, filename, query)
-        
-        # Save to database
         from app.db.models import FileUpload, Chat
         
         effective_chat_id = chat_id
+        if user_id == "guest" and not upload_owner(None, chat_id):
+            # Guests get a chat of their own; its id keys their upload partition
+            effective_chat_id = f"{GUEST_CHAT_PREFIX}{str(uuid.uuid4())[:8]}"
         if user_id != "guest" and not effective_chat_id:
             new_chat = Chat(
                 user_id=user_id,
@@ -223,7 +398,7 @@ async def upload_file(
         
         file_record = FileUpload(
             user_id=user_id if user_id != "guest" else None,
-            chat_id=effective_chat_id,
+            chat_id=effective_chat_id if user_id != "guest" else None,
             filename=filename,
             file_path=file_path,
             file_type=ext,
@@ -232,114 +407,151 @@ async def upload_file(
         db.add(file_record)
         db.commit()
         db.refresh(file_record)
-        
-        # === IMPROVED EMBEDDING BLOCK - with overlap & better filtering ===
-        try:
-            from app.data_processing.embed_dataset import embed_new_content
-            
-            start_time = time.time()
-            
-            # Better chunking with small overlap
-            chunk_size = 850
-            overlap = 120
-            chunks = []
-            i = 0
-            while i < len(extracted_text):
-                end = min(i + chunk_size, len(extracted_text))
-                chunks.append(extracted_text[i:end])
-                i += chunk_size - overlap
-            
-            # Filter short/empty chunks
-            chunks = [c.strip() for c in chunks if len(c.strip()) >= 70]
-            chunks = chunks[:60]  # reasonable upper limit per file
-            
-            if chunks:
-                enriched = [f"[Uploaded file: {filename}] {c}" for c in chunks]
-                added_count = embed_new_content(enriched, source=filename)
-                embed_time = time.time() - start_time
-                print(f"Embedded {added_count} chunks from '{filename}' in {embed_time:.2f}s")
-            else:
-                print(f"No suitable chunks from '{filename}'")
-                
-        except Exception as e:
-            print(f"Embedding failed (non-critical): {str(e)}")
-        
-        # Success response
-        return {
-            "status": "success",
-            "file": filename,
-            "file_id": str(file_record.id),
-            "chat_id": str(effective_chat_id) if effective_chat_id else None,
-            "message": ai_analysis,
-            "answer": ai_analysis,
-            "text_length": len(extracted_text),
-            "chunks_embedded": len(chunks) if 'chunks' in locals() else 0,
-            "has_query": bool(query and query.strip())
-        }
-    
-    except Exception as e:
-        # Fallback: file is saved, but processing failed
-        preview = extracted_text[:500] + "..." if len(extracted_text) > 500 else extracted_text
-        
-        return {
-            "status": "partial_success",
-            "file": filename,
-            "message": f"""File '{filename}' uploaded and saved to disk!
 
-**Content Preview:**
-{preview}
+        job = ingestion_queue.submit(
+            db,
+            kind="upload",
+            filename=filename,
+            file_path=file_path,
+            user_id=user_id,
+            payload={
+                "ext": ext,
+                "query": query,
+                "content_hash": digest,
+                "file_id": str(file_record.id),
+                "chat_id": str(effective_chat_id) if effective_chat_id else None,
+                "owner": upload_owner(user_id, str(effective_chat_id) if effective_chat_id else None),
+            },
+        )
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(500, f"Error queueing file: {str(e)}")
 
-**File Info:**
-- Length: {len(extracted_text):,} characters
-- Type: {ext.upper()}
+    response = {
+        "status": "queued",
+        "file": filename,
+        "file_id": str(file_record.id),
+        "chat_id": str(effective_chat_id) if effective_chat_id else None,
+        "message": f"File '{filename}' uploaded. Processing in the background...",
+        **_job_links(job.id),
+    }
 
-Processing failed: {str(e)[:100]}
+    if wait:
+        state = await ingestion_queue.wait_for(job.id, timeout=INGEST_WAIT_TIMEOUT)
+        if state and state["status"] == "succeeded":
+            return {**response, **state["result"]}
+        if state and state["status"] == "failed":
+            raise HTTPException(422, f"Processing failed: {state['error']}")
+        # Still running: the client keeps the job id
 
-The file is permanently saved. You can ask questions about it later!""",
-            "answer": f"File uploaded: {filename}\n\nPreview:\n{preview}",
-            "text_length": len(extracted_text),
-            "error": str(e)
-        }
+    return response
 
 
 # === NEW RAG UPLOAD ENDPOINT ===
 @router.post("/upload-rag")
 async def upload_for_rag(
     files: List[UploadFile] = File(...),
-    current_user: dict = Depends(get_current_user_optional)
+    current_user: dict = Depends(get_current_user_optional),
+    db: Session = Depends(get_db),
 ):
-    """Upload multiple files for RAG — returns collection_id for document Q&A"""
+    """
+    Upload multiple files for RAG — each file becomes its own collection,
+    built by a background job. Returns the collection ids (searchable once
+    their job succeeds), the job ids and a group naming all of them.
+    """
     if len(files) == 0:
         raise HTTPException(400, "No files provided")
-    
-    collections = []
+
+    owner = current_user["id"] if current_user else "guest"
+
+    contents = []
     for file in files:  # Process one by one
         content = await file.read()
         if len(content) == 0:
             raise HTTPException(400, f"Empty file: {file.filename}")
         if len(content) > 10 * 1024 * 1024:
             raise HTTPException(400, f"File too large: {file.filename} (max 10MB)")
-        
+        contents.append((file.filename, content))
+
+    collections = []
+    for filename, content in contents:
+        digest, path = store_blob(content)
+        collection_id = collection_id_for(digest)
+
+        # Known document: its collection is shared, nothing to extract or embed
+        if collection_exists(collection_id):
+            collections.append({"filename": filename, "collection_id": collection_id, "status": "ready"})
+            continue
+
         try:
-            collection_id = create_collection([{
-                "filename": file.filename,
-                "content": content
-            }])
-            collections.append({
-                "filename": file.filename,
-                "collection_id": collection_id
-            })
+            # The same document may already be queued by an earlier upload of this user
+            job = ingestion_queue.active_job(db, kind="rag", file_path=path, user_id=owner) or ingestion_queue.submit(
+                db,
+                kind="rag",
+                filename=filename,
+                file_path=path,
+                user_id=owner,
+                payload={"collection_id": collection_id},
+            )
         except Exception as e:
-            raise HTTPException(500, f"Failed to process {file.filename}: {str(e)}")
-    
+            db.rollback()
+            raise HTTPException(500, f"Failed to queue {filename}: {str(e)}")
+        collections.append({
+            "filename": filename,
+            "collection_id": collection_id,
+            "status": "queued",
+            **_job_links(job.id),
+        })
+
+    # One group per upload so a chat turn can search all of these files at once
+    group = create_group([c["collection_id"] for c in collections])
+
     return {
-        "status": "success",
+        "status": "queued" if any(c["status"] == "queued" for c in collections) else "success",
         "collections": collections,
-        "message": "Documents processed one by one. Use each collection_id for queries.",
+        "collection_group": group,
+        "message": "Documents are being indexed in the background. Each collection_id (or the collection_group) is searchable once its job has succeeded.",
         "example": "Try: 'What is the main topic?' or 'Summarize page 2'"
     }
 
 
+# === INGESTION JOB STATUS ===
+def _job_visible_to(job: dict, current_user: Optional[dict]) -> bool:
+    # Guest jobs are only reachable through their (random) job id
+    if job["user_id"] in (None, "guest"):
+        return True
+    return bool(current_user) and current_user["id"] == job["user_id"]
+
+
+@router.get("/jobs/{job_id}")
+async def get_ingestion_job(
+    job_id: str,
+    current_user: dict = Depends(get_current_user_optional),
+):
+    """Poll an ingestion job: status, current stage, progress, result or error."""
+    job = await asyncio.to_thread(ingestion_queue.get, job_id)
+    if job is None or not _job_visible_to(job, current_user):
+        raise HTTPException(404, "Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_ingestion_job(
+    job_id: str,
+    current_user: dict = Depends(get_current_user_optional),
+):
+    """Server-sent events: one event per status / stage / progress change, until the job finishes."""
+    job = await asyncio.to_thread(ingestion_queue.get, job_id)
+    if job is None or not _job_visible_to(job, current_user):
+        raise HTTPException(404, "Job not found")
+
+    async def event_stream():
+        async for state in ingestion_queue.watch(job_id):
+            yield f"data: {json.dumps(state)}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @router.post("/analyze-text")
 async def analyze_text_endpoint(
     text: str = Form(...),
@@ -372,25 +584,17 @@ Answer accurately and directly:"""
 
 Include key points and important details."""
 
-        response = requests.post(
-            f"{OLLAMA_HOST}/api/generate",
-            json={
-                "model": LLM_MODEL,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.3,
-                    "num_predict": -1,
-                    "num_ctx": 8192,
-                }
+        result = await ollama.generate(
+            LLM_MODEL,
+            prompt,
+            options={
+                "temperature": 0.3,
+                "num_predict": -1,
+                "num_ctx": 8192,
             },
-            timeout=60
+            timeout=60,
         )
         
-        if response.status_code != 200:
-            raise Exception("Ollama API error")
-        
-        result = response.json()
         answer = result.get("response", "No response generated")
         
         return {
@@ -398,5 +602,7 @@ Include key points and important details."""
             "answer": answer
         }
     
+    except GenerationOverloaded as e:
+        raise HTTPException(503, str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(500, f"Analysis failed: {str(e)}")
\ No newline at end of file
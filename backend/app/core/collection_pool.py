@@ -0,0 +1,206 @@
+# backend/app/core/collection_pool.py
+"""
+Pool of long-lived, reference-counted collection handles (used by core/rag.py).
+
+Opening a persisted collection means mapping its files and, for large
+ones, loading the HNSW index from disk; doing that per question made every
+RAG turn a cold open. The pool keeps opened handles in an LRU bounded by RAG_POOL_MAX_HANDLES
+and RAG_POOL_MAX_MB (on-disk size as the memory estimate), so repeat
+queries against the same document set cost one vector search.
+
+    with pool.acquire(collection_id) as collection:
+        collection.search(...)
+
+Handles are reference counted: eviction only closes idle handles, and
+invalidate() (used before deleting a collection) blocks new checkouts,
+waits for in-flight queries to release the handle and closes it, so the
+files can be removed without sleeping and retrying. A per-collection lock
+makes concurrent first queries share one cold open.
+"""
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+RAG_POOL_MAX_HANDLES = int(os.getenv("RAG_POOL_MAX_HANDLES", "16"))
+RAG_POOL_MAX_MB = float(os.getenv("RAG_POOL_MAX_MB", "512"))
+
+
+class CollectionClosingError(LookupError):
+    """The collection is being closed (e.g. deleted) and cannot be checked out."""
+
+
+class _Handle:
+    __slots__ = ("key", "value", "size", "refs", "closing")
+
+    def __init__(self, key: str, value: Any, size: int):
+        self.key = key
+        self.value = value
+        self.size = size
+        self.refs = 0
+        self.closing = False
+
+
+def dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class CollectionPool:
+    def __init__(
+        self,
+        opener: Callable[[str], Any],
+        closer: Callable[[Any], None],
+        sizer: Optional[Callable[[str], int]] = None,
+        max_handles: int = RAG_POOL_MAX_HANDLES,
+        max_mb: float = RAG_POOL_MAX_MB,
+    ):
+        self._opener = opener
+        self._closer = closer
+        self._sizer = sizer
+        self.max_handles = max_handles
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+        self._entries: "OrderedDict[str, _Handle]" = OrderedDict()
+        self._open_locks: Dict[str, threading.Lock] = {}
+        self._cond = threading.Condition()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    # ------------------------------------------------------------
+    # Checkout / release
+    # ------------------------------------------------------------
+    @contextmanager
+    def acquire(self, key: str) -> Iterator[Any]:
+        handle = self._checkout(key)
+        try:
+            yield handle.value
+        finally:
+            self._release(handle)
+
+    def _take_locked(self, key: str) -> Optional[_Handle]:
+        handle = self._entries.get(key)
+        if handle is None:
+            return None
+        if handle.closing:
+            raise CollectionClosingError(key)
+        handle.refs += 1
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return handle
+
+    def _checkout(self, key: str) -> _Handle:
+        with self._cond:
+            handle = self._take_locked(key)
+            if handle is not None:
+                return handle
+            open_lock = self._open_locks.setdefault(key, threading.Lock())
+
+        # One cold open per collection; other collections are not blocked
+        with open_lock:
+            with self._cond:
+                handle = self._take_locked(key)
+                if handle is not None:
+                    return handle
+
+            value = self._opener(key)
+            size = self._sizer(key) if self._sizer else 0
+
+            with self._cond:
+                handle = _Handle(key, value, size)
+                handle.refs = 1
+                self._entries[key] = handle
+                self.misses += 1
+                victims = self._evict_locked()
+
+        self._close_all(victims)
+        return handle
+
+    def _release(self, handle: _Handle) -> None:
+        with self._cond:
+            handle.refs -= 1
+            if handle.refs == 0:
+                self._cond.notify_all()
+
+    def put(self, key: str, value: Any) -> None:
+        """Register an already-open handle (e.g. right after creating the collection)."""
+        size = self._sizer(key) if self._sizer else 0
+        with self._cond:
+            old = self._entries.pop(key, None)
+            self._entries[key] = _Handle(key, value, size)
+            victims = self._evict_locked()
+        if old is not None and old.refs == 0:
+            victims.append(old)
+        self._close_all(victims)
+
+    # ------------------------------------------------------------
+    # Eviction / close
+    # ------------------------------------------------------------
+    def _evict_locked(self) -> List[_Handle]:
+        """Pick idle LRU handles until the pool is within its caps (caller holds the condition)."""
+        victims = []
+        total = sum(h.size for h in self._entries.values())
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_handles and total <= self.max_bytes:
+                break
+            handle = self._entries[key]
+            if handle.refs or handle.closing:
+                continue  # in use: stays over the cap until released
+            del self._entries[key]
+            total -= handle.size
+            victims.append(handle)
+            self.evictions += 1
+        return victims
+
+    def _close_all(self, handles: List[_Handle]) -> None:
+        for handle in handles:
+            try:
+                self._closer(handle.value)
+            except Exception as e:
+                print(f"⚠️ Closing collection {handle.key} failed: {e}")
+
+    def invalidate(self, key: str, timeout: Optional[float] = 30.0) -> bool:
+        """
+        Close the handle for `key`: new checkouts fail, in-flight ones are
+        waited for. Returns False if they did not finish within `timeout`.
+        """
+        with self._cond:
+            handle = self._entries.get(key)
+            if handle is None:
+                return True
+            handle.closing = True
+            if not self._cond.wait_for(lambda: handle.refs == 0, timeout=timeout):
+                handle.closing = False
+                return False
+            del self._entries[key]
+            self._open_locks.pop(key, None)
+        self._close_all([handle])
+        return True
+
+    def close_all(self) -> None:
+        with self._cond:
+            handles = [h for h in self._entries.values() if h.refs == 0]
+            for h in handles:
+                del self._entries[h.key]
+        self._close_all(handles)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "open": len(self._entries),
+                "in_use": sum(1 for h in self._entries.values() if h.refs),
+                "bytes": sum(h.size for h in self._entries.values()),
+                "max_handles": self.max_handles,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,236 @@
+# backend/app/core/embedding_scheduler.py
+"""
+Micro-batching embedding scheduler.
+
+Concurrent single-query encodes (retrieve_context, retrieve_knowledge,
+query_collection, ...) are merged into one forward pass when they arrive
+within EMBED_BATCH_WINDOW_MS of each other. Two lanes:
+
+    interactive → chat queries, always served first
+    bulk        → upload / ingestion batches, split into EMBED_BULK_CHUNK
+                  pieces so an interactive query never waits behind a
+                  whole document
+
+With EMBED_SCHEDULER_MODE=process the forward pass runs in a child process
+that owns its own model, so torch does not contend with the event loop for
+the GIL. Batch sizes and queue waits are recorded as histograms.
+"""
+import collections
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Deque, Dict, List, Optional, Sequence
+
+import numpy as np
+
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "3"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "64"))
+EMBED_BULK_CHUNK = int(os.getenv("EMBED_BULK_CHUNK", "64"))
+EMBED_SCHEDULER_MODE = os.getenv("EMBED_SCHEDULER_MODE", "thread").lower()  # thread | process
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+QUEUE_WAIT_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+
+# ================================================================
+# Histogram
+# ================================================================
+class Histogram:
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += value
+        self.n += 1
+
+    def snapshot(self) -> Dict:
+        labels = [f"<={b:g}" for b in self.bounds] + [f">{self.bounds[-1]:g}"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.n,
+            "mean": round(self.total / self.n, 3) if self.n else 0.0,
+        }
+
+
+# ================================================================
+# Child-process encoder (EMBED_SCHEDULER_MODE=process)
+# ================================================================
+_child_service = None
+
+
+def _child_init() -> None:
+    global _child_service
+    from app.core.embeddings import EmbeddingService
+
+    _child_service = EmbeddingService()
+    _child_service.warm_up()  # load once per child
+
+
+def _child_encode(texts: List[str]) -> np.ndarray:
+    return _child_service.encode_direct(texts, batch_size=len(texts) or 1)
+
+
+# ================================================================
+# Scheduler
+# ================================================================
+class _Request:
+    __slots__ = ("texts", "future", "enqueued")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class EmbeddingScheduler:
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        window_ms: float = EMBED_BATCH_WINDOW_MS,
+        max_batch: int = EMBED_MAX_BATCH,
+        bulk_chunk: int = EMBED_BULK_CHUNK,
+        mode: str = EMBED_SCHEDULER_MODE,
+    ):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.bulk_chunk = bulk_chunk
+        self.mode = mode
+
+        self._encode_fn = encode_fn
+        self._pool: Optional[ProcessPoolExecutor] = None
+        if mode == "process":
+            self._pool = ProcessPoolExecutor(max_workers=1, initializer=_child_init)
+
+        self._lanes: Dict[str, Deque[_Request]] = {
+            LANE_INTERACTIVE: collections.deque(),
+            LANE_BULK: collections.deque(),
+        }
+        self._cond = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self.batch_sizes = {lane: Histogram(BATCH_SIZE_BUCKETS) for lane in self._lanes}
+        self.queue_wait_ms = {lane: Histogram(QUEUE_WAIT_BUCKETS_MS) for lane in self._lanes}
+
+        self._worker = threading.Thread(target=self._run, name="embedding-scheduler", daemon=True)
+        self._worker.start()
+
+    # ------------------------------------------------------------
+    # Submission
+    # ------------------------------------------------------------
+    def submit(self, texts: Sequence[str], lane: str = LANE_INTERACTIVE) -> Future:
+        texts = list(texts)
+        if lane == LANE_BULK and len(texts) > self.bulk_chunk:
+            # Chunk bulk work so interactive requests can cut in between pieces
+            parts = [self._enqueue(texts[i:i + self.bulk_chunk], lane) for i in range(0, len(texts), self.bulk_chunk)]
+            return _gather(parts)
+        return self._enqueue(texts, lane)
+
+    def encode(self, texts: Sequence[str], lane: str = LANE_INTERACTIVE) -> np.ndarray:
+        return self.submit(texts, lane).result()
+
+    def _enqueue(self, texts: List[str], lane: str) -> Future:
+        req = _Request(texts)
+        with self._cond:
+            self._lanes[lane].append(req)
+            self._cond.notify()
+        return req.future
+
+    # ------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------
+    def _next_batch(self):
+        with self._cond:
+            while not self._lanes[LANE_INTERACTIVE] and not self._lanes[LANE_BULK]:
+                self._cond.wait()
+
+            interactive = self._lanes[LANE_INTERACTIVE]
+            if not interactive:
+                return LANE_BULK, [self._lanes[LANE_BULK].popleft()]
+
+            # Hold the window open so concurrent queries share one forward pass
+            deadline = interactive[0].enqueued + self.window
+            while sum(len(r.texts) for r in interactive) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch, size = [], 0
+            while interactive and (not batch or size + len(interactive[0].texts) <= self.max_batch):
+                req = interactive.popleft()
+                batch.append(req)
+                size += len(req.texts)
+            return LANE_INTERACTIVE, batch
+
+    def _run(self) -> None:
+        while True:
+            lane, batch = self._next_batch()
+            started = time.perf_counter()
+            texts = [t for req in batch for t in req.texts]
+
+            with self._stats_lock:
+                self.batch_sizes[lane].observe(len(texts))
+                for req in batch:
+                    self.queue_wait_ms[lane].observe((started - req.enqueued) * 1000)
+
+            try:
+                if self._pool is not None:
+                    vecs = self._pool.submit(_child_encode, texts).result()
+                else:
+                    vecs = self._encode_fn(texts)
+            except Exception as e:
+                for req in batch:
+                    req.future.set_exception(e)
+                continue
+
+            pos = 0
+            for req in batch:
+                req.future.set_result(vecs[pos:pos + len(req.texts)])
+                pos += len(req.texts)
+
+    # ------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "mode": self.mode,
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+                "queued": {lane: len(q) for lane, q in self._lanes.items()},
+                "batch_size": {lane: h.snapshot() for lane, h in self.batch_sizes.items()},
+                "queue_wait_ms": {lane: h.snapshot() for lane, h in self.queue_wait_ms.items()},
+            }
+
+
+def _gather(parts: List[Future]) -> Future:
+    """One future that resolves to the stacked results of several futures."""
+    out: Future = Future()
+    remaining = [len(parts)]
+    lock = threading.Lock()
+
+    def _done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        try:
+            out.set_result(np.concatenate([p.result() for p in parts]))
+        except Exception as e:
+            out.set_exception(e)
+
+    for p in parts:
+        p.add_done_callback(_done)
+    return out
@@ -0,0 +1,300 @@
+# backend/app/core/embeddings.py
+"""
+Shared embedding service.
+
+One all-MiniLM-L6-v2 instance per process, used by the knowledge/file
+vector store (core/vector.py), the dataset store (embed_dataset.py) and the
+Chroma adapter (core/rag.py). The model is loaded lazily on first use, so
+importing this module is cheap.
+
+Encodes go through the micro-batching scheduler (core/embedding_scheduler.py)
+unless EMBED_MICROBATCH=false: queries take the interactive lane, document
+batches the bulk lane. Query vectors are memoized in a bounded LRU/TTL cache
+keyed by normalized query text, so one chat turn that searches the file
+store, the knowledge store and a collection encodes its question once.
+
+EMBEDDING_BACKEND selects the forward pass: "torch" (sentence-transformers)
+or "onnx" (int8 ONNX Runtime, see core/onnx_embeddings.py). Both produce the
+same normalized 384-d vectors.
+"""
+import asyncio
+import collections
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "cpu")
+MODEL_CACHE_DIR = os.path.join(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")), "model_cache")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()  # torch | onnx
+EMBEDDING_ONNX_VERIFY = os.getenv("EMBEDDING_ONNX_VERIFY", "false").lower() == "true"
+EMBED_MICROBATCH = os.getenv("EMBED_MICROBATCH", "true").lower() == "true"
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "4096"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+
+_WS_RE = re.compile(r"\s+")
+
+
+# =====================================================
+# QUERY EMBEDDING CACHE
+# =====================================================
+def normalize_query(text: str) -> str:
+    # all-MiniLM-L6-v2 is uncased, so case and spacing do not change the vector
+    return _WS_RE.sub(" ", text).strip().lower()
+
+
+class QueryEmbeddingCache:
+    """Thread-safe LRU with a TTL: normalized query text → embedding vector."""
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "collections.OrderedDict[str, tuple]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vec: np.ndarray) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (vec, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class EmbeddingService:
+    def __init__(
+        self,
+        model_name: str = MODEL_NAME,
+        device: str = EMBEDDING_DEVICE,
+        cache_folder: str = MODEL_CACHE_DIR,
+        backend: str = EMBEDDING_BACKEND,
+    ):
+        self.model_name = model_name
+        self.device = device
+        self.cache_folder = cache_folder
+        self.backend = backend
+        self._model = None
+        self._onnx = None
+        self._lock = threading.RLock()
+        self._scheduler = None
+        self.query_cache = QueryEmbeddingCache()
+
+    # ------------------------------------------------------------
+    # Model ownership
+    # ------------------------------------------------------------
+    @property
+    def model(self):
+        """Thread-safe lazy load; only the first caller pays the cold start."""
+        if self._model is not None:
+            return self._model
+
+        with self._lock:
+            if self._model is None:
+                if os.getenv("ENV", "development") != "production":
+                    print(f"🔥 Loading embedding model ({self.model_name})...")
+
+                from sentence_transformers import SentenceTransformer
+
+                self._model = SentenceTransformer(
+                    self.model_name,
+                    device=self.device,
+                    cache_folder=self.cache_folder,
+                )
+
+                if os.getenv("ENV", "development") != "production":
+                    print("✅ Embedding model loaded")
+
+        return self._model
+
+    @property
+    def onnx(self):
+        """ONNX Runtime encoder (EMBEDDING_BACKEND=onnx), exported and quantized on first use."""
+        if self._onnx is not None:
+            return self._onnx
+
+        with self._lock:
+            if self._onnx is None:
+                from app.core.onnx_embeddings import OnnxEncoder
+
+                encoder = OnnxEncoder(self.model_name, self.cache_folder)
+                print(f"✅ ONNX embedding backend loaded ({os.path.basename(encoder.path)})")
+
+                if EMBEDDING_ONNX_VERIFY:
+                    from app.core.onnx_embeddings import parity_check
+
+                    report = parity_check(self, encoder)
+                    if not report["ok"]:
+                        print(f"⚠️ ONNX cosine drift {report['max_drift']} too high → falling back to torch")
+                        self.backend = "torch"
+                self._onnx = encoder
+
+        return self._onnx
+
+    def warm_up(self) -> None:
+        """Load whichever backend will serve encodes."""
+        if self.backend == "onnx":
+            self.onnx
+        else:
+            self.model
+
+    @property
+    def dim(self) -> int:
+        if self.backend == "onnx":
+            return self.onnx.dim
+        return int(self.model.get_sentence_embedding_dimension())
+
+    @property
+    def scheduler(self):
+        """Micro-batching scheduler, started on first use (None when disabled)."""
+        if not EMBED_MICROBATCH:
+            return None
+        if self._scheduler is None:
+            with self._lock:
+                if self._scheduler is None:
+                    from app.core.embedding_scheduler import EmbeddingScheduler
+
+                    self._scheduler = EmbeddingScheduler(self._encode_batch)
+        return self._scheduler
+
+    def scheduler_stats(self) -> Dict:
+        return self._scheduler.stats() if self._scheduler is not None else {"enabled": EMBED_MICROBATCH}
+
+    def stats(self) -> Dict:
+        return {"scheduler": self.scheduler_stats(), "query_cache": self.query_cache.stats()}
+
+    # ------------------------------------------------------------
+    # Sync API
+    # ------------------------------------------------------------
+    def encode(
+        self,
+        texts: Sequence[str],
+        batch_size: int = 32,
+        normalize: bool = True,
+        show_progress_bar: bool = False,
+        lane: str = "bulk",
+    ) -> np.ndarray:
+        """Encode texts → float32 matrix (len(texts) x dim), L2-normalized by default."""
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+
+        scheduler = self.scheduler
+        if scheduler is not None and normalize and not show_progress_bar:
+            return scheduler.encode(texts, lane=lane)
+        return self.encode_direct(texts, batch_size, normalize, show_progress_bar)
+
+    def encode_direct(
+        self,
+        texts: Sequence[str],
+        batch_size: int = 32,
+        normalize: bool = True,
+        show_progress_bar: bool = False,
+    ) -> np.ndarray:
+        """Forward pass on the calling thread, bypassing the scheduler."""
+        if self.backend == "onnx":
+            return self.onnx.encode(list(texts), batch_size=batch_size, normalize=normalize)
+
+        vecs = self.model.encode(
+            list(texts),
+            batch_size=batch_size,
+            show_progress_bar=show_progress_bar,
+            normalize_embeddings=normalize,
+            convert_to_numpy=True,
+        )
+        return np.asarray(vecs, dtype=np.float32)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        # Scheduler batches are already sized; run them as one forward pass
+        return self.encode_direct(texts, batch_size=max(1, len(texts)))
+
+    def encode_query(self, text: str) -> np.ndarray:
+        """Encode one query → float32 vector (dim,), served from the query cache when possible."""
+        key = normalize_query(text)
+        vec = self.query_cache.get(key)
+        if vec is None:
+            vec = self._encode_query_key(key)
+        # Callers may reshape or write into the result; keep the cached copy intact
+        return vec.copy()
+
+    def _encode_query_key(self, key: str) -> np.ndarray:
+        vec = self.encode([key], lane="interactive")[0]
+        self.query_cache.put(key, vec)
+        return vec
+
+    # ------------------------------------------------------------
+    # Async API (runs the forward pass off the event loop)
+    # ------------------------------------------------------------
+    async def aencode(self, texts: Sequence[str], **kwargs) -> np.ndarray:
+        return await asyncio.to_thread(self.encode, texts, **kwargs)
+
+    async def aencode_query(self, text: str) -> np.ndarray:
+        key = normalize_query(text)
+        vec = self.query_cache.get(key)
+        if vec is None:
+            vec = await asyncio.to_thread(self._encode_query_key, key)
+        return vec.copy()
+
+
+# =====================================================
+# PROCESS-WIDE INSTANCE
+# =====================================================
+_service: Optional[EmbeddingService] = None
+_service_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = EmbeddingService()
+    return _service
+
+
+def set_embedding_service(service: EmbeddingService) -> None:
+    """Swap the process-wide service (e.g. a different backend or a test double)."""
+    global _service
+    with _service_lock:
+        _service = service
+
+
+__all__: List[str] = [
+    "EmbeddingService",
+    "QueryEmbeddingCache",
+    "get_embedding_service",
+    "set_embedding_service",
+]
@@ -0,0 +1,282 @@
+# backend/app/core/generation_scheduler.py
+"""
+Admission control and priority queueing for Ollama generations.
+
+Every generating request (chat streams, titles, document analysis, the
+OpenAI-compatible API) takes a slot before it reaches Ollama:
+
+    async with generation_scheduler.slot(model, PRIORITY_INTERACTIVE, user_id):
+        ...  # stream from Ollama
+
+Slots are limited per model (GEN_SLOTS_PER_MODEL, overrides in
+GEN_MODEL_SLOTS="qwen2.5:7b=2,gemma3:4b=4") and overall (GEN_MAX_ACTIVE),
+so a burst queues here instead of making Ollama time-slice every request.
+A freed slot goes to the highest priority class with waiters:
+
+    interactive → chat turns a user is watching
+    api         → /v1/chat/completions
+    background  → titles, upload analysis
+
+Within a class users are served round-robin, so one user's burst cannot
+starve the others; a waiter older than GEN_MAX_STARVATION seconds is
+served before higher classes. Queues are bounded per model and class
+(GEN_QUEUE_DEPTH_*): a full queue rejects at once with GenerationOverloaded
+and a Retry-After estimate (routes answer 503), as does a wait longer than
+the class' GEN_QUEUE_TIMEOUT_*. Queue waits are recorded as histograms.
+
+All state lives on the event loop (the Ollama client runs there), so no
+locks are needed.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from app.core.embedding_scheduler import Histogram
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_API = "api"
+PRIORITY_BACKGROUND = "background"
+PRIORITIES = (PRIORITY_INTERACTIVE, PRIORITY_API, PRIORITY_BACKGROUND)  # highest first
+
+GEN_SLOTS_PER_MODEL = int(os.getenv("GEN_SLOTS_PER_MODEL", "2"))
+GEN_MODEL_SLOTS = os.getenv("GEN_MODEL_SLOTS", "")
+GEN_MAX_ACTIVE = int(os.getenv("GEN_MAX_ACTIVE", "4"))
+GEN_MAX_STARVATION = float(os.getenv("GEN_MAX_STARVATION", "30"))
+
+QUEUE_DEPTH = {
+    PRIORITY_INTERACTIVE: int(os.getenv("GEN_QUEUE_DEPTH_INTERACTIVE", "32")),
+    PRIORITY_API: int(os.getenv("GEN_QUEUE_DEPTH_API", "16")),
+    PRIORITY_BACKGROUND: int(os.getenv("GEN_QUEUE_DEPTH_BACKGROUND", "128")),
+}
+QUEUE_TIMEOUT = {
+    PRIORITY_INTERACTIVE: float(os.getenv("GEN_QUEUE_TIMEOUT_INTERACTIVE", "60")),
+    PRIORITY_API: float(os.getenv("GEN_QUEUE_TIMEOUT_API", "120")),
+    PRIORITY_BACKGROUND: float(os.getenv("GEN_QUEUE_TIMEOUT_BACKGROUND", "900")),
+}
+
+QUEUE_WAIT_BUCKETS_S = (0.01, 0.1, 0.5, 1, 2, 5, 10, 30, 60, 120)
+# Service time assumed for Retry-After before any generation has finished
+DEFAULT_SERVICE_SECONDS = 20.0
+
+
+class GenerationOverloaded(RuntimeError):
+    """The generation queue is full (or the wait timed out); retry after `retry_after` seconds."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _parse_model_slots(spec: str) -> Dict[str, int]:
+    slots = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, _, n = item.rpartition("=")
+            slots[name.strip()] = max(1, int(n))
+    return slots
+
+
+class _Waiter:
+    __slots__ = ("future", "model", "priority", "user", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, model: str, priority: str, user: str):
+        self.future = future
+        self.model = model
+        self.priority = priority
+        self.user = user
+        self.enqueued_at = time.monotonic()
+
+
+class _ModelQueue:
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.active = 0
+        # priority → user → FIFO of that user's waiters (OrderedDict order = round-robin turn)
+        self.classes: Dict[str, "OrderedDict[str, Deque[_Waiter]]"] = {p: OrderedDict() for p in PRIORITIES}
+        self.depth = {p: 0 for p in PRIORITIES}
+
+    def push(self, waiter: _Waiter) -> None:
+        self.classes[waiter.priority].setdefault(waiter.user, deque()).append(waiter)
+        self.depth[waiter.priority] += 1
+
+    def remove(self, waiter: _Waiter) -> bool:
+        users = self.classes[waiter.priority]
+        queue = users.get(waiter.user)
+        if queue is None or waiter not in queue:
+            return False
+        queue.remove(waiter)
+        if not queue:
+            del users[waiter.user]
+        self.depth[waiter.priority] -= 1
+        return True
+
+    def head(self, now: float) -> Optional[_Waiter]:
+        """Next waiter: a starving one first, else the current turn of the highest class."""
+        best = None
+        for priority in PRIORITIES:
+            users = self.classes[priority]
+            if not users:
+                continue
+            first = next(iter(users.values()))[0]
+            if best is None:
+                best = first
+            elif now - first.enqueued_at > GEN_MAX_STARVATION and first.enqueued_at < best.enqueued_at:
+                best = first
+        return best
+
+    def pop(self, waiter: _Waiter) -> None:
+        users = self.classes[waiter.priority]
+        queue = users[waiter.user]
+        queue.popleft()
+        if queue:
+            users.move_to_end(waiter.user)  # user's turn is over
+        else:
+            del users[waiter.user]
+        self.depth[waiter.priority] -= 1
+
+
+class GenerationScheduler:
+    def __init__(
+        self,
+        slots_per_model: int = GEN_SLOTS_PER_MODEL,
+        model_slots: Optional[Dict[str, int]] = None,
+        max_active: int = GEN_MAX_ACTIVE,
+    ):
+        self.slots_per_model = slots_per_model
+        self.model_slots = model_slots if model_slots is not None else _parse_model_slots(GEN_MODEL_SLOTS)
+        self.max_active = max_active
+        self._queues: Dict[str, _ModelQueue] = {}
+        self._active = 0
+
+        self.queue_wait_s = {p: Histogram(QUEUE_WAIT_BUCKETS_S) for p in PRIORITIES}
+        self.admitted = {p: 0 for p in PRIORITIES}
+        self.shed = {p: 0 for p in PRIORITIES}
+        self.timed_out = {p: 0 for p in PRIORITIES}
+        self._service_s: Deque[float] = deque(maxlen=50)
+
+    def _queue(self, model: str) -> _ModelQueue:
+        mq = self._queues.get(model)
+        if mq is None:
+            mq = self._queues[model] = _ModelQueue(self.model_slots.get(model, self.slots_per_model))
+        return mq
+
+    # ------------------------------------------------------------
+    # Admission
+    # ------------------------------------------------------------
+    def retry_after(self, model: str) -> int:
+        """Seconds until the queue ahead of a new request has likely drained."""
+        mq = self._queues.get(model)
+        queued = sum(mq.depth.values()) if mq else 0
+        service = sum(self._service_s) / len(self._service_s) if self._service_s else DEFAULT_SERVICE_SECONDS
+        slots = mq.slots if mq else self.slots_per_model
+        return max(1, math.ceil((queued + 1) * service / slots))
+
+    def check(self, model: str, priority: str) -> None:
+        """Raise GenerationOverloaded if a request of this class would be rejected right now."""
+        mq = self._queues.get(model)
+        if mq is not None and mq.depth[priority] >= QUEUE_DEPTH[priority]:
+            self.shed[priority] += 1
+            raise GenerationOverloaded(
+                f"Too many queued {priority} requests for {model}", self.retry_after(model),
+            )
+
+    @asynccontextmanager
+    async def slot(self, model: str, priority: str = PRIORITY_INTERACTIVE, user: Optional[str] = None) -> AsyncIterator[None]:
+        if priority not in QUEUE_DEPTH:
+            raise ValueError(f"Unknown priority '{priority}'. Use one of: {', '.join(PRIORITIES)}")
+        self.check(model, priority)
+
+        mq = self._queue(model)
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), model, priority, user or "anonymous")
+        mq.push(waiter)
+        self._dispatch()
+
+        # asyncio.wait, not wait_for: on 3.11 wait_for swallows a cancel that races the grant
+        try:
+            done, _ = await asyncio.wait({waiter.future}, timeout=QUEUE_TIMEOUT[priority])
+        except asyncio.CancelledError:
+            # Client went away while queued (or right as the slot was granted)
+            if not self._abandon(waiter):
+                self._release(waiter, 0.0)
+            raise
+        if not done and self._abandon(waiter):
+            self.timed_out[priority] += 1
+            raise GenerationOverloaded(
+                f"Waited {QUEUE_TIMEOUT[priority]:g}s for a {model} slot", self.retry_after(model),
+            )
+
+        wait = time.monotonic() - waiter.enqueued_at
+        self.queue_wait_s[priority].observe(wait)
+        self.admitted[priority] += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(waiter, time.monotonic() - started)
+
+    def _abandon(self, waiter: _Waiter) -> bool:
+        """Take a waiter out of its queue; False if it had already been granted a slot."""
+        if self._queue(waiter.model).remove(waiter):
+            waiter.future.cancel()
+            return True
+        return False
+
+    # ------------------------------------------------------------
+    # Dispatch
+    # ------------------------------------------------------------
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        while self._active < self.max_active:
+            best = None
+            for mq in self._queues.values():
+                if mq.active >= mq.slots:
+                    continue
+                head = mq.head(now)
+                if head is None:
+                    continue
+                rank = (PRIORITIES.index(head.priority), head.enqueued_at)
+                if now - head.enqueued_at > GEN_MAX_STARVATION:
+                    rank = (-1, head.enqueued_at)
+                if best is None or rank < best[0]:
+                    best = (rank, mq, head)
+            if best is None:
+                return
+
+            _, mq, waiter = best
+            mq.pop(waiter)
+            mq.active += 1
+            self._active += 1
+            waiter.future.set_result(None)
+
+    def _release(self, waiter: _Waiter, service_seconds: float) -> None:
+        mq = self._queue(waiter.model)
+        mq.active -= 1
+        self._active -= 1
+        if service_seconds > 0:
+            self._service_s.append(service_seconds)
+        self._dispatch()
+
+    # ------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------
+    def stats(self) -> Dict:
+        return {
+            "max_active": self.max_active,
+            "active": self._active,
+            "models": {
+                model: {"slots": mq.slots, "active": mq.active, "queued": dict(mq.depth)}
+                for model, mq in self._queues.items()
+            },
+            "admitted": dict(self.admitted),
+            "shed": dict(self.shed),
+            "timed_out": dict(self.timed_out),
+            "queue_wait_s": {p: h.snapshot() for p, h in self.queue_wait_s.items()},
+            "mean_service_s": round(sum(self._service_s) / len(self._service_s), 3) if self._service_s else None,
+        }
+
+
+generation_scheduler = GenerationScheduler()
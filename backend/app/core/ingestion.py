@@ -0,0 +1,374 @@
+# backend/app/core/ingestion.py
+"""
+Persistent background ingestion for /files/upload and /files/upload-rag.
+
+An upload is saved to disk and recorded as an IngestionJob row; the request
+returns the job id at once. A pool of INGEST_WORKERS threads claims queued
+rows (SELECT ... FOR UPDATE SKIP LOCKED, so several app processes can share
+the table) and runs the handler registered for the job's kind, off the
+event loop. Handlers report progress per stage:
+
+    upload: extract → chunk → embed → analyze
+    rag:    extract → chunk → embed → index
+
+Progress is written to the row, so GET /files/jobs/{id} (polling) and
+/files/jobs/{id}/events (SSE) work from any worker process.
+
+Failures are retried with exponential backoff up to INGEST_MAX_ATTEMPTS
+(PermanentJobError fails at once). Running jobs are heartbeated; one whose
+heartbeat is older than INGEST_STALE_SECONDS (its process died or was
+restarted) is claimed again, so queued and interrupted work survives
+restarts. Every row update is fenced on the attempt number, so a worker
+that lost its job cannot overwrite the new owner's progress.
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Callable, Dict, Optional, Set, Tuple
+from uuid import UUID
+
+from sqlalchemy import and_, or_
+
+from app.db.database import SessionLocal
+from app.db.models import IngestionJob
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+INGEST_RETRY_BASE_SECONDS = float(os.getenv("INGEST_RETRY_BASE_SECONDS", "10"))
+INGEST_POLL_SECONDS = float(os.getenv("INGEST_POLL_SECONDS", "2.0"))
+INGEST_HEARTBEAT_SECONDS = float(os.getenv("INGEST_HEARTBEAT_SECONDS", "15"))
+INGEST_STALE_SECONDS = float(os.getenv("INGEST_STALE_SECONDS", "60"))
+INGEST_EVENT_INTERVAL = float(os.getenv("INGEST_EVENT_INTERVAL", "0.5"))
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+# Progress writes are throttled per job; stage changes are always written
+_PROGRESS_MIN_INTERVAL = 0.5
+
+
+class PermanentJobError(Exception):
+    """Retrying cannot help (unsupported file, no extractable text, ...)."""
+
+
+class JobLostError(Exception):
+    """The job was reclaimed by another worker (this one missed its heartbeats)."""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_id(job_id) -> Optional[UUID]:
+    try:
+        return job_id if isinstance(job_id, UUID) else UUID(str(job_id))
+    except ValueError:
+        return None
+
+
+def job_to_dict(job: IngestionJob) -> Dict:
+    return {
+        "job_id": str(job.id),
+        "kind": job.kind,
+        "user_id": job.user_id,
+        "filename": job.filename,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": round(float(job.progress or 0.0), 3),
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "error": job.error,
+        "result": json.loads(job.result) if job.result else None,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# ================================================================
+# Job context (handed to handlers)
+# ================================================================
+class JobContext:
+    def __init__(self, queue: "IngestionQueue", job_id: UUID, attempt: int):
+        self._queue = queue
+        self.job_id = job_id
+        self.attempt = attempt
+        self._stage: Optional[str] = None
+        self._last_write = 0.0
+
+    def progress(self, stage: str, fraction: float = 0.0) -> None:
+        """Record the current stage and how far into it the job is (0-1)."""
+        now = time.monotonic()
+        if stage == self._stage and fraction < 1.0 and now - self._last_write < _PROGRESS_MIN_INTERVAL:
+            return
+        self._stage, self._last_write = stage, now
+        if not self._queue._update(self.job_id, self.attempt, stage=stage, progress=min(max(fraction, 0.0), 1.0)):
+            raise JobLostError(str(self.job_id))
+
+
+# ================================================================
+# Queue + worker pool
+# ================================================================
+class IngestionQueue:
+    def __init__(self, workers: int = INGEST_WORKERS):
+        self.workers = workers
+        self._handlers: Dict[str, Callable[[Dict, JobContext], Dict]] = {}
+        self._threads = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Semaphore(0)
+        self._running: Set[Tuple[UUID, int]] = set()  # (job id, attempt) owned by this process
+        self._running_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    def register(self, kind: str, handler: Callable[[Dict, JobContext], Dict]) -> None:
+        """handler(job, ctx) → JSON-serializable result; runs on a worker thread."""
+        self._handlers[kind] = handler
+
+    # ------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------
+    def start(self) -> None:
+        with self._start_lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for i in range(self.workers):
+                t = threading.Thread(target=self._worker, name=f"ingest-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            hb = threading.Thread(target=self._heartbeat, name="ingest-heartbeat", daemon=True)
+            hb.start()
+            self._threads.append(hb)
+        print(f"📥 Ingestion workers started ({self.workers})")
+
+    def stop(self) -> None:
+        """Stop claiming new jobs. Jobs still running are reclaimed after restart."""
+        self._stop.set()
+        for _ in range(self.workers):
+            self._wakeup.release()
+        with self._start_lock:
+            self._threads = []
+
+    # ------------------------------------------------------------
+    # Producer side
+    # ------------------------------------------------------------
+    def submit(
+        self,
+        db,
+        kind: str,
+        filename: str,
+        file_path: str,
+        user_id: Optional[str] = None,
+        payload: Optional[Dict] = None,
+        max_attempts: int = INGEST_MAX_ATTEMPTS,
+    ) -> IngestionJob:
+        job = IngestionJob(
+            kind=kind,
+            user_id=user_id,
+            filename=filename,
+            file_path=file_path,
+            payload=json.dumps(payload or {}),
+            status="queued",
+            progress=0.0,
+            attempts=0,
+            run_after=_now(),
+            max_attempts=max_attempts,
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        self._wakeup.release()
+        return job
+
+    def active_job(self, db, kind: str, file_path: str, user_id: Optional[str] = None) -> Optional[IngestionJob]:
+        """Queued or running job of this kind for the same (content-addressed) file, if any."""
+        return (
+            db.query(IngestionJob)
+            .filter(
+                IngestionJob.kind == kind,
+                IngestionJob.file_path == file_path,
+                IngestionJob.user_id == user_id,
+                IngestionJob.status.in_(("queued", "running")),
+            )
+            .order_by(IngestionJob.created_at)
+            .first()
+        )
+
+    def get(self, job_id) -> Optional[Dict]:
+        uid = _parse_id(job_id)
+        if uid is None:
+            return None
+        db = SessionLocal()
+        try:
+            job = db.query(IngestionJob).filter(IngestionJob.id == uid).first()
+            return job_to_dict(job) if job else None
+        finally:
+            db.close()
+
+    async def watch(self, job_id) -> AsyncIterator[Dict]:
+        """Yield the job each time its status / stage / progress changes, until it finishes."""
+        last = None
+        # Start fast (cached documents finish in milliseconds), back off to the normal interval
+        interval = min(0.05, INGEST_EVENT_INTERVAL)
+        while True:
+            job = await asyncio.to_thread(self.get, job_id)
+            if job is None:
+                return
+            state = (job["status"], job["stage"], job["progress"], job["attempts"])
+            if state != last:
+                last = state
+                yield job
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, INGEST_EVENT_INTERVAL)
+
+    async def wait_for(self, job_id, timeout: float) -> Optional[Dict]:
+        """Last known state of the job after it finished or `timeout` seconds passed."""
+        job = None
+        try:
+            async def _follow():
+                nonlocal job
+                async for job in self.watch(job_id):
+                    pass
+            await asyncio.wait_for(_follow(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    # ------------------------------------------------------------
+    # Worker side
+    # ------------------------------------------------------------
+    def _worker(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"⚠️ Ingestion claim failed: {e}")
+                job = None
+            if job is None:
+                self._wakeup.acquire(timeout=INGEST_POLL_SECONDS)
+                continue
+            self._run(job)
+
+    def _claim(self) -> Optional[Dict]:
+        db = SessionLocal()
+        try:
+            now = _now()
+            job = (
+                db.query(IngestionJob)
+                .filter(or_(
+                    and_(IngestionJob.status == "queued", IngestionJob.run_after <= now),
+                    and_(
+                        IngestionJob.status == "running",
+                        IngestionJob.heartbeat_at < now - timedelta(seconds=INGEST_STALE_SECONDS),
+                    ),
+                ))
+                .order_by(IngestionJob.created_at)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if job is None:
+                db.rollback()
+                return None
+
+            values = {"status": "running", "attempts": (job.attempts or 0) + 1, "heartbeat_at": now}
+            if job.status == "running":
+                print(f"♻️ Reclaiming interrupted ingestion job {job.id} ({job.filename})")
+                if job.attempts >= job.max_attempts:
+                    values = {"status": "failed", "finished_at": now, "error": job.error or "Interrupted too many times"}
+
+            # Compare-and-set on what was read: exactly one worker wins even where SKIP LOCKED is not enforced
+            won = (
+                db.query(IngestionJob)
+                .filter(
+                    IngestionJob.id == job.id,
+                    IngestionJob.status == job.status,
+                    IngestionJob.attempts == job.attempts,
+                )
+                .update(values, synchronize_session=False)
+            )
+            db.commit()
+            if not won or values["status"] != "running":
+                return None
+
+            db.refresh(job)
+            claimed = job_to_dict(job)
+            claimed["file_path"] = job.file_path
+            claimed["payload"] = json.loads(job.payload) if job.payload else {}
+            return claimed
+        finally:
+            db.close()
+
+    def _update(self, job_id: UUID, attempt: int, **values) -> bool:
+        """Fenced update: only applies while `attempt` still owns the job."""
+        db = SessionLocal()
+        try:
+            n = (
+                db.query(IngestionJob)
+                .filter(IngestionJob.id == job_id, IngestionJob.attempts == attempt)
+                .update(values, synchronize_session=False)
+            )
+            db.commit()
+            return n > 0
+        finally:
+            db.close()
+
+    def _run(self, job: Dict) -> None:
+        job_id, attempt = UUID(job["job_id"]), job["attempts"]
+        ctx = JobContext(self, job_id, attempt)
+        with self._running_lock:
+            self._running.add((job_id, attempt))
+
+        print(f"📥 Ingesting {job['filename']} ({job['kind']}, attempt {attempt}/{job['max_attempts']})")
+        try:
+            handler = self._handlers.get(job["kind"])
+            if handler is None:
+                raise PermanentJobError(f"No handler for job kind '{job['kind']}'")
+            result = handler(job, ctx)
+        except JobLostError:
+            print(f"⚠️ Ingestion job {job_id} was reclaimed by another worker")
+        except Exception as e:
+            self._fail(job, attempt, e)
+        else:
+            self._update(
+                job_id, attempt,
+                status="succeeded", progress=1.0, error=None,
+                result=json.dumps(result or {}), finished_at=_now(),
+            )
+            print(f"✅ Ingestion job {job_id} done ({job['filename']})")
+        finally:
+            with self._running_lock:
+                self._running.discard((job_id, attempt))
+
+    def _fail(self, job: Dict, attempt: int, error: Exception) -> None:
+        job_id = UUID(job["job_id"])
+        message = str(error)[:2000] or error.__class__.__name__
+
+        if isinstance(error, PermanentJobError) or attempt >= job["max_attempts"]:
+            self._update(job_id, attempt, status="failed", error=message, finished_at=_now())
+            print(f"❌ Ingestion job {job_id} failed: {message}")
+            return
+
+        delay = INGEST_RETRY_BASE_SECONDS * (2 ** (attempt - 1))
+        self._update(
+            job_id, attempt,
+            status="queued", error=message,
+            run_after=_now() + timedelta(seconds=delay),
+        )
+        print(f"🔁 Ingestion job {job_id} failed ({message[:120]}) → retry in {delay:.0f}s")
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(INGEST_HEARTBEAT_SECONDS):
+            with self._running_lock:
+                running = list(self._running)
+            for job_id, attempt in running:
+                try:
+                    self._update(job_id, attempt, heartbeat_at=_now())
+                except Exception as e:
+                    print(f"⚠️ Ingestion heartbeat failed: {e}")
+
+
+ingestion_queue = IngestionQueue()
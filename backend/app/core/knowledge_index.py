@@ -0,0 +1,817 @@
+# backend/app/core/knowledge_index.py
+"""
+Write-behind knowledge vector index (used by core/vector.py).
+
+index_knowledge_entry() only appends the entry to a journal (fsync) and
+queues it; a background worker encodes queued entries in batches, appends
+them to a growable in-memory buffer + the FAISS index, and flushes new rows
+to disk when KNOWLEDGE_FLUSH_ROWS rows are pending or KNOWLEDGE_FLUSH_SECONDS
+have passed.
+A batch that fails to apply (e.g. the encoder is down) stays in the journal
+and is retried first, with backoff up to KNOWLEDGE_RETRY_MAX_SECONDS.
+
+Confidence and usage_count live in a side table (two arrays aligned with
+the rows) that feedback updates in place; search oversamples
+KNOWLEDGE_OVERSAMPLE candidates from FAISS and re-ranks them with one
+vectorized fusion over the side table, so nothing is re-embedded.
+
+Deletes are tombstones: the row stays in FAISS but is skipped at search
+time. Re-indexing a knowledge_id tombstones its previous row; the new row
+keeps the previous row's confidence and usage. A background
+compactor rewrites the index without dead rows, evicting the weakest
+entries (confidence, usage_count) once more than KNOWLEDGE_MAX_ROWS are live
+and entries whose KnowledgeMemory row no longer exists.
+
+On disk (app/data/), one generation of files at a time:
+    knowledge_vectors[.<gen>].bin     → raw float32 rows, append-only
+    knowledge_meta[.<gen>].jsonl      → one {"knowledge_id", "confidence"} line per row
+    knowledge_tombstones[.<gen>].bin  → int64 ids of dead rows, append-only
+    knowledge_stats[.<gen>].bin       → side table, (float32 confidence, int32 usage) per row
+    knowledge_manifest.json           → {"version", "dim", "generation", "rows", "dead", "journal_seq"}
+    knowledge_journal.jsonl           → acknowledged operations not yet covered by the manifest
+    knowledge.lock                    → held for journal appends, manifest commits, journal trims
+    knowledge.writer.lock             → held for life by the one process that persists and compacts
+
+The manifest is the commit point: anything past its row/dead counts is a
+torn write and is cut off on load, and journal entries newer than its
+journal_seq are replayed. Compaction writes generation N+1 beside N and
+switches by swapping the manifest.
+
+Several worker processes may share app/data/. Sequence numbers are
+assigned under knowledge.lock, so the journal is in one global order, and
+every process feeds its worker by tailing the journal, which also picks up
+other processes' entries. Only the process holding knowledge.writer.lock
+(the first to load) writes generation files, commits the manifest, trims
+the journal and compacts; the others keep an in-memory view. Their
+side-table updates are not written; compaction reconciles them from
+KnowledgeMemory.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.core.embeddings import get_embedding_service
+from app.data_processing.columnar_store import FileLock
+
+KNOWLEDGE_BATCH_SIZE = int(os.getenv("KNOWLEDGE_BATCH_SIZE", "64"))
+KNOWLEDGE_FLUSH_ROWS = int(os.getenv("KNOWLEDGE_FLUSH_ROWS", "256"))
+KNOWLEDGE_FLUSH_SECONDS = float(os.getenv("KNOWLEDGE_FLUSH_SECONDS", "5"))
+KNOWLEDGE_JOURNAL_FSYNC = os.getenv("KNOWLEDGE_JOURNAL_FSYNC", "true").lower() == "true"
+# Backoff cap between retries of a batch that failed to apply (e.g. encoder unavailable)
+KNOWLEDGE_RETRY_MAX_SECONDS = float(os.getenv("KNOWLEDGE_RETRY_MAX_SECONDS", "60"))
+# How long shutdown waits for the queue; what is left is replayed from the journal
+KNOWLEDGE_DRAIN_TIMEOUT = float(os.getenv("KNOWLEDGE_DRAIN_TIMEOUT", "30"))
+
+# Capacity / compaction policy
+KNOWLEDGE_MAX_ROWS = int(os.getenv("KNOWLEDGE_MAX_ROWS", "200000"))
+KNOWLEDGE_EVICT_HEADROOM = float(os.getenv("KNOWLEDGE_EVICT_HEADROOM", "0.1"))
+KNOWLEDGE_EVICT_USAGE_WEIGHT = float(os.getenv("KNOWLEDGE_EVICT_USAGE_WEIGHT", "0.1"))
+KNOWLEDGE_COMPACT_DEAD_RATIO = float(os.getenv("KNOWLEDGE_COMPACT_DEAD_RATIO", "0.2"))
+KNOWLEDGE_COMPACT_INTERVAL = float(os.getenv("KNOWLEDGE_COMPACT_INTERVAL", "300"))
+KNOWLEDGE_RECONCILE_SECONDS = float(os.getenv("KNOWLEDGE_RECONCILE_SECONDS", "3600"))
+
+# Retrieval: FAISS candidates re-ranked by similarity × confidence × usage boost
+KNOWLEDGE_OVERSAMPLE = int(os.getenv("KNOWLEDGE_OVERSAMPLE", "4096"))
+KNOWLEDGE_USAGE_BOOST = float(os.getenv("KNOWLEDGE_USAGE_BOOST", "0.05"))
+
+FORMAT_VERSION = 2
+MANIFEST_NAME = "knowledge_manifest.json"
+JOURNAL_NAME = "knowledge_journal.jsonl"
+LOCK_NAME = "knowledge.lock"
+WRITER_LOCK_NAME = "knowledge.writer.lock"
+
+_INITIAL_CAPACITY = 1024
+_STATS_DTYPE = np.dtype([("confidence", "<f4"), ("usage", "<i4")])
+
+# knowledge_id → (confidence, usage_count); ids missing from the result were deleted
+StatsFn = Callable[[List[str]], Dict[str, Tuple[float, int]]]
+
+
+def _atomic_write_json(path: str, data) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _append_bytes(path: str, payload: bytes) -> None:
+    with open(path, "ab") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _write_bytes(path: str, payload: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _normalize(v: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(v, axis=1, keepdims=True)
+    norm[norm == 0] = 1.0
+    return v / norm
+
+
+def _meta_lines(meta: List[Dict[str, Any]]) -> bytes:
+    return "".join(json.dumps(m) + "\n" for m in meta).encode("utf-8")
+
+
+def _entry_seq(line: bytes) -> Optional[int]:
+    """Sequence number of a complete journal line, None for a torn or unreadable one."""
+    if not line.endswith(b"\n"):
+        return None
+    try:
+        return int(json.loads(line)["seq"])
+    except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _generation_files(gen: int) -> Tuple[str, str, str, str]:
+    # Generation 0 keeps the original (unsuffixed) file names
+    suffix = f".{gen}" if gen else ""
+    return (
+        f"knowledge_vectors{suffix}.bin",
+        f"knowledge_meta{suffix}.jsonl",
+        f"knowledge_tombstones{suffix}.bin",
+        f"knowledge_stats{suffix}.bin",
+    )
+
+
+class KnowledgeIndex:
+    def __init__(self, data_dir: str, stats_fn: Optional[StatsFn] = None):
+        self.data_dir = data_dir
+        self.manifest_path = os.path.join(data_dir, MANIFEST_NAME)
+        self.journal_path = os.path.join(data_dir, JOURNAL_NAME)
+        self.stats_fn = stats_fn
+
+        self.dim = 0
+        self.generation = 0
+        self._vectors = np.zeros((0, 0), dtype=np.float32)  # capacity-sized buffer
+        self._alive = np.zeros(0, dtype=bool)
+        self._confidence = np.zeros(0, dtype=np.float32)  # side table, same capacity
+        self._usage = np.zeros(0, dtype=np.int32)
+        self._stats_dirty = False
+        self._rows = 0
+        self._meta: List[Dict[str, Any]] = []
+        self._id_to_row: Dict[str, int] = {}
+        self._tombstones: List[int] = []  # dead rows of this generation, in delete order
+        self._index = None
+
+        self._flushed_rows = 0
+        self._flushed_dead = 0
+        self._last_flush = time.monotonic()
+        self._last_compact = time.monotonic()
+
+        # Journal sequence numbers: assigned under the file lock, applied by the worker
+        self._tailed_seq = 0  # newest entry queued from the journal
+        self._applied_seq = 0
+        self._persisted_seq = 0
+        self._journal_pos = 0  # bytes of the journal already read
+        self._journal_head: Optional[int] = None  # seq of its first line (changes when trimmed)
+
+        self._lock = threading.Lock()          # buffers + FAISS index
+        self._journal_lock = threading.Lock()  # pairs with the (not thread-safe) file lock
+        self._file_lock = FileLock(os.path.join(data_dir, LOCK_NAME))
+        self._writer_lock = FileLock(os.path.join(data_dir, WRITER_LOCK_NAME))
+        self._flush_lock = threading.Lock()    # disk writes (flush vs. compaction swap)
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._compact_wakeup = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+        self._compactor: Optional[threading.Thread] = None
+
+    @property
+    def writer(self) -> bool:
+        """True in the one process that persists and compacts this index."""
+        return self._writer_lock.held
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.data_dir, name)
+
+    def _files(self, gen: Optional[int] = None) -> Tuple[str, str, str, str]:
+        return tuple(self._path(n) for n in _generation_files(self.generation if gen is None else gen))
+
+    # ------------------------------------------------------------
+    # Load / recovery
+    # ------------------------------------------------------------
+    def load(self, legacy_texts: Optional[str] = None, legacy_vectors: Optional[str] = None) -> None:
+        with self._journal_lock, self._file_lock:
+            # The first process to load becomes the writer; the lock is kept for its lifetime
+            self._writer_lock.acquire(blocking=False)
+
+            if self.writer and not os.path.exists(self.manifest_path) and legacy_texts and legacy_vectors:
+                self._migrate_legacy(legacy_texts, legacy_vectors)
+
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                # Version 1 is generation 0 without tombstones
+                if manifest.get("version") not in (1, FORMAT_VERSION):
+                    raise ValueError(f"Unsupported knowledge index version: {manifest.get('version')}")
+                self.dim = int(manifest["dim"])
+                self.generation = int(manifest.get("generation", 0))
+                self._persisted_seq = self._applied_seq = int(manifest.get("journal_seq", 0))
+                self._load_rows(int(manifest["rows"]), int(manifest.get("dead", 0)))
+                if self.writer:
+                    self._remove_stale_generations()
+
+            self._tailed_seq = self._persisted_seq
+            replayed = self._tail_journal()
+        if replayed:
+            print(f"↩️ Replaying {replayed} journaled knowledge operations")
+        self._start_worker()
+
+    def _load_rows(self, rows: int, dead: int) -> None:
+        vectors_path, meta_path, tomb_path, stats_path = self._files()
+
+        # Cut off anything written after the last manifest (torn flush); only the
+        # writer may, the others just read up to the manifest's counts
+        for path, keep in ((vectors_path, rows * self.dim * 4), (tomb_path, dead * 8)):
+            if self.writer and os.path.exists(path) and os.path.getsize(path) > keep:
+                os.truncate(path, keep)
+
+        meta, keep_bytes = [], 0
+        if os.path.exists(meta_path):
+            with open(meta_path, "rb") as f:
+                for line in f:
+                    if len(meta) == rows:
+                        break
+                    meta.append(json.loads(line))
+                    keep_bytes += len(line)
+            if self.writer and os.path.getsize(meta_path) > keep_bytes:
+                os.truncate(meta_path, keep_bytes)
+        if len(meta) != rows:
+            raise ValueError(f"Knowledge index is inconsistent: {len(meta)} meta rows vs manifest {rows}")
+
+        if rows:
+            vectors = np.fromfile(vectors_path, dtype=np.float32, count=rows * self.dim)
+            self._append_rows(vectors.reshape(rows, self.dim), meta)
+        if dead:
+            for row in np.fromfile(tomb_path, dtype=np.int64)[:dead]:
+                self._tombstone(int(row))
+        if rows and os.path.exists(stats_path):
+            # Rows newer than the last stats write keep the confidence they were indexed with
+            stats = np.fromfile(stats_path, dtype=_STATS_DTYPE)[:rows]
+            self._confidence[:len(stats)] = stats["confidence"]
+            self._usage[:len(stats)] = stats["usage"]
+            self._stats_dirty = len(stats) < rows
+        self._flushed_rows = rows
+        self._flushed_dead = len(self._tombstones)
+
+        print(f"→ Knowledge index loaded ({self.live_rows:,} live / {rows:,} rows)")
+
+    def _remove_stale_generations(self) -> None:
+        current = set(_generation_files(self.generation))
+        for name in os.listdir(self.data_dir):
+            if not name.startswith(("knowledge_vectors", "knowledge_meta", "knowledge_tombstones", "knowledge_stats")):
+                continue
+            if name in current or not name.endswith((".bin", ".jsonl")):
+                continue
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+    def _migrate_legacy(self, texts_path: str, vectors_path: str) -> None:
+        """One-shot conversion of knowledge_texts.json / knowledge_vectors.npy."""
+        if not (os.path.exists(texts_path) and os.path.exists(vectors_path)):
+            return
+        with open(texts_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        vectors = _normalize(np.load(vectors_path).astype(np.float32))
+        if len(meta) != len(vectors):
+            raise ValueError(f"Legacy knowledge index is inconsistent: {len(meta)} vs {len(vectors)}")
+
+        print(f"🔁 Migrating {len(meta):,} knowledge vectors to the write-behind index")
+        vectors_file, meta_file, _, _ = self._files(0)
+        _write_bytes(vectors_file, np.ascontiguousarray(vectors).tobytes())
+        _write_bytes(meta_file, _meta_lines(meta))
+        _atomic_write_json(self.manifest_path, {
+            "version": FORMAT_VERSION, "dim": int(vectors.shape[1]), "generation": 0,
+            "rows": len(meta), "dead": 0, "journal_seq": 0,
+        })
+
+    def _tail_journal(self) -> int:
+        """
+        Queue journal entries newer than the last one seen, in sequence order
+        (replay on load, other processes' entries later). Caller holds the
+        file lock. Returns the number queued.
+        """
+        if not os.path.exists(self.journal_path):
+            return 0
+        queued = 0
+        with open(self.journal_path, "rb") as f:
+            head = _entry_seq(f.readline())
+            if head != self._journal_head:
+                # Trimmed by the writer: read it again from the start, skipping what was seen,
+                # and never hand out a sequence number the manifest already covers
+                self._journal_head, self._journal_pos = head, 0
+                self._tailed_seq = max(self._tailed_seq, self._manifest_seq())
+            f.seek(self._journal_pos)
+            for line in f:
+                seq = _entry_seq(line)
+                if seq is None:
+                    break  # torn final line: it was never acknowledged
+                self._journal_pos += len(line)
+                if seq <= self._tailed_seq:
+                    continue
+                self._tailed_seq = seq
+                self._queue.put(json.loads(line))
+                queued += 1
+        if os.path.getsize(self.journal_path) > self._journal_pos:
+            os.truncate(self.journal_path, self._journal_pos)
+        return queued
+
+    def _manifest_seq(self) -> int:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return int(json.load(f).get("journal_seq", 0))
+        except (OSError, ValueError):
+            return 0
+
+    def _poll_journal(self) -> None:
+        with self._journal_lock, self._file_lock:
+            self._tail_journal()
+
+    # ------------------------------------------------------------
+    # Write path
+    # ------------------------------------------------------------
+    def _journal(self, entry: Dict[str, Any]) -> int:
+        with self._journal_lock, self._file_lock:
+            # Whatever other processes appended goes first, so the queue stays in journal order
+            self._tail_journal()
+            entry["seq"] = self._tailed_seq + 1
+            line = (json.dumps(entry) + "\n").encode("utf-8")
+            with open(self.journal_path, "ab") as f:
+                f.write(line)
+                f.flush()
+                if KNOWLEDGE_JOURNAL_FSYNC:
+                    os.fsync(f.fileno())
+            if self._journal_pos == 0:
+                self._journal_head = entry["seq"]
+            self._journal_pos += len(line)
+            self._tailed_seq = entry["seq"]
+            self._queue.put(entry)
+        return entry["seq"]
+
+    def enqueue(self, knowledge_id: str, text: str, confidence: float) -> int:
+        """Durably accept an entry (journal + fsync) and queue it for indexing."""
+        return self._journal({"op": "add", "knowledge_id": knowledge_id, "text": text, "confidence": confidence})
+
+    def delete(self, knowledge_id: str) -> int:
+        """Durably queue a tombstone for knowledge_id."""
+        return self._journal({"op": "delete", "knowledge_id": knowledge_id})
+
+    def _start_worker(self) -> None:
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._worker = threading.Thread(target=self._run, name="knowledge-indexer", daemon=True)
+        self._worker.start()
+
+    def _run(self) -> None:
+        retry: List[Dict[str, Any]] = []
+        failures = 0
+        while True:
+            if retry:
+                batch, retry = retry, []
+            else:
+                try:
+                    entry = self._queue.get(timeout=KNOWLEDGE_FLUSH_SECONDS)
+                except queue.Empty:
+                    # Idle: pick up what other processes journaled, then flush
+                    try:
+                        self._poll_journal()
+                    except Exception as e:
+                        print(f"⚠️ Knowledge journal read failed: {e}")
+                    self._maybe_flush(force=True)
+                    continue
+                if entry is None:  # close()
+                    self._queue.task_done()
+                    return
+
+                batch = [entry]
+                while len(batch) < KNOWLEDGE_BATCH_SIZE:
+                    try:
+                        entry = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if entry is None:
+                        # Let the stop request through after this batch
+                        self._queue.task_done()
+                        self._queue.put(None)
+                        break
+                    batch.append(entry)
+
+            try:
+                self._apply_batch(batch)
+            except Exception as e:
+                # Not applied → _applied_seq stays put, so the entries stay in the journal;
+                # the same batch goes first again so journal order is kept
+                failures += 1
+                delay = min(KNOWLEDGE_RETRY_MAX_SECONDS, 2 ** (failures - 1))
+                print(f"⚠️ Knowledge batch of {len(batch)} failed ({e}), retrying in {delay:.0f}s")
+                retry = batch
+                time.sleep(delay)
+                continue
+            failures = 0
+
+            self._maybe_flush()
+            if self.needs_compaction():
+                self._compact_wakeup.set()
+            for _ in batch:
+                self._queue.task_done()
+
+    def _apply_batch(self, batch: List[Dict[str, Any]]) -> None:
+        """Apply a batch in journal order; raises (nothing acknowledged) if it cannot be encoded."""
+        adds = [e for e in batch if e.get("op", "add") == "add"]
+        vectors = None
+        if adds:
+            vectors = get_embedding_service().encode([e["text"] for e in adds])
+
+        with self._lock:
+            # Apply in journal order so "add X, delete X" ends with X deleted
+            pos = 0
+            for entry in batch:
+                if entry.get("op", "add") == "add":
+                    meta = {"knowledge_id": entry["knowledge_id"], "confidence": entry["confidence"]}
+                    self._append_rows(vectors[pos:pos + 1], [meta])
+                    pos += 1
+                else:
+                    row = self._id_to_row.get(entry["knowledge_id"])
+                    if row is not None:
+                        self._tombstone(row)
+            self._applied_seq = batch[-1]["seq"]
+
+    def _append_rows(self, vectors: np.ndarray, meta: List[Dict[str, Any]]) -> None:
+        """Append into the preallocated buffer (amortized O(batch)); caller holds the lock."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self._index is None:
+            self.dim = int(vectors.shape[1])
+            self._index = faiss.IndexFlatIP(self.dim)
+            self._resize(max(_INITIAL_CAPACITY, len(vectors)))
+
+        start = self._rows
+        needed = start + len(vectors)
+        if needed > len(self._vectors):
+            self._resize(max(needed, len(self._vectors) * 2))
+
+        self._vectors[start:needed] = vectors
+        self._alive[start:needed] = True
+        self._confidence[start:needed] = [float(m["confidence"]) for m in meta]
+        self._usage[start:needed] = 0
+        self._stats_dirty = True
+        self._index.add(vectors)
+        self._meta.extend(meta)
+        self._rows = needed
+
+        # Re-indexing a knowledge_id replaces its previous row; the learned stats carry over
+        for row, m in enumerate(meta, start):
+            previous = self._id_to_row.get(m["knowledge_id"])
+            if previous is not None:
+                self._confidence[row] = self._confidence[previous]
+                self._usage[row] = self._usage[previous]
+                self._tombstone(previous)
+            self._id_to_row[m["knowledge_id"]] = row
+
+    def _resize(self, capacity: int) -> None:
+        """Grow the row buffer and the side table together; caller holds the lock."""
+        n = self._rows
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        alive = np.zeros(capacity, dtype=bool)
+        confidence = np.zeros(capacity, dtype=np.float32)
+        usage = np.zeros(capacity, dtype=np.int32)
+        if n:
+            vectors[:n] = self._vectors[:n]
+            alive[:n] = self._alive[:n]
+            confidence[:n] = self._confidence[:n]
+            usage[:n] = self._usage[:n]
+        self._vectors, self._alive, self._confidence, self._usage = vectors, alive, confidence, usage
+
+    def update_stats(self, knowledge_id: str, confidence: Optional[float] = None, usage_count: Optional[int] = None) -> bool:
+        """Feedback path: update the live row's side-table entry in place. Returns False if not indexed."""
+        with self._lock:
+            row = self._id_to_row.get(knowledge_id)
+            if row is None:
+                return False
+            if confidence is not None:
+                self._confidence[row] = confidence
+            if usage_count is not None:
+                self._usage[row] = usage_count
+            self._stats_dirty = True
+        return True
+
+    def _tombstone(self, row: int) -> None:
+        """Caller holds the lock."""
+        if not self._alive[row]:
+            return
+        self._alive[row] = False
+        self._tombstones.append(row)
+        kid = self._meta[row]["knowledge_id"]
+        if self._id_to_row.get(kid) == row:
+            del self._id_to_row[kid]
+
+    def _maybe_flush(self, force: bool = False) -> None:
+        # The journal already makes queued operations durable; flushing only bounds replay work
+        if not self.writer:
+            return
+        pending = self._rows - self._flushed_rows
+        due = force or time.monotonic() - self._last_flush >= KNOWLEDGE_FLUSH_SECONDS
+        # Side-table updates are not journaled: KnowledgeMemory stays the source of truth
+        # and compaction reconciles against it, so they only ride along on a timed flush
+        dirty = self._applied_seq > self._persisted_seq or self._stats_dirty
+        if pending >= KNOWLEDGE_FLUSH_ROWS or (due and dirty):
+            try:
+                self.flush_to_disk()
+            except Exception as e:
+                print(f"⚠️ Knowledge index flush failed: {e}")
+
+    def flush_to_disk(self) -> None:
+        """Append unflushed rows and tombstones, commit the manifest, then trim the journal (writer only)."""
+        if not self.writer:
+            return
+        with self._flush_lock:
+            with self._lock:
+                start, end = self._flushed_rows, self._rows
+                vectors = self._vectors[start:end].copy()
+                meta = self._meta[start:end]
+                dead = np.asarray(self._tombstones[self._flushed_dead:], dtype=np.int64)
+                dead_total = len(self._tombstones)
+                applied_seq = self._applied_seq
+
+            vectors_path, meta_path, tomb_path, stats_path = self._files()
+            if end > start:
+                _append_bytes(vectors_path, vectors.tobytes())
+                _append_bytes(meta_path, _meta_lines(meta))
+            if len(dead):
+                _append_bytes(tomb_path, dead.tobytes())
+            self._write_stats(stats_path)
+
+            self._commit(end, dead_total, applied_seq)
+
+    def _write_stats(self, path: str) -> None:
+        """Rewrite the side table if it changed (8 bytes per row; vectors are untouched)."""
+        with self._lock:
+            if not self._stats_dirty:
+                return
+            payload = self._stats_bytes()
+        tmp = f"{path}.tmp"
+        _write_bytes(tmp, payload)
+        os.replace(tmp, path)
+
+    def _stats_bytes(self) -> bytes:
+        # Caller holds the lock
+        stats = np.zeros(self._rows, dtype=_STATS_DTYPE)
+        stats["confidence"] = self._confidence[:self._rows]
+        stats["usage"] = self._usage[:self._rows]
+        self._stats_dirty = False
+        return stats.tobytes()
+
+    def _commit(self, rows: int, dead: int, applied_seq: int) -> None:
+        with self._journal_lock, self._file_lock:
+            _atomic_write_json(self.manifest_path, {
+                "version": FORMAT_VERSION, "dim": self.dim, "generation": self.generation,
+                "rows": rows, "dead": dead, "journal_seq": applied_seq,
+            })
+            self._trim_journal(applied_seq)
+        self._flushed_rows = rows
+        self._flushed_dead = dead
+        self._persisted_seq = applied_seq
+        self._last_flush = time.monotonic()
+
+    def _trim_journal(self, seq: int) -> None:
+        """Drop the entries the manifest now covers; caller holds the file lock."""
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "rb") as f:
+            lines = f.readlines()
+        # Entries acknowledged since (by any process) are kept for the next commit
+        pending = [line for line in lines if (_entry_seq(line) or 0) > seq]
+        if len(pending) == len(lines):
+            return
+        tmp = f"{self.journal_path}.tmp"
+        _write_bytes(tmp, b"".join(pending))
+        os.replace(tmp, self.journal_path)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every queued operation is applied and on disk (shutdown /
+        tests). Returns False if `timeout` runs out first (e.g. a batch keeps
+        failing); the operations left over are still in the journal.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Polled instead of queue.join() so a batch stuck in retries cannot block forever
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                print(f"⚠️ Knowledge index drain timed out: {self._queue.unfinished_tasks} operations "
+                      f"left in the journal for replay")
+                return False
+            time.sleep(0.05)
+        if (
+            self._applied_seq > self._persisted_seq
+            or self._flushed_dead < len(self._tombstones)
+            or self._stats_dirty
+        ):
+            self.flush_to_disk()
+        return True
+
+    def close(self) -> None:
+        """Drain, stop the worker and give up the writer role (tests; a process just exits)."""
+        self.drain(KNOWLEDGE_DRAIN_TIMEOUT)
+        if self._worker is not None and self._worker.is_alive():
+            self._queue.put(None)
+            self._worker.join()
+        with self._journal_lock:
+            self._writer_lock.release()
+
+    # ------------------------------------------------------------
+    # Compaction / eviction
+    # ------------------------------------------------------------
+    @property
+    def live_rows(self) -> int:
+        return self._rows - len(self._tombstones)
+
+    def needs_compaction(self) -> bool:
+        dead = len(self._tombstones)
+        return (
+            self.live_rows > KNOWLEDGE_MAX_ROWS
+            or (dead > 0 and dead >= KNOWLEDGE_COMPACT_DEAD_RATIO * self._rows)
+        )
+
+    def _choose_evictions(self, live: np.ndarray, meta: List[Dict[str, Any]]) -> np.ndarray:
+        """Rows (old numbering) to drop: deleted upstream, then the weakest beyond capacity."""
+        ids = [meta[r]["knowledge_id"] for r in live]
+        stats = None
+        if self.stats_fn is not None and ids:
+            try:
+                stats = self.stats_fn(ids)
+            except Exception as e:
+                print(f"⚠️ Knowledge stats unavailable ({e}) → capacity check uses the side table")
+
+        with self._lock:
+            conf = self._confidence[live].copy()
+            usage = self._usage[live].astype(np.float32)
+
+        exists = np.ones(len(live), dtype=bool)
+        if stats is not None:
+            # Reconcile the side table with KnowledgeMemory while we are at it
+            exists = np.array([kid in stats for kid in ids], dtype=bool)
+            for i, kid in enumerate(ids):
+                if kid in stats:
+                    conf[i], usage[i] = stats[kid][0] or 0.0, stats[kid][1] or 0
+            with self._lock:
+                for i, row in enumerate(live):
+                    if exists[i] and self._meta[row] is meta[row]:
+                        self._confidence[row], self._usage[row] = conf[i], usage[i]
+                self._stats_dirty = True
+
+        evict = ~exists
+        n_live = int(exists.sum())
+        if n_live > KNOWLEDGE_MAX_ROWS:
+            # Evict down to capacity minus headroom so the next few inserts don't re-trigger
+            n_evict = n_live - int(KNOWLEDGE_MAX_ROWS * (1 - KNOWLEDGE_EVICT_HEADROOM))
+            priority = conf + KNOWLEDGE_EVICT_USAGE_WEIGHT * np.log1p(usage)
+            priority[~exists] = np.inf
+            evict[np.argsort(priority, kind="stable")[:n_evict]] = True
+        return live[evict]
+
+    def compact(self) -> int:
+        """
+        Rewrite the index without dead or evicted rows. The copy, the FAISS
+        rebuild and the file writes happen outside the lock; only the rows
+        appended meanwhile and the swap itself are done under it, so
+        searches keep running. Only the writer compacts. Returns the number
+        of rows removed.
+        """
+        if not self.writer:
+            return 0
+        with self._lock:
+            n0 = self._rows
+            if n0 == 0:
+                return 0
+            buf = self._vectors  # rows < n0 are never rewritten in place
+            meta0 = self._meta[:n0]
+            alive0 = self._alive[:n0].copy()
+            new_gen = self.generation + 1
+
+        live = np.flatnonzero(alive0)
+        evicted = self._choose_evictions(live, meta0)
+        keep = np.setdiff1d(live, evicted, assume_unique=True)
+
+        vectors_file, meta_file, tomb_file, stats_file = self._files(new_gen)
+        new_vectors = np.ascontiguousarray(buf[keep], dtype=np.float32)
+        new_meta = [meta0[r] for r in keep]
+        _write_bytes(vectors_file, new_vectors.tobytes())
+        _write_bytes(meta_file, _meta_lines(new_meta))
+        index = faiss.IndexFlatIP(self.dim)
+        index.add(new_vectors)
+
+        old_files = self._files()
+        with self._flush_lock, self._lock:
+            # Rows appended and deletes applied while we were copying
+            total = self._rows
+            tail_vectors = self._vectors[n0:total].copy()
+            tail_meta = self._meta[n0:total]
+            remap = np.full(total, -1, dtype=np.int64)
+            remap[keep] = np.arange(len(keep))
+            remap[n0:total] = len(keep) + np.arange(total - n0)
+            dead_rows = np.flatnonzero(~self._alive[:total])
+            dead_now = [int(remap[r]) for r in dead_rows if remap[r] >= 0]
+
+            if len(tail_vectors):
+                _append_bytes(vectors_file, tail_vectors.tobytes())
+                _append_bytes(meta_file, _meta_lines(tail_meta))
+                index.add(tail_vectors)
+            _write_bytes(tomb_file, np.asarray(dead_now, dtype=np.int64).tobytes())
+
+            rows = len(keep) + len(tail_vectors)
+            survivors = np.concatenate([keep, np.arange(n0, total)]).astype(np.int64)
+            capacity = max(_INITIAL_CAPACITY, rows * 2)
+            vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+            vectors[:len(keep)] = new_vectors
+            vectors[len(keep):rows] = tail_vectors
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:rows] = True
+            alive[dead_now] = False
+            confidence = np.zeros(capacity, dtype=np.float32)
+            confidence[:rows] = self._confidence[survivors]
+            usage = np.zeros(capacity, dtype=np.int32)
+            usage[:rows] = self._usage[survivors]
+            meta = new_meta + list(tail_meta)
+
+            self.generation = new_gen
+            self._vectors, self._alive, self._meta, self._index, self._rows = vectors, alive, meta, index, rows
+            self._confidence, self._usage = confidence, usage
+            self._tombstones = dead_now
+            self._id_to_row = {m["knowledge_id"]: i for i, m in enumerate(meta) if alive[i]}
+            _write_bytes(stats_file, self._stats_bytes())
+            self._commit(rows, len(dead_now), self._applied_seq)
+            self._last_compact = time.monotonic()
+
+        # Under the file lock, so a process loading the old generation finishes first
+        with self._journal_lock, self._file_lock:
+            for path in old_files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        removed = total - rows
+        print(f"🧹 Knowledge index compacted: {removed:,} rows removed ({len(evicted):,} evicted) → {rows:,}")
+        return removed
+
+    def start_compactor(self, interval: float = KNOWLEDGE_COMPACT_INTERVAL) -> None:
+        """Background compaction; only the writer process runs it."""
+        if not self.writer or (self._compactor is not None and self._compactor.is_alive()):
+            return
+
+        def _loop():
+            while True:
+                self._compact_wakeup.wait(interval)
+                self._compact_wakeup.clear()
+                reconcile = (
+                    self.stats_fn is not None
+                    and time.monotonic() - self._last_compact >= KNOWLEDGE_RECONCILE_SECONDS
+                )
+                if not (self.needs_compaction() or reconcile):
+                    continue
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"⚠️ Knowledge index compaction failed: {e}")
+
+        self._compactor = threading.Thread(target=_loop, name="knowledge-compactor", daemon=True)
+        self._compactor.start()
+
+    # ------------------------------------------------------------
+    # Read path
+    # ------------------------------------------------------------
+    def __len__(self) -> int:
+        return self.live_rows
+
+    def search(self, q_vec: np.ndarray, k: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            if self._index is None or self.live_rows == 0:
+                return []
+            # Oversample, then re-rank with the live side table (tombstones are filtered out)
+            fetch = min(self._rows, max(k, KNOWLEDGE_OVERSAMPLE) + len(self._tombstones))
+            D, I = self._index.search(q_vec.reshape(1, -1).astype(np.float32), fetch)
+            sims, ids = D[0], I[0]
+            valid = ids >= 0
+            sims, ids = sims[valid], ids[valid]
+            valid = self._alive[ids]
+            sims, ids = sims[valid], ids[valid]
+
+            fused = sims * self._confidence[ids] * (1.0 + KNOWLEDGE_USAGE_BOOST * np.log1p(self._usage[ids]))
+            top = np.argsort(-fused, kind="stable")[:k]
+            hits = [(float(fused[i]), self._meta[ids[i]]["knowledge_id"]) for i in top]
+
+        return [{"knowledge_id": kid, "score": score} for score, kid in hits]
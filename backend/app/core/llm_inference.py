@@ -1,16 +1,12 @@
 import asyncio
 import os
-import requests
 from typing import List, Optional, Dict
 from concurrent.futures import ThreadPoolExecutor
-from functools import lru_cache
 import time
-import json
 import psutil
 import re
 from datetime import datetime
 import random
-import aiohttp
 
 from .prompts.general import NEXORA_SYSTEM_PROMPT
 from .prompts.math import MATH_SYSTEM_PROMPT
@@ -24,7 +20,6 @@ from app.tools.code_execution import safe_execute_code
 from app.core.vector import (
     retrieve_context,
     retrieve_knowledge,
-    get_sentence_transformer
 )
 
 from app.core.response_style import (
@@ -38,10 +33,14 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from app.core.intent_detector import detect_query_intent
+from app.core.generation_scheduler import PRIORITY_INTERACTIVE, GenerationOverloaded
+from app.core.model_router import estimate_tokens, model_router
+from app.core.ollama_client import OLLAMA_HOST, OllamaConnectionError, OllamaError, OllamaTimeout, ollama
+from app.core.resource_monitor import resource_monitor, sample_host
+from app.data_processing.partitions import upload_owner
 
-get_sentence_transformer()
+# The embedding model is warmed once in main.startup_init (shared service)
 
-OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
 OLLAMA_TIMEOUT = 15.0
 GEN_TIMEOUT = 600
 STALL_TIMEOUT = 600
@@ -355,44 +354,50 @@ MODEL_TIERS = {
 
 ALL_MODELS = [m for tier in MODEL_TIERS.values() for m in tier]
 
-_model_performance: Dict[str, List[float]] = {}
-_model_failures: Dict[str, int] = {}
+# With comparable quality (same tier), a model Ollama already has loaded wins
+MODEL_PREFER_RESIDENT = os.getenv("MODEL_PREFER_RESIDENT", "true").lower() == "true"
+
 _current_model = None
 _last_model_check = 0
 _cached_available_models = []
 
 
 def get_system_resources() -> Dict:
+    """Latest background sample; sampled on the spot (without sleeping) before the monitor runs."""
+    snapshot = resource_monitor.snapshot
+    if snapshot is not None:
+        return snapshot.as_dict()
     try:
-        return {
-            "ram_total_gb": psutil.virtual_memory().total / (1024**3),
-            "ram_available_gb": psutil.virtual_memory().available / (1024**3),
-            "ram_percent": psutil.virtual_memory().percent,
-            "cpu_count": psutil.cpu_count(logical=True),
-            "cpu_percent": psutil.cpu_percent(interval=0.1),
-        }
+        return sample_host()
     except:
         return {"ram_total_gb": 8, "ram_available_gb": 4, "ram_percent": 50, "cpu_count": 4, "cpu_percent": 50}
 
 
-@lru_cache(maxsize=1)
-def is_llm_available() -> bool:
+_llm_available = False
+
+
+async def is_llm_available(refresh: bool = False) -> bool:
+    """Whether Ollama answers; a positive result is remembered, a negative one re-checked."""
+    global _llm_available
+    if _llm_available and not refresh:
+        return True
     try:
-        r = requests.get(f"{OLLAMA_HOST}/api/tags", timeout=OLLAMA_TIMEOUT)
-        return r.status_code == 200
-    except:
-        return False
+        await ollama.tags(timeout=OLLAMA_TIMEOUT)
+        _llm_available = True
+    except OllamaError:
+        _llm_available = False
+    return _llm_available
 
 
 def get_available_models(force_refresh=False) -> List[str]:
+    """Installed model names (cached 5 min). Blocking: call from a worker thread, not the event loop."""
     global _cached_available_models, _last_model_check
     now = time.time()
     if not force_refresh and _cached_available_models and (now - _last_model_check) < 300:
         return _cached_available_models
     try:
-        r = requests.get(f"{OLLAMA_HOST}/api/tags", timeout=OLLAMA_TIMEOUT)
-        r.raise_for_status()
-        _cached_available_models = [m["name"] for m in r.json().get("models", [])]
+        models = ollama.call("tags", timeout=OLLAMA_TIMEOUT)
+        _cached_available_models = [m["name"] for m in models]
         _last_model_check = now
         return _cached_available_models
     except:
@@ -405,15 +410,60 @@ def is_text_generation_model(model_name: str) -> bool:
 
 
 def select_optimal_model(force_reselect=False, is_math_or_coding=False) -> Optional[str]:
+    """
+    Pick a model for the available RAM, preferring one Ollama already has
+    loaded from the same tier. While the resource monitor runs this only
+    reads its latest snapshot (no I/O, safe on the event loop).
+    """
     global _current_model
-    available = get_available_models()
+    snapshot = resource_monitor.snapshot
+    if snapshot is not None:
+        available, ram_gb, loaded = snapshot.installed_models, snapshot.ram_available_gb, snapshot.loaded_models
+    else:
+        available, ram_gb, loaded = get_available_models(), get_system_resources()["ram_available_gb"], ()
     if not available: return None
     text_models = [m for m in available if is_text_generation_model(m)]
     if not text_models: return None
 
-    resources = get_system_resources()
-    ram_gb = resources["ram_available_gb"]
+    model = _select_for_resources(text_models, ram_gb, is_math_or_coding)
+    if MODEL_PREFER_RESIDENT and model not in loaded:
+        model = _resident_alternative(model, text_models, loaded) or model
+    return model
+
+
+def _model_tier(model: str) -> Optional[str]:
+    for tier, models in MODEL_TIERS.items():
+        if model in models:
+            return tier
+    return None
+
+
+def _resident_alternative(model: str, text_models: List[str], loaded) -> Optional[str]:
+    """A loaded model from the same tier as `model`, saving its cold start."""
+    tier = _model_tier(model)
+    if tier is None:
+        return None
+    for candidate in MODEL_TIERS[tier]:
+        if candidate != model and candidate in loaded and candidate in text_models:
+            return candidate
+    return None
+
+
+def select_title_model() -> str:
+    """Small model for chat titles: a loaded one from the small tiers, else qwen2.5:3b."""
+    snapshot = resource_monitor.snapshot
+    if snapshot is None:
+        return "qwen2.5:3b"
+    for tier in ("minimal", "fastest", "fast"):
+        for model in MODEL_TIERS[tier]:
+            if model in snapshot.loaded_models:
+                return model
+    if "qwen2.5:3b" in snapshot.installed_models or not snapshot.installed_models:
+        return "qwen2.5:3b"
+    return select_optimal_model() or "qwen2.5:3b"
 
+
+def _select_for_resources(text_models: List[str], ram_gb: float, is_math_or_coding: bool) -> str:
     if is_math_or_coding:
         if "qwen2.5:14b" in text_models and ram_gb > 12.0:
             return "qwen2.5:14b"
@@ -432,81 +482,177 @@ def select_optimal_model(force_reselect=False, is_math_or_coding=False) -> Optio
     return text_models[0]
 
 
-def record_performance(model: str, response_time: float, success: bool = True):
-    if model not in _model_performance:
-        _model_performance[model] = []
+def candidate_models(is_math_or_coding=False) -> List[str]:
+    """
+    Tier ladder for routing, best first: the resource-based pick, then the
+    installed models of its tier and every lower one (loaded ones first).
+    """
+    top = select_optimal_model(is_math_or_coding=is_math_or_coding)
+    if top is None:
+        return []
+    snapshot = resource_monitor.snapshot
+    installed = snapshot.installed_models if snapshot is not None else _cached_available_models
+    loaded = snapshot.loaded_models if snapshot is not None else ()
+
+    tiers = list(MODEL_TIERS)  # smallest first
+    top_tier = _model_tier(top) or "fastest"
+    ladder = [top]
+    for tier in reversed(tiers[:tiers.index(top_tier) + 1]):
+        for model in sorted(MODEL_TIERS[tier], key=lambda m: m not in loaded):
+            if model in installed and model not in ladder and is_text_generation_model(model):
+                ladder.append(model)
+    return ladder
+
+
+def route_model(is_math_or_coding=False, style: str = "balanced", prompt_chars: int = 0) -> List[str]:
+    """
+    Models to try for a chat turn: the best one predicted to meet the
+    style's latency target, then the rest of the ladder below it as
+    fallbacks (see generate_with_streaming_async).
+    """
+    ladder = candidate_models(is_math_or_coding)
+    chosen = model_router.choose(ladder, style, estimate_tokens(prompt_chars))
+    if chosen is None:
+        return []
+    return ladder[ladder.index(chosen):]
+
+
+def record_performance(
+    model: str,
+    ttft: Optional[float],
+    final: Optional[Dict] = None,
+    success: bool = True,
+    style: Optional[str] = None,
+):
+    """Feed a finished generation (TTFT + Ollama's final chunk) or a failure into the router's statistics."""
     if success:
-        _model_performance[model].append(response_time)
-        _model_failures[model] = max(0, _model_failures.get(model, 0) - 1)
+        model_router.observe(model, ttft, final, style)
     else:
-        _model_failures[model] = _model_failures.get(model, 0) + 1
-    if len(_model_performance[model]) > 10:
-        _model_performance[model] = _model_performance[model][-10:]
-
-
-async def generate_with_streaming_async(messages: List[Dict], model: str, options: Dict, contexts: List[str] = None):
-    payload = {
-        "model": model,
-        "messages": messages,
-        "stream": True,
-        "keep_alive": "5m",
-        "options": options,
-    }
+        model_router.record_failure(model)
+
+
+async def _first_chunk(stream, admitted: asyncio.Event, deadline: Optional[float]):
+    """Next chunk of `stream`; `deadline` only starts once `admitted` is set (the slot was granted)."""
+    first = asyncio.ensure_future(anext(stream, None))
+    if deadline is None:
+        return await first
+    granted = asyncio.ensure_future(admitted.wait())
+    try:
+        # Time queued behind other generations does not count against the model
+        await asyncio.wait({first, granted}, return_when=asyncio.FIRST_COMPLETED)
+        done, _ = await asyncio.wait({first}, timeout=deadline)
+        if not done:
+            raise asyncio.TimeoutError
+        return first.result()
+    finally:
+        granted.cancel()
+        if not first.done():
+            first.cancel()
+            await asyncio.wait({first})
+
+
+async def generate_with_streaming_async(
+    messages: List[Dict],
+    model: str,
+    options: Dict,
+    contexts: List[str] = None,
+    priority: str = PRIORITY_INTERACTIVE,
+    user_id: Optional[str] = None,
+    fallbacks: Optional[List[str]] = None,
+    style: str = "balanced",
+    used: Optional[Dict] = None,
+):
+    """
+    Stream the answer of `model`. If it has not produced a first token by
+    its router deadline, counted from when its generation slot is granted,
+    the request is dropped and the next model of `fallbacks` is tried (the
+    last one is waited for). A fallback is not recorded as a model failure.
+    The model that answered is stored in used["model"].
+    """
+    models = [model] + list(fallbacks or [])
+    prompt_tokens = estimate_tokens(sum(len(m.get("content", "")) for m in messages))
     try:
-        timeout = aiohttp.ClientTimeout(total=GEN_TIMEOUT)
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            async with session.post(f"{OLLAMA_HOST}/api/chat", json=payload) as response:
-                response.raise_for_status()
-                token_count = 0
-                start_time = time.time()
-                last_chunk_time = time.time()
-
-                async for line in response.content:
-                    if await asyncio.sleep(0) or True:
-                        try:
-                            chunk = json.loads(line)
-                            if "message" in chunk and chunk["message"]["role"] == "assistant":
-                                content = chunk["message"].get("content", "")
-                                if content:
-                                    token_count += len(content.split())
-                                    yield content
-                                    last_chunk_time = time.time()
-
-                                    if token_count % 5 == 0:
-                                        await asyncio.sleep(0)
-                            if chunk.get("done", False):
-                                elapsed = time.time() - start_time
-                                log('SUCCESS', f"Streaming complete: {token_count} tokens | {elapsed:.2f}s")
-                                break
-                        except json.JSONDecodeError:
-                            continue
-
-                    if time.time() - last_chunk_time > STALL_TIMEOUT:
-                        log('ERROR', f"No tokens for {STALL_TIMEOUT}s - Generation stalled")
+        for attempt, model in enumerate(models):
+            token_count = 0
+            start_time = time.time()
+            deadline = model_router.ttft_deadline(model, style, prompt_tokens) if attempt < len(models) - 1 else None
+
+            admitted = asyncio.Event()
+            admitted_at = [start_time]
+
+            def on_admitted():
+                admitted_at[0] = time.time()
+                admitted.set()
+
+            stream = ollama.chat_stream(
+                model, messages, options=options, priority=priority, user=user_id, on_admitted=on_admitted,
+            )
+            try:
+                try:
+                    chunk = await _first_chunk(stream, admitted, deadline)
+                except asyncio.TimeoutError:
+                    log('MODEL', f"No first token from {model} after {deadline:.1f}s - falling back to {models[attempt + 1]}")
+                    continue
+
+                # Queueing is the scheduler's latency, not the model's
+                ttft = time.time() - admitted_at[0]
+                if used is not None:
+                    used["model"] = model
+
+                # A stall longer than OLLAMA_READ_TIMEOUT surfaces as OllamaTimeout
+                while chunk is not None:
+                    message = chunk.get("message")
+                    if message and message.get("role") == "assistant":
+                        content = message.get("content", "")
+                        if content:
+                            token_count += len(content.split())
+                            yield content
+
+                            if token_count % 5 == 0:
+                                await asyncio.sleep(0)
+                    if chunk.get("done", False):
+                        elapsed = time.time() - start_time
+                        record_performance(model, ttft, chunk, style=style)
+                        log('SUCCESS', f"Streaming complete: {token_count} tokens | {elapsed:.2f}s | TTFT {ttft:.2f}s")
                         break
 
+                    if time.time() - start_time > GEN_TIMEOUT:
+                        raise OllamaTimeout(f"generation exceeded {GEN_TIMEOUT}s")
+                    chunk = await anext(stream, None)
+            finally:
+                await stream.aclose()
+            return
+
     except asyncio.CancelledError:
         log('INFO', "Ollama streaming cancelled by client")
         raise
-    except asyncio.TimeoutError:
+    except GenerationOverloaded as e:
+        log('ERROR', f"Generation queue full: {e}")
+        yield f"\n\nWarning: Server busy - please retry in {e.retry_after}s"
+    except OllamaTimeout:
+        record_performance(model, None, success=False)
         log('ERROR', f"Streaming timeout after {GEN_TIMEOUT}s")
         yield "\n\nWarning: Response timeout - please try a shorter question"
-    except aiohttp.ClientError as e:
+    except OllamaConnectionError as e:
+        # Ollama itself is down: not held against the model
         log('ERROR', f"Connection error: {e}")
         yield "\n\nWarning: Connection error - is Ollama running?"
+    except OllamaError as e:
+        record_performance(model, None, success=False)
+        log('ERROR', f"Ollama error: {e}")
+        yield "\n\nWarning: Connection error - is Ollama running?"
     except Exception as e:
         log('ERROR', f"Streaming error: {e}")
         yield f"\n\nWarning: Error: {str(e)}"
 
 
-def generate_with_streaming(messages: List[Dict], model: str, options: Dict) -> Optional[str]:
-    payload = {
-        "model": model,
-        "messages": messages,
-        "stream": True,
-        "keep_alive": "10m",
-        "options": options,
-    }
+async def generate_with_streaming(
+    messages: List[Dict],
+    model: str,
+    options: Dict,
+    priority: str = PRIORITY_INTERACTIVE,
+    user_id: Optional[str] = None,
+) -> Optional[str]:
     max_tokens = options.get("num_predict", "N/A")
     ctx_size = options.get("num_ctx", "N/A")
     temp = options.get("temperature", "N/A")
@@ -521,8 +667,6 @@ def generate_with_streaming(messages: List[Dict], model: str, options: Dict) ->
     print("-"*80)
 
     try:
-        response = requests.post(f"{OLLAMA_HOST}/api/chat", json=payload, stream=True, timeout=GEN_TIMEOUT)
-        response.raise_for_status()
         full_response = []
         token_count = 0
         word_count_estimate = 0
@@ -531,44 +675,37 @@ def generate_with_streaming(messages: List[Dict], model: str, options: Dict) ->
         last_print_time = 0
         batch_buffer = []
         batch_size = 4
+        ttft = None
 
-        for line in response.iter_lines(decode_unicode=True):
-            if not line:
+        async for chunk in ollama.chat_stream(model, messages, options=options, priority=priority, user=user_id):
+            if chunk.get("done", False):
+                record_performance(model, ttft, chunk)
+                break
+            if "message" not in chunk or chunk["message"]["role"] != "assistant":
                 continue
-            try:
-                chunk = json.loads(line)
-                if chunk.get("done", False):
-                    if batch_buffer:
-                        text = "".join(batch_buffer)
-                        full_response.append(text)
-                        token_count += len(text.split())
-                        word_count_estimate += len(text.split())
-                    break
-                if "message" not in chunk or chunk["message"]["role"] != "assistant":
-                    continue
-                text = chunk["message"].get("content", "")
-                if not text:
-                    continue
-                batch_buffer.append(text)
-                if len(batch_buffer) >= batch_size:
-                    combined = "".join(batch_buffer)
-                    full_response.append(combined)
-                    new_tokens = len(combined.split())
-                    token_count += new_tokens
-                    word_count_estimate += new_tokens
-                    batch_buffer.clear()
-                    now = time.time()
-                    elapsed = max(now - start_time, 0.1)
-                    speed = token_count / elapsed
-                    progress = min(30, int(token_count / 40))
-                    bar = "█" * progress + "░" * (30 - progress)
-                    if now - last_print_time >= 0.3:
-                        print(f"\rSpeed {speed:5.1f} t/s │ {token_count:4d} tokens │ {word_count_estimate:3d} words │ {bar} {int((progress/30)*100):3d}%",
-                              end="", flush=True)
-                        last_print_time = now
-                    last_chunk_time = now
-            except json.JSONDecodeError:
+            text = chunk["message"].get("content", "")
+            if not text:
                 continue
+            if ttft is None:
+                ttft = time.time() - start_time
+            batch_buffer.append(text)
+            if len(batch_buffer) >= batch_size:
+                combined = "".join(batch_buffer)
+                full_response.append(combined)
+                new_tokens = len(combined.split())
+                token_count += new_tokens
+                word_count_estimate += new_tokens
+                batch_buffer.clear()
+                now = time.time()
+                elapsed = max(now - start_time, 0.1)
+                speed = token_count / elapsed
+                progress = min(30, int(token_count / 40))
+                bar = "█" * progress + "░" * (30 - progress)
+                if now - last_print_time >= 0.3:
+                    print(f"\rSpeed {speed:5.1f} t/s │ {token_count:4d} tokens │ {word_count_estimate:3d} words │ {bar} {int((progress/30)*100):3d}%",
+                          end="", flush=True)
+                    last_print_time = now
+                last_chunk_time = now
 
         if batch_buffer:
             final_text = "".join(batch_buffer)
@@ -598,11 +735,16 @@ def generate_with_streaming(messages: List[Dict], model: str, options: Dict) ->
 
         return answer
 
-    except requests.Timeout:
+    except GenerationOverloaded as e:
         print("\r" + " " * 120, end="\r")
+        log('ERROR', f"Generation queue full: {e}")
+        return None
+    except OllamaTimeout:
+        print("\r" + " " * 120, end="\r")
+        record_performance(model, None, success=False)
         log('ERROR', f"Timeout after {GEN_TIMEOUT}s")
         return None
-    except requests.ConnectionError:
+    except OllamaConnectionError:
         print("\r" + " " * 120, end="\r")
         log('ERROR', "Cannot connect to Ollama. Run: ollama serve")
         return None
@@ -703,7 +845,8 @@ async def generate_direct_response(
     is_greeting_msg: bool = False,
     enable_web_search: bool = True,
     force_search: bool = False,
-    response_style: str = "balanced"
+    response_style: str = "balanced",
+    chat_id: str | None = None,
 ) -> str:
     contexts = contexts or []
 
@@ -778,14 +921,20 @@ async def generate_direct_response(
 
     is_math = is_math_question(question)
     is_coding = is_coding_question(question)
-    model = select_optimal_model(is_math_or_coding=(is_math or is_coding))
+    route = route_model(
+        is_math_or_coding=(is_math or is_coding),
+        style=response_style,
+        prompt_chars=len(question) + sum(len(c) for c in contexts),
+    )
+    model = route[0] if route else None
 
     if not model:
         return "No models available. Install: `ollama pull qwen2.5:7b`"
 
     start_time = time.time()
 
-    file_contexts = retrieve_context(question, k=4)
+    # The caller's own uploads: user partition, or the guest chat's partition
+    file_contexts = retrieve_context(question, k=4, user_id=upload_owner(user_id, chat_id))
     knowledge_results = retrieve_knowledge(question, k=5)
 
     all_contexts_list = search_results + file_contexts + knowledge_results
@@ -901,13 +1050,7 @@ Example responses:
         "num_predict": 1500,
     }
 
-    answer = await asyncio.get_event_loop().run_in_executor(
-        _executor,
-        generate_with_streaming,
-        messages,
-        model,
-        generation_options
-    )
+    answer = await generate_with_streaming(messages, model, generation_options, user_id=user_id)
 
     # ────────────────────────────────────────────────
     # FIX 1F ── Final safety check
@@ -927,7 +1070,6 @@ Example responses:
         
         add_to_history(user_id, "assistant", validated_answer)
         elapsed = time.time() - start_time
-        record_performance(model, elapsed, success=True)
         log('SUCCESS', f"Response in {elapsed:.2f}s")
 
         if search_source:
@@ -961,9 +1103,8 @@ async def generate_chat_response(
             log('SUCCESS', "Instant greeting | 0.00s | No LLM used")
             return instant_response
 
-    if not is_llm_available():
-        is_llm_available.cache_clear()
-        if not is_llm_available():
+    if not await is_llm_available():
+        if not await is_llm_available(refresh=True):
             log('ERROR', "Ollama is not running")
             return "Ollama is not running\n\nStart Ollama: `ollama serve`"
 
@@ -978,7 +1119,8 @@ async def generate_chat_response(
         intent,
         is_greeting_msg,
         enable_web_search,
-        response_style=response_style
+        response_style=response_style,
+        chat_id=chat_id,
     )
 
 
@@ -988,8 +1130,8 @@ async def generate_with_llm(question: str, contexts: list[str]) -> str:
 
 def startup_check():
     try:
-        if is_llm_available():
-            models = get_available_models()
+        models = get_available_models(force_refresh=True)
+        if models:
             resources = get_system_resources()
             log('INFO', f"Ollama: Running at {OLLAMA_HOST}")
             log('INFO', f"Models Available: {len(models)}")
@@ -0,0 +1,208 @@
+# backend/app/core/model_residency.py
+"""
+Which Ollama models stay loaded, and for how long.
+
+Ollama unloads a model `keep_alive` after its last request, and reloads a
+loaded model whenever a request asks for different runner options
+(num_ctx, num_thread, ...). Both cost a multi-second cold start. This
+module:
+
+- preloads the hot set (MODEL_HOT_SET="qwen2.5:7b,gemma3:4b", by default
+  the current chat model) at startup with a one-token warm-up prefill
+  using the chat path's runner options, in the background;
+- picks keep_alive per request from observed traffic: a few times the
+  recent gap between requests to that model (MODEL_KEEP_ALIVE_FACTOR),
+  clamped to [MODEL_KEEP_ALIVE_MIN, MODEL_KEEP_ALIVE_MAX]. Hot models
+  always get the maximum; under RAM pressure the others get the minimum;
+- keeps a request on the already-loaded runner: num_thread and a num_ctx
+  at least as large as requested are taken from the options the model
+  was loaded with, so e.g. title generation does not reload the chat model.
+
+The resident set is Ollama's /api/ps as sampled by the resource monitor;
+routing (select_optimal_model) prefers resident models. OllamaClient
+applies keep_alive_for() / align_options() to every generating request
+that does not set keep_alive itself.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+import psutil
+
+MODEL_HOT_SET = [m.strip() for m in os.getenv("MODEL_HOT_SET", "").split(",") if m.strip()]
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "true").lower() == "true"
+MODEL_PRELOAD_TIMEOUT = float(os.getenv("MODEL_PRELOAD_TIMEOUT", "300"))
+# Runner options of the warm-up; keep in line with /chat/send so the first chat reuses the runner
+MODEL_WARMUP_NUM_CTX = int(os.getenv("MODEL_WARMUP_NUM_CTX", "12288"))
+MODEL_WARMUP_NUM_THREAD = int(os.getenv("MODEL_WARMUP_NUM_THREAD", str(min(12, psutil.cpu_count(logical=True) or 1))))
+
+MODEL_KEEP_ALIVE_MIN = int(os.getenv("MODEL_KEEP_ALIVE_MIN", "120"))       # seconds
+MODEL_KEEP_ALIVE_MAX = int(os.getenv("MODEL_KEEP_ALIVE_MAX", "3600"))
+MODEL_KEEP_ALIVE_DEFAULT = int(os.getenv("MODEL_KEEP_ALIVE_DEFAULT", "300"))  # Ollama's own default
+MODEL_KEEP_ALIVE_FACTOR = float(os.getenv("MODEL_KEEP_ALIVE_FACTOR", "3"))
+MODEL_TRAFFIC_WINDOW = int(os.getenv("MODEL_TRAFFIC_WINDOW", "32"))
+MODEL_RAM_PRESSURE_PERCENT = float(os.getenv("MODEL_RAM_PRESSURE_PERCENT", "90"))
+
+# Options that make Ollama start a new runner (reload the model) when they change
+RUNNER_OPTIONS = ("num_ctx", "num_thread", "num_gpu", "num_batch", "main_gpu", "use_mmap")
+# A load_duration above this on a finished request counts as a cold start
+COLD_LOAD_SECONDS = 1.0
+
+WARMUP_MESSAGES = [{"role": "user", "content": "Hi"}]
+
+
+def _snapshot():
+    # Imported here: resource_monitor → ollama_client → this module
+    from app.core.resource_monitor import resource_monitor
+    return resource_monitor.snapshot
+
+
+class ModelResidency:
+    def __init__(self, hot_set: Optional[List[str]] = None):
+        self.hot_set: List[str] = list(hot_set if hot_set is not None else MODEL_HOT_SET)
+        self._arrivals: Dict[str, Deque[float]] = {}
+        self._runner: Dict[str, Dict] = {}
+        self._keep_alive: Dict[str, int] = {}
+        self._cold_loads: Dict[str, int] = {}
+        self._load_seconds: Dict[str, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # ------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------
+    def start(self, default_model: Optional[str] = None) -> None:
+        """Preload the hot set in the background (the configured one, else `default_model`)."""
+        if not self.hot_set and default_model:
+            self.hot_set = [default_model]
+        if MODEL_PRELOAD and self.hot_set and self._task is None:
+            self._task = asyncio.create_task(self.preload(), name="model-preload")
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def preload(self) -> None:
+        from app.core.ollama_client import OllamaError, ollama
+        from app.core.resource_monitor import resource_monitor
+
+        snapshot = resource_monitor.snapshot
+        installed = set(snapshot.installed_models) if snapshot is not None else set()
+        for model in self.hot_set:
+            if installed and model not in installed:
+                print(f"⚠️ Hot model {model} is not installed, skipping preload")
+                continue
+            started = time.monotonic()
+            try:
+                # One-token prefill: loads the weights and allocates the KV cache at the chat num_ctx
+                await ollama.chat(
+                    model,
+                    WARMUP_MESSAGES,
+                    options={"num_ctx": MODEL_WARMUP_NUM_CTX, "num_thread": MODEL_WARMUP_NUM_THREAD, "num_predict": 1},
+                    keep_alive=f"{MODEL_KEEP_ALIVE_MAX}s",
+                    timeout=MODEL_PRELOAD_TIMEOUT,
+                    priority=None,
+                )
+                print(f"🔥 Preloaded {model} ({time.monotonic() - started:.1f}s)")
+            except OllamaError as e:
+                print(f"⚠️ Preload of {model} failed: {e}")
+
+        # Routing sees the new resident set right away instead of at the next sample
+        try:
+            await resource_monitor.sample()
+        except Exception:
+            pass
+
+    # ------------------------------------------------------------
+    # Residency
+    # ------------------------------------------------------------
+    def resident_models(self) -> Tuple[str, ...]:
+        snapshot = _snapshot()
+        return snapshot.loaded_models if snapshot is not None else ()
+
+    def is_resident(self, model: str) -> bool:
+        return model in self.resident_models()
+
+    # ------------------------------------------------------------
+    # Per-request policy
+    # ------------------------------------------------------------
+    def keep_alive_for(self, model: str) -> str:
+        """Record a request to `model` and return the keep_alive to send with it."""
+        now = time.monotonic()
+        arrivals = self._arrivals.get(model)
+        if arrivals is None:
+            arrivals = self._arrivals[model] = deque(maxlen=MODEL_TRAFFIC_WINDOW)
+        arrivals.append(now)
+
+        seconds = self._policy(model, arrivals)
+        self._keep_alive[model] = seconds
+        return f"{seconds}s"
+
+    def _policy(self, model: str, arrivals: Deque[float]) -> int:
+        if model in self.hot_set:
+            return MODEL_KEEP_ALIVE_MAX
+        snapshot = _snapshot()
+        if snapshot is not None and snapshot.ram_percent >= MODEL_RAM_PRESSURE_PERCENT:
+            return MODEL_KEEP_ALIVE_MIN
+        if len(arrivals) < 3:
+            return MODEL_KEEP_ALIVE_DEFAULT
+
+        times = list(arrivals)
+        gaps = sorted(b - a for a, b in zip(times, times[1:]))
+        p90 = gaps[min(len(gaps) - 1, int(len(gaps) * 0.9))]
+        return int(min(MODEL_KEEP_ALIVE_MAX, max(MODEL_KEEP_ALIVE_MIN, p90 * MODEL_KEEP_ALIVE_FACTOR)))
+
+    def align_options(self, model: str, options: Optional[Dict]) -> Optional[Dict]:
+        """Options adjusted to the loaded runner where that loses nothing; remembers what was sent."""
+        options = dict(options) if options else {}
+        runner = self._runner.get(model)
+        if runner is not None and self.is_resident(model):
+            if "num_thread" in runner:
+                options["num_thread"] = runner["num_thread"]
+            # A larger context holds the request just as well; a smaller one would truncate it
+            if runner.get("num_ctx", 0) >= options.get("num_ctx", 0) > 0:
+                options["num_ctx"] = runner["num_ctx"]
+
+        sent = {k: options[k] for k in RUNNER_OPTIONS if k in options}
+        if sent:
+            self._runner[model] = sent
+        return options or None
+
+    def record_load(self, model: str, load_duration_ns: Optional[int]) -> None:
+        """Note the load_duration Ollama reported for a finished request."""
+        seconds = (load_duration_ns or 0) / 1e9
+        if seconds >= COLD_LOAD_SECONDS:
+            self._cold_loads[model] = self._cold_loads.get(model, 0) + 1
+            self._load_seconds[model] = self._load_seconds.get(model, 0.0) + seconds
+
+    # ------------------------------------------------------------
+    # Metrics
+    # ------------------------------------------------------------
+    def stats(self) -> Dict:
+        resident = set(self.resident_models())
+        models = set(self._arrivals) | set(self.hot_set) | resident
+        return {
+            "hot_set": list(self.hot_set),
+            "preloading": self._task is not None and not self._task.done(),
+            "models": {
+                model: {
+                    "resident": model in resident,
+                    "hot": model in self.hot_set,
+                    "recent_requests": len(self._arrivals.get(model, ())),
+                    "keep_alive_s": self._keep_alive.get(model),
+                    "runner_options": self._runner.get(model),
+                    "cold_loads": self._cold_loads.get(model, 0),
+                    "load_seconds": round(self._load_seconds.get(model, 0.0), 2),
+                }
+                for model in sorted(models)
+            },
+        }
+
+
+model_residency = ModelResidency()
@@ -0,0 +1,277 @@
+# backend/app/core/model_router.py
+"""
+Latency-aware model choice from measured performance.
+
+Every finished generation feeds rolling per-model statistics (the last
+ROUTER_STATS_WINDOW requests): time to first token as the user saw it,
+decode speed (eval_count / eval_duration), prefill cost per prompt token
+(prompt_eval_count / prompt_eval_duration), load time and failure rate.
+TTFT is modelled as a fixed overhead plus prefill per prompt token, so a
+model that is fast on short questions but slow on long RAG prompts is
+predicted as such.
+
+choose() walks a best-first candidate list (the tier ladder built by
+llm_inference.candidate_models) and returns the first model predicted to
+meet the response style's target (ROUTER_TTFT_* for the first token,
+ROUTER_TOTAL_* for the whole answer) with a failure rate below
+ROUTER_MAX_FAILURE_RATE. Models without measurements are assumed to meet
+it, so they get measured; a model that is not loaded pays its observed
+load time. When no candidate meets the target the fastest predicted one
+is used.
+
+The failure rate only counts the last ROUTER_FAILURE_WINDOW_SECONDS: a
+skipped model gets no new outcomes, so it is tried again once its
+failures age out. Not reaching Ollama at all is not the model's fault and
+is not recorded against it.
+
+ttft_deadline() is how long a stream may go without its first token
+before the caller abandons it for the next candidate down the ladder.
+
+calibrate() profiles models on demand (short and long prompt, a fixed
+number of output tokens) at background priority to seed the statistics.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from app.core.generation_scheduler import PRIORITY_BACKGROUND
+from app.core.model_residency import COLD_LOAD_SECONDS, model_residency
+
+ROUTER_STATS_WINDOW = int(os.getenv("ROUTER_STATS_WINDOW", "50"))
+ROUTER_MAX_FAILURE_RATE = float(os.getenv("ROUTER_MAX_FAILURE_RATE", "0.3"))
+# Outcomes older than this no longer count towards the failure rate
+ROUTER_FAILURE_WINDOW_SECONDS = float(os.getenv("ROUTER_FAILURE_WINDOW_SECONDS", "300"))
+# Abandon a stream for the next tier when its first token is this many times later than expected
+ROUTER_FALLBACK_FACTOR = float(os.getenv("ROUTER_FALLBACK_FACTOR", "2.0"))
+# Load time allowed to a model that is not loaded and whose load was never measured
+ROUTER_COLD_LOAD_SECONDS = float(os.getenv("ROUTER_COLD_LOAD_SECONDS", "30"))
+ROUTER_CALIBRATION_TOKENS = int(os.getenv("ROUTER_CALIBRATION_TOKENS", "64"))
+
+# style → (first token, whole answer) targets in seconds
+LATENCY_SLO: Dict[str, Tuple[float, float]] = {
+    "concise": (float(os.getenv("ROUTER_TTFT_CONCISE", "2")), float(os.getenv("ROUTER_TOTAL_CONCISE", "20"))),
+    "balanced": (float(os.getenv("ROUTER_TTFT_BALANCED", "4")), float(os.getenv("ROUTER_TOTAL_BALANCED", "60"))),
+    "detailed": (float(os.getenv("ROUTER_TTFT_DETAILED", "8")), float(os.getenv("ROUTER_TOTAL_DETAILED", "150"))),
+}
+# Answer length assumed per style until real answers have been measured
+DEFAULT_OUTPUT_TOKENS = {"concise": 150, "balanced": 400, "detailed": 900}
+
+CHARS_PER_TOKEN = 4
+
+CALIBRATION_PROMPTS = (
+    "In one sentence, what is photosynthesis?",
+    "Summarize the following notes in three bullet points.\n\n" + (
+        "The quarterly report covers revenue, costs, hiring and the product roadmap. "
+        "Revenue grew in every region while costs stayed flat, and two launches slipped. "
+    ) * 40,
+)
+
+
+def estimate_tokens(text_chars: int) -> int:
+    return max(1, text_chars // CHARS_PER_TOKEN)
+
+
+def _median(values) -> Optional[float]:
+    values = sorted(values)
+    if not values:
+        return None
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+
+class ModelStats:
+    """Rolling measurements of one model."""
+
+    def __init__(self, window: int = ROUTER_STATS_WINDOW):
+        # (prompt tokens, ttft seconds) of requests whose first token was timed
+        self.ttft: Deque[Tuple[int, float]] = deque(maxlen=window)
+        self.prefill_s_per_token: Deque[float] = deque(maxlen=window)
+        self.tokens_per_s: Deque[float] = deque(maxlen=window)
+        self.load_s: Deque[float] = deque(maxlen=window)
+        self.outcomes: Deque[Tuple[float, bool]] = deque(maxlen=window)  # (monotonic time, succeeded)
+
+    def observe(self, ttft: Optional[float], final: Optional[Dict]) -> None:
+        final = final or {}
+        prompt_tokens = final.get("prompt_eval_count") or 0
+        load_s = (final.get("load_duration") or 0) / 1e9
+        cold = load_s >= COLD_LOAD_SECONDS
+        if ttft is not None:
+            # A cold load is accounted for separately, not as prefill overhead
+            self.ttft.append((prompt_tokens, max(0.0, ttft - (load_s if cold else 0.0))))
+        if cold:
+            self.load_s.append(load_s)
+        if prompt_tokens and final.get("prompt_eval_duration"):
+            self.prefill_s_per_token.append(final["prompt_eval_duration"] / 1e9 / prompt_tokens)
+        if final.get("eval_count") and final.get("eval_duration"):
+            self.tokens_per_s.append(final["eval_count"] / (final["eval_duration"] / 1e9))
+        self.outcomes.append((time.monotonic(), True))
+
+    def fail(self) -> None:
+        self.outcomes.append((time.monotonic(), False))
+
+    # ------------------------------------------------------------
+    # Estimates
+    # ------------------------------------------------------------
+    @property
+    def failure_rate(self) -> float:
+        """Share of failures among the outcomes of the last ROUTER_FAILURE_WINDOW_SECONDS."""
+        since = time.monotonic() - ROUTER_FAILURE_WINDOW_SECONDS
+        recent = [ok for at, ok in self.outcomes if at >= since]
+        return recent.count(False) / len(recent) if recent else 0.0
+
+    @property
+    def decode_rate(self) -> Optional[float]:
+        return _median(self.tokens_per_s)
+
+    def ttft_model(self) -> Tuple[float, float]:
+        """(overhead seconds, seconds per prompt token) of the TTFT model."""
+        per_token = _median(self.prefill_s_per_token) or 0.0
+        overhead = _median(max(0.0, t - n * per_token) for n, t in self.ttft)
+        return overhead or 0.0, per_token
+
+    def predict_ttft(self, prompt_tokens: int, resident: bool = True) -> Optional[float]:
+        if not self.ttft and not self.prefill_s_per_token:
+            return None
+        overhead, per_token = self.ttft_model()
+        cold = 0.0 if resident else (_median(self.load_s) or 0.0)
+        return cold + overhead + prompt_tokens * per_token
+
+    def predict_total(self, prompt_tokens: int, output_tokens: int, resident: bool = True) -> Optional[float]:
+        ttft, rate = self.predict_ttft(prompt_tokens, resident), self.decode_rate
+        if ttft is None or not rate:
+            return None
+        return ttft + output_tokens / rate
+
+    def as_dict(self) -> Dict:
+        overhead, per_token = self.ttft_model()
+        return {
+            "samples": len(self.outcomes),
+            "failure_rate": round(self.failure_rate, 3),
+            "ttft_p50_s": round(_median(t for _, t in self.ttft), 3) if self.ttft else None,
+            "ttft_overhead_s": round(overhead, 3),
+            "prefill_ms_per_token": round(per_token * 1000, 3),
+            "tokens_per_s": round(self.decode_rate, 1) if self.decode_rate else None,
+            "load_s_p50": round(_median(self.load_s), 2) if self.load_s else None,
+        }
+
+
+class ModelRouter:
+    def __init__(self):
+        self.stats: Dict[str, ModelStats] = {}
+        self._output_tokens: Dict[str, Deque[int]] = {s: deque(maxlen=ROUTER_STATS_WINDOW) for s in LATENCY_SLO}
+        self._calibration: Optional[asyncio.Task] = None
+        self.calibrated_at: Optional[float] = None
+
+    def _stats(self, model: str) -> ModelStats:
+        stats = self.stats.get(model)
+        if stats is None:
+            stats = self.stats[model] = ModelStats()
+        return stats
+
+    # ------------------------------------------------------------
+    # Recording
+    # ------------------------------------------------------------
+    def observe(self, model: str, ttft: Optional[float], final: Optional[Dict], style: Optional[str] = None) -> None:
+        """A finished generation: measured TTFT and Ollama's final chunk (timings)."""
+        self._stats(model).observe(ttft, final)
+        if style in self._output_tokens and final and final.get("eval_count"):
+            self._output_tokens[style].append(final["eval_count"])
+
+    def record_failure(self, model: str) -> None:
+        self._stats(model).fail()
+
+    # ------------------------------------------------------------
+    # Routing
+    # ------------------------------------------------------------
+    def expected_output_tokens(self, style: str) -> int:
+        return int(_median(self._output_tokens.get(style, ())) or DEFAULT_OUTPUT_TOKENS.get(style, 400))
+
+    def predict(self, model: str, style: str, prompt_tokens: int) -> Tuple[Optional[float], Optional[float]]:
+        stats = self.stats.get(model)
+        if stats is None:
+            return None, None
+        resident = model_residency.is_resident(model)
+        return (
+            stats.predict_ttft(prompt_tokens, resident),
+            stats.predict_total(prompt_tokens, self.expected_output_tokens(style), resident),
+        )
+
+    def choose(self, candidates: List[str], style: str = "balanced", prompt_tokens: int = 0) -> Optional[str]:
+        """First candidate (best first) predicted to meet the style's latency target."""
+        if not candidates:
+            return None
+        ttft_target, total_target = LATENCY_SLO.get(style, LATENCY_SLO["balanced"])
+        fastest, fastest_total = None, None
+        for model in candidates:
+            stats = self.stats.get(model)
+            if stats is not None and stats.failure_rate > ROUTER_MAX_FAILURE_RATE:
+                continue
+            ttft, total = self.predict(model, style, prompt_tokens)
+            if (ttft is None or ttft <= ttft_target) and (total is None or total <= total_target):
+                return model
+            estimate = total if total is not None else ttft
+            if fastest_total is None or estimate < fastest_total:
+                fastest, fastest_total = model, estimate
+        return fastest or candidates[0]
+
+    def ttft_deadline(self, model: str, style: str = "balanced", prompt_tokens: int = 0) -> float:
+        """Seconds without a first token after which a stream falls back to the next model."""
+        ttft_target = LATENCY_SLO.get(style, LATENCY_SLO["balanced"])[0]
+        predicted, _ = self.predict(model, style, prompt_tokens)
+        deadline = ROUTER_FALLBACK_FACTOR * max(ttft_target, predicted or 0.0)
+        stats = self.stats.get(model)
+        if not model_residency.is_resident(model) and not (stats and stats.load_s):
+            deadline += ROUTER_COLD_LOAD_SECONDS
+        return deadline
+
+    # ------------------------------------------------------------
+    # Calibration
+    # ------------------------------------------------------------
+    def start_calibration(self, models: List[str]) -> bool:
+        """Profile `models` in the background; False if a calibration is already running."""
+        if self._calibration is not None and not self._calibration.done():
+            return False
+        self._calibration = asyncio.create_task(self.calibrate(models), name="model-calibration")
+        return True
+
+    async def calibrate(self, models: List[str]) -> Dict:
+        from app.core.ollama_client import OllamaConnectionError, OllamaError, ollama
+
+        for model in models:
+            for prompt in CALIBRATION_PROMPTS:
+                started, ttft, final = time.monotonic(), None, None
+                try:
+                    async for chunk in ollama.chat_stream(
+                        model,
+                        [{"role": "user", "content": prompt}],
+                        options={"num_predict": ROUTER_CALIBRATION_TOKENS, "temperature": 0},
+                        priority=PRIORITY_BACKGROUND,
+                        user="calibration",
+                    ):
+                        if ttft is None and chunk.get("message", {}).get("content"):
+                            ttft = time.monotonic() - started
+                        if chunk.get("done"):
+                            final = chunk
+                    self.observe(model, ttft, final)
+                except OllamaError as e:
+                    print(f"⚠️ Calibration of {model} failed: {e}")
+                    if not isinstance(e, OllamaConnectionError):
+                        self.record_failure(model)
+                    break
+            print(f"📏 Calibrated {model}: {self._stats(model).as_dict()}")
+        self.calibrated_at = time.time()
+        return self.summary()
+
+    def summary(self) -> Dict:
+        return {
+            "calibrating": self._calibration is not None and not self._calibration.done(),
+            "calibrated_at": self.calibrated_at,
+            "slo": {style: {"ttft_s": t, "total_s": total} for style, (t, total) in LATENCY_SLO.items()},
+            "expected_output_tokens": {style: self.expected_output_tokens(style) for style in LATENCY_SLO},
+            "models": {model: stats.as_dict() for model, stats in sorted(self.stats.items())},
+        }
+
+
+model_router = ModelRouter()
@@ -0,0 +1,365 @@
+# backend/app/core/ollama_client.py
+"""
+One shared async client for the Ollama HTTP API.
+
+Every caller (chat streaming, title generation, file analysis, the
+OpenAI-compatible endpoint, model discovery) goes through `ollama`, which
+owns a single httpx.AsyncClient: connections are kept alive between
+requests (OLLAMA_MAX_CONNECTIONS / OLLAMA_MAX_KEEPALIVE), so a chat turn
+does not pay TCP setup, and nothing blocks the event loop.
+
+Streaming responses are NDJSON; NDJSONDecoder splits the byte stream on
+newlines as it arrives and decodes each complete line with orjson, keeping
+a partial trailing line for the next read.
+
+Generating calls (chat, chat_stream, generate, generate_stream) first take
+a slot from core/generation_scheduler.py under their `priority` class;
+the slot is released before the final (done) chunk is handed over. The
+streaming calls' `on_admitted` callback fires once the slot is granted,
+so callers can time the model apart from the queue.
+Requests that do not set keep_alive get one from core/model_residency.py,
+which also keeps their runner options in line with the loaded model.
+
+Sync code running off the event loop (ingestion job threads, the startup
+check) uses `ollama.call("generate", ...)`, which runs the coroutine on the
+server's loop so it shares the same pool; without a running loop (scripts)
+a short-lived client is used instead.
+"""
+import asyncio
+import os
+import threading
+from contextlib import aclosing, asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, TypedDict
+
+import httpx
+import orjson
+
+from app.core.generation_scheduler import PRIORITY_INTERACTIVE, generation_scheduler
+from app.core.model_residency import model_residency
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434")
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "16"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "60"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+# Longest silence between two streamed chunks (or before a non-streamed answer)
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "600"))
+
+
+class OllamaError(RuntimeError):
+    """Any failure talking to Ollama."""
+
+
+class OllamaConnectionError(OllamaError):
+    """Ollama is not reachable (not running, wrong OLLAMA_HOST)."""
+
+
+class OllamaTimeout(OllamaError):
+    """Ollama accepted the request but did not answer in time."""
+
+
+class OllamaHTTPError(OllamaError):
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f"Ollama returned {status_code}: {body[:200]}")
+        self.status_code = status_code
+        self.body = body
+
+
+class ChatMessage(TypedDict):
+    role: str
+    content: str
+
+
+class ChatChunk(TypedDict, total=False):
+    model: str
+    message: ChatMessage
+    done: bool
+    done_reason: str
+    total_duration: int
+    load_duration: int
+    prompt_eval_count: int
+    prompt_eval_duration: int
+    eval_count: int
+    eval_duration: int
+
+
+class GenerateResult(TypedDict, total=False):
+    model: str
+    response: str
+    done: bool
+    total_duration: int
+    load_duration: int
+    prompt_eval_count: int
+    eval_count: int
+    eval_duration: int
+
+
+class ModelInfo(TypedDict, total=False):
+    name: str
+    model: str
+    size: int
+    size_vram: int
+    digest: str
+    details: Dict[str, Any]
+    expires_at: str
+
+
+# ================================================================
+# NDJSON stream decoding
+# ================================================================
+class NDJSONDecoder:
+    """Incremental newline-delimited JSON decoder for a byte stream."""
+
+    def __init__(self):
+        self._tail = b""
+
+    def feed(self, data: bytes) -> List[Dict[str, Any]]:
+        buf = self._tail + data if self._tail else data
+        lines = buf.split(b"\n")
+        self._tail = lines.pop()
+        return [orjson.loads(line) for line in lines if line.strip()]
+
+    def flush(self) -> List[Dict[str, Any]]:
+        tail, self._tail = self._tail, b""
+        return [orjson.loads(tail)] if tail.strip() else []
+
+
+# ================================================================
+# Client
+# ================================================================
+class OllamaClient:
+    def __init__(
+        self,
+        host: str = OLLAMA_HOST,
+        max_connections: int = OLLAMA_MAX_CONNECTIONS,
+        max_keepalive: int = OLLAMA_MAX_KEEPALIVE,
+        keepalive_expiry: float = OLLAMA_KEEPALIVE_EXPIRY,
+    ):
+        self.host = host.rstrip("/")
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self._http: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------
+    # Connection pool
+    # ------------------------------------------------------------
+    def _client(self) -> httpx.AsyncClient:
+        # The pool belongs to the loop that first used it (the server's loop)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            stale = self._loop is not None and self._loop is not loop and self._loop.is_closed()
+            if self._http is None or self._http.is_closed or stale:
+                self._http = httpx.AsyncClient(
+                    base_url=self.host,
+                    limits=self._limits,
+                    timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+                )
+                self._loop = loop
+            elif self._loop is not loop:
+                raise RuntimeError("OllamaClient is bound to another event loop; use call() from other threads")
+            return self._http
+
+    async def open(self) -> None:
+        """Bind the pool to the running (server) loop, so worker threads can call() into it."""
+        self._client()
+
+    async def aclose(self) -> None:
+        with self._lock:
+            http, self._http, self._loop = self._http, None, None
+        if http is not None:
+            await http.aclose()
+
+    def call(self, method: str, *args, timeout: Optional[float] = None, **kwargs):
+        """
+        Run one of the coroutine methods from sync code that is NOT on the
+        event loop (worker threads, scripts) and return its result.
+        `timeout` is passed on as the request timeout.
+        """
+        kwargs["timeout"] = timeout
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            try:
+                on_loop = asyncio.get_running_loop() is loop
+            except RuntimeError:
+                on_loop = False
+            if on_loop:
+                raise RuntimeError(f"ollama.call('{method}') would block the event loop; await it instead")
+            # The request timeout and the scheduler's queue timeout bound the wait
+            return asyncio.run_coroutine_threadsafe(getattr(self, method)(*args, **kwargs), loop).result()
+
+        async def _once():
+            client = OllamaClient(self.host)
+            try:
+                return await getattr(client, method)(*args, **kwargs)
+            finally:
+                await client.aclose()
+
+        return asyncio.run(_once())
+
+    # ------------------------------------------------------------
+    # Requests
+    # ------------------------------------------------------------
+    async def _request(self, method: str, path: str, payload: Optional[Dict] = None, timeout: Optional[float] = None) -> Dict:
+        try:
+            response = await self._client().request(
+                method,
+                path,
+                content=orjson.dumps(payload) if payload is not None else None,
+                headers={"Content-Type": "application/json"} if payload is not None else None,
+                timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+            )
+        except httpx.TimeoutException as e:
+            raise OllamaTimeout(f"{path} timed out") from e
+        except httpx.TransportError as e:
+            raise OllamaConnectionError(f"Cannot reach Ollama at {self.host}: {e}") from e
+
+        if response.status_code >= 400:
+            raise OllamaHTTPError(response.status_code, response.text)
+        return orjson.loads(response.content)
+
+    async def _stream(self, path: str, payload: Dict, timeout: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        decoder = NDJSONDecoder()
+        try:
+            async with self._client().stream(
+                "POST",
+                path,
+                content=orjson.dumps(payload),
+                headers={"Content-Type": "application/json"},
+                timeout=timeout if timeout is not None else httpx.USE_CLIENT_DEFAULT,
+            ) as response:
+                if response.status_code >= 400:
+                    body = (await response.aread()).decode("utf-8", errors="replace")
+                    raise OllamaHTTPError(response.status_code, body)
+
+                async for data in response.aiter_raw():
+                    for chunk in decoder.feed(data):
+                        if "error" in chunk:
+                            raise OllamaError(chunk["error"])
+                        yield chunk
+                for chunk in decoder.flush():
+                    yield chunk
+        except httpx.TimeoutException as e:
+            raise OllamaTimeout(f"{path} stream stalled") from e
+        except httpx.TransportError as e:
+            raise OllamaConnectionError(f"Cannot reach Ollama at {self.host}: {e}") from e
+
+    @staticmethod
+    def _body(model: str, options: Optional[Dict], keep_alive: Optional[str], **fields) -> Dict:
+        body = {"model": model, **fields}
+        options = model_residency.align_options(model, options)
+        if options:
+            body["options"] = options
+        body["keep_alive"] = keep_alive if keep_alive is not None else model_residency.keep_alive_for(model)
+        return body
+
+    @asynccontextmanager
+    async def _admitted(self, model: str, priority: Optional[str], user: Optional[str]) -> AsyncIterator[None]:
+        # priority=None bypasses the generation scheduler (e.g. warm-up requests)
+        if priority is None:
+            yield
+            return
+        async with generation_scheduler.slot(model, priority, user):
+            yield
+
+    async def _scheduled_stream(
+        self,
+        path: str,
+        body: Dict,
+        priority: Optional[str],
+        user: Optional[str],
+        timeout: Optional[float],
+        on_admitted: Optional[Callable[[], None]] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        final = None
+        async with self._admitted(body["model"], priority, user):
+            if on_admitted is not None:
+                on_admitted()
+            async with aclosing(self._stream(path, body, timeout)) as stream:
+                async for chunk in stream:
+                    if chunk.get("done"):
+                        final = chunk
+                        break
+                    yield chunk
+        # The slot is free before the caller sees the last chunk (callers usually stop reading there)
+        if final is not None:
+            model_residency.record_load(body["model"], final.get("load_duration"))
+            yield final
+
+    async def chat_stream(
+        self,
+        model: str,
+        messages: List[ChatMessage],
+        options: Optional[Dict] = None,
+        keep_alive: Optional[str] = None,
+        timeout: Optional[float] = None,
+        priority: Optional[str] = PRIORITY_INTERACTIVE,
+        user: Optional[str] = None,
+        on_admitted: Optional[Callable[[], None]] = None,
+    ) -> AsyncIterator[ChatChunk]:
+        """Streamed /api/chat: one chunk per generated piece, the last has done=True and the timings."""
+        body = self._body(model, options, keep_alive, messages=messages, stream=True)
+        async for chunk in self._scheduled_stream("/api/chat", body, priority, user, timeout, on_admitted):
+            yield chunk
+
+    async def chat(
+        self,
+        model: str,
+        messages: List[ChatMessage],
+        options: Optional[Dict] = None,
+        keep_alive: Optional[str] = None,
+        timeout: Optional[float] = None,
+        priority: Optional[str] = PRIORITY_INTERACTIVE,
+        user: Optional[str] = None,
+    ) -> ChatChunk:
+        body = self._body(model, options, keep_alive, messages=messages, stream=False)
+        async with self._admitted(model, priority, user):
+            result = await self._request("POST", "/api/chat", body, timeout)
+        model_residency.record_load(model, result.get("load_duration"))
+        return result
+
+    async def generate(
+        self,
+        model: str,
+        prompt: str,
+        options: Optional[Dict] = None,
+        keep_alive: Optional[str] = None,
+        timeout: Optional[float] = None,
+        priority: Optional[str] = PRIORITY_INTERACTIVE,
+        user: Optional[str] = None,
+    ) -> GenerateResult:
+        body = self._body(model, options, keep_alive, prompt=prompt, stream=False)
+        async with self._admitted(model, priority, user):
+            result = await self._request("POST", "/api/generate", body, timeout)
+        model_residency.record_load(model, result.get("load_duration"))
+        return result
+
+    async def generate_stream(
+        self,
+        model: str,
+        prompt: str,
+        options: Optional[Dict] = None,
+        keep_alive: Optional[str] = None,
+        timeout: Optional[float] = None,
+        priority: Optional[str] = PRIORITY_INTERACTIVE,
+        user: Optional[str] = None,
+        on_admitted: Optional[Callable[[], None]] = None,
+    ) -> AsyncIterator[GenerateResult]:
+        body = self._body(model, options, keep_alive, prompt=prompt, stream=True)
+        async for chunk in self._scheduled_stream("/api/generate", body, priority, user, timeout, on_admitted):
+            yield chunk
+
+    async def tags(self, timeout: Optional[float] = None) -> List[ModelInfo]:
+        """Installed models."""
+        return (await self._request("GET", "/api/tags", timeout=timeout)).get("models", [])
+
+    async def ps(self, timeout: Optional[float] = None) -> List[ModelInfo]:
+        """Models currently loaded in memory."""
+        return (await self._request("GET", "/api/ps", timeout=timeout)).get("models", [])
+
+
+ollama = OllamaClient()
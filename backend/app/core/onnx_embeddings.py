@@ -0,0 +1,208 @@
+# backend/app/core/onnx_embeddings.py
+"""
+ONNX Runtime backend for the embedding service (EMBEDDING_BACKEND=onnx).
+
+all-MiniLM-L6-v2 is exported once to ONNX, dynamically quantized to int8
+and cached under model_cache/onnx/. Pooling (attention-masked mean) and L2
+normalization mirror the sentence-transformers pipeline, so vectors stay
+compatible with everything already stored on disk.
+
+    python -m app.core.onnx_embeddings --parity      # cosine drift vs torch
+    python -m app.core.onnx_embeddings --bench       # latency / throughput, batch 1..256
+"""
+import os
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", str(os.cpu_count() or 4)))
+ONNX_QUANTIZE = os.getenv("EMBEDDING_ONNX_QUANTIZE", "true").lower() == "true"
+ONNX_MAX_SEQ_LEN = int(os.getenv("EMBEDDING_ONNX_MAX_SEQ_LEN", "256"))
+ONNX_MAX_DRIFT = float(os.getenv("EMBEDDING_ONNX_MAX_DRIFT", "0.02"))
+
+PARITY_TEXTS = [
+    "What is the capital of France?",
+    "How do I reset my password?",
+    "Explain the difference between a process and a thread.",
+    "def fibonacci(n): return n if n < 2 else fibonacci(n - 1) + fibonacci(n - 2)",
+    "The mitochondria is the powerhouse of the cell.",
+    "Quelle est la meilleure façon d'apprendre le Python ?",
+    "Summarize the attached quarterly report in three bullet points.",
+    "ok",
+]
+
+
+def _model_dir(model_name: str, cache_folder: str) -> str:
+    return os.path.join(cache_folder, "onnx", model_name.replace("/", "__"))
+
+
+# ================================================================
+# Export / quantization
+# ================================================================
+def export_onnx(model_name: str, cache_folder: str, quantize: bool = ONNX_QUANTIZE) -> str:
+    """Export the transformer to ONNX (and int8) once; returns the model path to load."""
+    out_dir = _model_dir(model_name, cache_folder)
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    int8_path = os.path.join(out_dir, "model.int8.onnx")
+    target = int8_path if quantize else fp32_path
+
+    if os.path.exists(target):
+        return target
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    if not os.path.exists(fp32_path):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        hf_name = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        print(f"📦 Exporting {hf_name} to ONNX...")
+
+        tokenizer = AutoTokenizer.from_pretrained(hf_name, cache_dir=cache_folder)
+        model = AutoModel.from_pretrained(hf_name, cache_dir=cache_folder).eval()
+        tokenizer.save_pretrained(out_dir)
+
+        sample = tokenizer(["export sample"], return_tensors="pt")
+        tmp = f"{fp32_path}.tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+                tmp,
+                input_names=["input_ids", "attention_mask", "token_type_ids"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "seq"},
+                    "attention_mask": {0: "batch", 1: "seq"},
+                    "token_type_ids": {0: "batch", 1: "seq"},
+                    "last_hidden_state": {0: "batch", 1: "seq"},
+                },
+                opset_version=14,
+            )
+        os.replace(tmp, fp32_path)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        print("🗜️ Quantizing ONNX model to int8...")
+        tmp = f"{int8_path}.tmp"
+        quantize_dynamic(fp32_path, tmp, weight_type=QuantType.QInt8)
+        os.replace(tmp, int8_path)
+
+    print(f"✅ ONNX embedding model ready: {target}")
+    return target
+
+
+# ================================================================
+# Encoder
+# ================================================================
+class OnnxEncoder:
+    def __init__(self, model_name: str, cache_folder: str, threads: int = ONNX_THREADS, quantize: bool = ONNX_QUANTIZE):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        path = export_onnx(model_name, cache_folder, quantize)
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.session = ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(os.path.dirname(path))
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.path = path
+        self.dim = int(self.session.get_outputs()[0].shape[-1])
+
+    def encode(self, texts: Sequence[str], batch_size: int = 32, normalize: bool = True) -> np.ndarray:
+        out = np.empty((len(texts), self.dim), dtype=np.float32)
+        for lo in range(0, len(texts), batch_size):
+            out[lo:lo + batch_size] = self._forward(list(texts[lo:lo + batch_size]))
+
+        if normalize:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out /= np.maximum(norms, 1e-12)
+        return out
+
+    def _forward(self, texts: List[str]) -> np.ndarray:
+        enc = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=ONNX_MAX_SEQ_LEN,
+            return_tensors="np",
+        )
+        feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+        hidden = self.session.run(None, feeds)[0]
+
+        # Mean pooling over real tokens, as in sentence-transformers' Pooling layer
+        mask = enc["attention_mask"][..., None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+
+# ================================================================
+# Parity check / benchmark
+# ================================================================
+def parity_check(torch_service, onnx_encoder: OnnxEncoder, texts: Optional[Sequence[str]] = None) -> Dict:
+    """Cosine drift of ONNX vectors against the torch model on the same texts."""
+    texts = list(texts or PARITY_TEXTS)
+    ref = torch_service.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+    got = onnx_encoder.encode(texts)
+    cos = np.sum(np.asarray(ref, dtype=np.float32) * got, axis=1)
+    drift = 1.0 - cos
+    return {
+        "texts": len(texts),
+        "model": onnx_encoder.path,
+        "mean_cosine": round(float(cos.mean()), 6),
+        "max_drift": round(float(drift.max()), 6),
+        "ok": bool(drift.max() <= ONNX_MAX_DRIFT),
+    }
+
+
+def benchmark(encode_fn, batch_sizes=(1, 2, 4, 8, 16, 32, 64, 128, 256), repeats: int = 5) -> List[Dict]:
+    rows = []
+    for bs in batch_sizes:
+        texts = [PARITY_TEXTS[i % len(PARITY_TEXTS)] for i in range(bs)]
+        encode_fn(texts)  # warm-up
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            encode_fn(texts)
+        elapsed = (time.perf_counter() - start) / repeats
+
+        rows.append({
+            "batch": bs,
+            "latency_ms": round(elapsed * 1000, 2),
+            "texts_per_s": round(bs / elapsed, 1),
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app.core.embeddings import EmbeddingService
+
+    parser = argparse.ArgumentParser(description="ONNX embedding backend: parity check and benchmark")
+    parser.add_argument("--parity", action="store_true")
+    parser.add_argument("--bench", action="store_true")
+    parser.add_argument("--fp32", action="store_true", help="benchmark the unquantized ONNX model")
+    args = parser.parse_args()
+
+    torch_service = EmbeddingService(backend="torch")
+    onnx_encoder = OnnxEncoder(torch_service.model_name, torch_service.cache_folder, quantize=not args.fp32)
+
+    if args.parity or not args.bench:
+        for key, value in parity_check(torch_service, onnx_encoder).items():
+            print(f"{key:>12}: {value}")
+
+    if args.bench:
+        torch_rows = benchmark(lambda t: torch_service.encode_direct(t, batch_size=len(t)))
+        onnx_rows = benchmark(lambda t: onnx_encoder.encode(t, batch_size=len(t)))
+        print(f"\n{'batch':>6} {'torch ms':>10} {'onnx ms':>10} {'torch/s':>10} {'onnx/s':>10} {'speedup':>8}")
+        for t, o in zip(torch_rows, onnx_rows):
+            print(
+                f"{t['batch']:>6} {t['latency_ms']:>10} {o['latency_ms']:>10} "
+                f"{t['texts_per_s']:>10} {o['texts_per_s']:>10} {t['latency_ms'] / o['latency_ms']:>7.2f}x"
+            )
@@ -22,7 +22,7 @@ class Orchestrator:
         """Generate cache key for repeated queries"""
         return query.lower().strip()[:200]
 
-    async def handle(self, user_id: Optional[str], query: str) -> str:
+    async def handle(self, user_id: Optional[str], query: str, chat_id: Optional[str] = None) -> str:
         """
         Handle user query with knowledge storage.
 
@@ -34,6 +34,7 @@ class Orchestrator:
         Args:
             user_id: User identifier (optional for guests)
             query: User's question/message
+            chat_id: Chat id (for guests, the key of their uploads)
 
         Returns:
             AI response string
@@ -51,6 +52,7 @@ class Orchestrator:
             answer = await generate_chat_response(
                 question=q,
                 user_id=user_id or "guest",
+                chat_id=chat_id,
                 contexts=None,  # Multi-turn handled internally
                 enable_web_search=True
             )
@@ -123,7 +125,7 @@ class Orchestrator:
 _orchestrator = Orchestrator()
 
 
-async def handle_query(user_id: Optional[str], query: str) -> str:
+async def handle_query(user_id: Optional[str], query: str, chat_id: Optional[str] = None) -> str:
     """
     Public interface for query handling.
 
@@ -137,4 +139,4 @@ async def handle_query(user_id: Optional[str], query: str) -> str:
     - Persistent intelligence
     - Full multi-turn memory support
     """
-    return await _orchestrator.handle(user_id, query)
\ No newline at end of file
+    return await _orchestrator.handle(user_id, query, chat_id)
\ No newline at end of file
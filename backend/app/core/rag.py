@@ -1,75 +1,181 @@
 # backend/app/core/rag.py
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader, TextLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import Chroma
+"""
+Per-upload RAG collections: build, query, group and delete.
+
+Each collection is a small directory (see data_processing/rag_collection.py)
+holding memory-mapped chunk texts and vectors, per-chunk source/page and,
+for large collections, an HNSW index. Documents are split and embedded with
+the app's own splitter and shared embedding model; nothing heavier than
+numpy/faiss is imported. Collections left by the former Chroma backend are
+converted on first open, or all at once with `python -m app.core.rag`.
+"""
 import os
+import json
 import uuid
 import shutil
-import gc
-import time
-from typing import List, Dict
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
+
+import numpy as np
+
+from app.core.collection_pool import CollectionPool, dir_size
+from app.core.embeddings import get_embedding_service
+from app.data_processing.extraction import iter_pdf_pages
+from app.data_processing.rag_collection import RagCollection, read_chroma_collection, split_text
 
 RAG_BASE_DIR = "rag_collections"
 os.makedirs(RAG_BASE_DIR, exist_ok=True)
 
-# Use consistent embedding model across all systems
-embeddings = HuggingFaceEmbeddings(
-    model_name="all-MiniLM-L6-v2",
-    model_kwargs={'device': 'cpu'},
-    encode_kwargs={'normalize_embeddings': True}
+# Federated queries: bounded fan-out, and a per-collection deadline so one slow collection cannot stall a turn
+RAG_FEDERATED_WORKERS = int(os.getenv("RAG_FEDERATED_WORKERS", "4"))
+RAG_COLLECTION_TIMEOUT = float(os.getenv("RAG_COLLECTION_TIMEOUT", "2.0"))
+
+# Named groups of collections (e.g. all files of one /upload-rag call)
+GROUPS_FILE = os.path.join(RAG_BASE_DIR, "groups.json")
+
+# Directories that could not be removed right away (Windows file locks); purged on start
+TRASH_PREFIX = ".trash-"
+# Collections still being built by an ingestion job
+BUILDING_PREFIX = ".building-"
+
+# Slice size while embedding a collection (progress granularity)
+RAG_EMBED_BATCH = int(os.getenv("RAG_EMBED_BATCH", "256"))
+
+TEXT_EXTENSIONS = (".txt", ".md", ".py", ".js", ".json", ".html", ".css")
+TEXT_ENCODINGS = ("utf-8", "cp1252", "latin-1")
+
+
+# ────────────────────────────────────────────────
+# Pooled collection handles
+# ────────────────────────────────────────────────
+def _collection_dir(collection_id: str) -> str:
+    return os.path.join(RAG_BASE_DIR, collection_id)
+
+
+def _open_collection(collection_id: str) -> RagCollection:
+    collection_dir = _collection_dir(collection_id)
+    if not os.path.exists(collection_dir):
+        raise FileNotFoundError(f"Collection {collection_id} not found")
+    if RagCollection.is_chroma(collection_dir):
+        migrate_chroma_collection(collection_id)
+    return RagCollection(collection_dir)
+
+
+def _close_collection(collection: RagCollection) -> None:
+    collection.close()
+
+
+def _purge_trash() -> None:
+    for name in os.listdir(RAG_BASE_DIR):
+        if name.startswith(TRASH_PREFIX):
+            shutil.rmtree(os.path.join(RAG_BASE_DIR, name), ignore_errors=True)
+
+
+collection_pool = CollectionPool(
+    opener=_open_collection,
+    closer=_close_collection,
+    sizer=lambda cid: dir_size(_collection_dir(cid)),
 )
+_purge_trash()
+
+_build_locks: Dict[str, threading.Lock] = {}
+_build_locks_guard = threading.Lock()
+
+_federated_pool = ThreadPoolExecutor(max_workers=RAG_FEDERATED_WORKERS, thread_name_prefix="rag-federated")
+_groups_lock = threading.Lock()
 
 
-def create_collection(files_content: List[Dict]) -> str:
+def _build_lock(collection_id: str) -> threading.Lock:
+    with _build_locks_guard:
+        return _build_locks.setdefault(collection_id, threading.Lock())
+
+
+def create_collection(
+    files_content: List[Dict],
+    collection_id: Optional[str] = None,
+    progress: Optional[Callable[..., None]] = None,
+) -> str:
     """
     Create a new RAG collection from uploaded files
     Returns: collection_id (UUID)
+
+    Each file is {"filename", "content": bytes} or {"filename", "path"}
+    (read in place, e.g. a content-addressed upload blob).
+
+    The collection is built in a staging directory and renamed into place
+    when complete, so queries never see a half-built collection and a retried
+    ingestion job simply starts over. `progress(stage, fraction)` is called
+    for the extract / chunk / embed / index stages.
     """
-    collection_id = str(uuid.uuid4())
-    collection_dir = os.path.join(RAG_BASE_DIR, collection_id)
-    os.makedirs(collection_dir, exist_ok=True)
+    collection_id = collection_id or str(uuid.uuid4())
+
+    # Content-addressed ids: two uploads of one document build it once
+    with _build_lock(collection_id):
+        if collection_exists(collection_id):
+            return collection_id
+        return _build_collection(files_content, collection_id, progress or (lambda stage, fraction=0.0: None))
+
+
+def _load_pages(path: str, filename: str, progress: Callable[..., None]) -> Iterator[Tuple[Optional[int], str]]:
+    """(page, text) of one file; page is None for formats without pages."""
+    ext = os.path.splitext(filename)[1].lower()
+
+    if ext == ".pdf":
+        # Page-parallel (and OCR for scanned pages); split each page as it arrives
+        yield from iter_pdf_pages(path, progress=lambda f: progress("extract", f))
+    elif ext == ".docx":
+        from docx import Document as DocxDocument
+
+        doc = DocxDocument(path)
+        yield None, "\n".join(p.text for p in doc.paragraphs)
+    elif ext in TEXT_EXTENSIONS:
+        with open(path, "rb") as f:
+            raw = f.read()
+        for enc in TEXT_ENCODINGS:
+            try:
+                yield None, raw.decode(enc)
+                return
+            except UnicodeDecodeError:
+                continue
+        print(f"⚠️  Cannot decode {filename}")
+    else:
+        print(f"⚠️  Unsupported type: {ext} ({filename})")
+
+
+def _build_collection(files_content: List[Dict], collection_id: str, progress: Callable[..., None]) -> str:
+    build_dir = os.path.join(RAG_BASE_DIR, f"{BUILDING_PREFIX}{collection_id}")
+
+    # Leftover of an interrupted attempt
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir, exist_ok=True)
+
+    sources: List[str] = []
+    chunks: List[Tuple[str, int, int]] = []  # (text, source number, page or -1)
+    loaded_any = False
+    progress("extract")
 
-    docs = []
-    
     for file in files_content:
-        temp_path = os.path.join(collection_dir, file["filename"])
+        temp_path = file.get("path") or os.path.join(build_dir, file["filename"])
 
         try:
             # Write file temporarily
-            with open(temp_path, "wb") as f:
-                f.write(file["content"])
-
-            ext = os.path.splitext(file["filename"])[1].lower()
-
-            # Load based on file type
-            if ext == ".pdf":
-                loader = PyPDFLoader(temp_path)
-            elif ext == ".docx":
-                loader = Docx2txtLoader(temp_path)
-            elif ext in [".txt", ".md", ".py", ".js", ".json", ".html", ".css"]:
-                # Try multiple encodings
-                for enc in ['utf-8', 'latin-1', 'cp1252', 'iso-8859-1']:
-                    try:
-                        loader = TextLoader(temp_path, encoding=enc)
-                        break
-                    except UnicodeDecodeError:
-                        continue
-                else:
-                    print(f"⚠️  Cannot decode {file['filename']}")
-                    continue
-            else:
-                print(f"⚠️  Unsupported type: {ext} ({file['filename']})")
-                continue
-
-            loaded_docs = loader.load()
-            
-            # Filter out empty documents
-            valid_docs = [d for d in loaded_docs if d.page_content.strip()]
-
-            if valid_docs:
-                docs.extend(valid_docs)
-                print(f"  ✅ Loaded {len(valid_docs)} pages from {file['filename']}")
+            if "path" not in file:
+                with open(temp_path, "wb") as f:
+                    f.write(file["content"])
+
+            source = len(sources)
+            sources.append(file["filename"])  # not the (possibly content-addressed) path
+            pages = 0
+            for page_no, text in _load_pages(temp_path, file["filename"], progress):
+                if text.strip():
+                    page = page_no if page_no is not None else -1
+                    chunks.extend((chunk, source, page) for chunk in split_text(text))
+                    pages += 1
+
+            if pages:
+                loaded_any = True
+                print(f"  ✅ Loaded {pages} pages from {file['filename']}")
             else:
                 print(f"  ⚠️  No content extracted from {file['filename']}")
 
@@ -77,50 +183,151 @@ def create_collection(files_content: List[Dict]) -> str:
             print(f"  ❌ Error processing {file['filename']}: {str(e)[:120]}")
             continue
 
-    if not docs:
-        shutil.rmtree(collection_dir, ignore_errors=True)
-        raise ValueError("No readable text extracted from uploaded files")
+        finally:
+            if "path" not in file and os.path.exists(temp_path):
+                os.remove(temp_path)
 
-    # Better chunking strategy
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=800,           # Smaller chunks = more precise matching
-        chunk_overlap=150,        # Good overlap to preserve context
-        length_function=len,
-        separators=["\n\n", "\n", ". ", "! ", "? ", " ", ""]
-    )
+    if not loaded_any:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise ValueError("No readable text extracted from uploaded files")
 
-    chunks = splitter.split_documents(docs)
+    progress("chunk")
     
     # Less strict filtering
-    chunks = [c for c in chunks if len(c.page_content.strip()) >= 50]
+    chunks = [c for c in chunks if len(c[0]) >= 50]
 
     if not chunks:
-        shutil.rmtree(collection_dir, ignore_errors=True)
+        shutil.rmtree(build_dir, ignore_errors=True)
         raise ValueError("No meaningful chunks after splitting")
 
     print(f"→ Created {len(chunks)} chunks")
 
     try:
-        vectorstore = Chroma.from_documents(
-            documents=chunks,
-            embedding=embeddings,
-            persist_directory=collection_dir,
-            collection_name="docs"
-        )
-        
-        vectorstore.persist()
-        
+        _write_collection(build_dir, collection_id, sources, chunks, progress)
+
+        # Keep a warm handle: the first question is not a cold open
+        collection_pool.put(collection_id, RagCollection(_collection_dir(collection_id)))
         print(f"✅ Vector store created → {collection_id}")
         return collection_id
-        
+
     except Exception as e:
-        shutil.rmtree(collection_dir, ignore_errors=True)
-        raise ValueError(f"Vector store creation failed: {str(e)}")
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise RuntimeError(f"Vector store creation failed: {str(e)}")
+
+
+def _write_collection(
+    build_dir: str,
+    collection_id: str,
+    sources: List[str],
+    chunks: List[Tuple[str, int, int]],
+    progress: Callable[..., None],
+) -> None:
+    """Embed the chunks, write the collection in build_dir and swap it into place."""
+    service = get_embedding_service()
+    texts = [c[0] for c in chunks]
+
+    # Embed in slices so a long document reports progress as it goes
+    vectors = []
+    for start in range(0, len(texts), RAG_EMBED_BATCH):
+        vectors.append(service.encode(texts[start:start + RAG_EMBED_BATCH]))
+        progress("embed", (start + RAG_EMBED_BATCH) / len(texts))
+
+    progress("index")
+    meta = np.array([(c[1], c[2]) for c in chunks], dtype=np.int32)
+    RagCollection.create(build_dir, texts, np.vstack(vectors), sources, meta).close()
+
+    # A retry after a crash between the rename and the job's commit finds the finished copy
+    collection_dir = _collection_dir(collection_id)
+    if os.path.exists(collection_dir):
+        delete_collection(collection_id)
+    os.replace(build_dir, collection_dir)
+
+
+# ────────────────────────────────────────────────
+# Former Chroma collections
+# ────────────────────────────────────────────────
+def migrate_chroma_collection(collection_id: str) -> bool:
+    """
+    Rebuild a collection written by the Chroma backend in the native format.
+    The stored chunks are kept as they are and re-embedded with the shared
+    model (the one Chroma was fed), so answers do not change.
+    """
+    with _build_lock(collection_id):
+        collection_dir = _collection_dir(collection_id)
+        if not RagCollection.is_chroma(collection_dir):
+            return False
+
+        sources: Dict[str, int] = {}
+        chunks = []
+        for text, source, page in read_chroma_collection(collection_dir):
+            # Old collections stored the temp path (with Windows separators)
+            name = os.path.basename(str(source).replace("\\", "/"))
+            chunks.append((text, sources.setdefault(name, len(sources)), page if isinstance(page, int) else -1))
+
+        print(f"🔁 Migrating Chroma collection {collection_id} ({len(chunks)} chunks)")
+        build_dir = os.path.join(RAG_BASE_DIR, f"{BUILDING_PREFIX}{collection_id}")
+        shutil.rmtree(build_dir, ignore_errors=True)
+        os.makedirs(build_dir)
+        try:
+            _write_collection(build_dir, collection_id, list(sources), chunks, lambda stage, fraction=0.0: None)
+        except Exception:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+        return True
+
+
+def migrate_chroma_collections() -> int:
+    """Convert every Chroma collection under RAG_BASE_DIR; returns how many were converted."""
+    migrated = 0
+    for collection_id in list_collections():
+        try:
+            migrated += migrate_chroma_collection(collection_id)
+        except Exception as e:
+            print(f"❌ Migration failed for {collection_id}: {e}")
+    return migrated
+
+
+def collection_exists(collection_id: str) -> bool:
+    return os.path.isdir(os.path.join(RAG_BASE_DIR, collection_id))
 
 
 # ────────────────────────────────────────────────
 # FIX 3: Improved query_collection() with better relevance filtering
 # ────────────────────────────────────────────────
+def _search_collection(collection_id: str, query_embedding: np.ndarray, k: int) -> List[Dict]:
+    """Top-k contexts of one collection for an already-embedded question."""
+    with collection_pool.acquire(collection_id) as collection:
+        results = collection.search(query_embedding, k=k*2)
+
+    contexts = []
+
+    for hit in results:
+        # Squared L2 distance of unit vectors (the scale Chroma reported): 2 - 2·cos
+        score = max(0.0, 2.0 - 2.0 * hit["ip"])
+
+        # L2 distance threshold: 0.0-0.5 (excellent), 0.5-1.5 (good), 1.5-3.5 (acceptable)
+        if score > 3.5:
+            print(f"  Skipping low-quality result (L2 distance: {score:.3f})")
+            continue
+
+        page = hit["page"]
+
+        # Convert L2 distance to similarity score (0-1)
+        similarity = max(0, 1 - (score / 4.0))
+
+        contexts.append({
+            "content": hit["content"].strip(),
+            "source": hit["source"],
+            "page": str(page) if page is not None else "N/A",
+            "score": round(float(score), 3),
+            "similarity": round(similarity, 3),
+            "relevance": "high" if score < 1.0 else "medium" if score < 2.5 else "low"
+        })
+
+    contexts.sort(key=lambda x: x["score"])
+    return contexts[:k]
+
+
 def query_collection(collection_id: str, question: str, k: int = 5) -> List[Dict]:
     """
     Query a RAG collection with improved similarity matching
@@ -131,47 +338,14 @@ def query_collection(collection_id: str, question: str, k: int = 5) -> List[Dict
         print(f"❌ Collection {collection_id} not found")
         return []
 
-    vectorstore = None
     try:
-        vectorstore = Chroma(
-            persist_directory=collection_dir,
-            embedding_function=embeddings,
-            collection_name="docs"
-        )
+        final_results = _search_collection(collection_id, get_embedding_service().encode_query(question), k)
 
-        results = vectorstore.similarity_search_with_score(question, k=k*2)
-
-        if not results:
+        if not final_results:
             print(f"⚠️  No results found for: {question}")
             return []
 
-        contexts = []
-        
-        for doc, score in results:
-            # L2 distance threshold: 0.0-0.5 (excellent), 0.5-1.5 (good), 1.5-3.5 (acceptable)
-            if score > 3.5:
-                print(f"  Skipping low-quality result (L2 distance: {score:.3f})")
-                continue
-
-            source = os.path.basename(doc.metadata.get("source", "unknown"))
-            page = doc.metadata.get("page", None)
-
-            # Convert L2 distance to similarity score (0-1)
-            similarity = max(0, 1 - (score / 4.0))
-
-            contexts.append({
-                "content": doc.page_content.strip(),
-                "source": source,
-                "page": str(page) if page is not None else "N/A",
-                "score": round(float(score), 3),
-                "similarity": round(similarity, 3),
-                "relevance": "high" if score < 1.0 else "medium" if score < 2.5 else "low"
-            })
-
-        contexts.sort(key=lambda x: x["score"])
-        final_results = contexts[:k]
-        
-        print(f"✅ Found {len(final_results)} relevant results (from {len(results)} candidates)")
+        print(f"✅ Found {len(final_results)} relevant results")
         return final_results
 
     except Exception as e:
@@ -179,36 +353,132 @@ def query_collection(collection_id: str, question: str, k: int = 5) -> List[Dict
         import traceback
         traceback.print_exc()
         return []
-        
-    finally:
-        if vectorstore is not None:
-            del vectorstore
-        gc.collect()
+
+
+# ────────────────────────────────────────────────
+# Federated query over several collections
+# ────────────────────────────────────────────────
+def query_collections(
+    collection_ids: List[str],
+    question: str,
+    k: int = 5,
+    timeout: float = RAG_COLLECTION_TIMEOUT,
+) -> List[Dict]:
+    """
+    Search several collections concurrently and return one global top-k.
+
+    The question is embedded once and every collection is searched on the
+    shared worker pool. Collections that have not answered within `timeout`
+    seconds (or fail) are left out of this turn instead of stalling it.
+    All collections use the same embedding model, so each hit's L2 distance
+    is mapped onto the shared 0-1 similarity scale and the hits are merged
+    by it; each result carries its "collection_id".
+    """
+    collection_ids = [
+        cid for cid in dict.fromkeys(collection_ids)
+        if os.path.isdir(os.path.join(RAG_BASE_DIR, cid))
+    ]
+    if not collection_ids:
+        return []
+    if len(collection_ids) == 1:
+        results = query_collection(collection_ids[0], question, k=k)
+        return [dict(r, collection_id=collection_ids[0]) for r in results]
+
+    query_embedding = get_embedding_service().encode_query(question)
+    futures = {
+        _federated_pool.submit(_search_collection, cid, query_embedding, k): cid
+        for cid in collection_ids
+    }
+    done, not_done = wait(futures, timeout=timeout)
+
+    for future in not_done:
+        future.cancel()  # still queued → never runs; running ones finish in the background
+        print(f"⏱️  Collection {futures[future]} missed the {timeout:.1f}s deadline → skipped")
+
+    merged, seen = [], set()
+    for future in done:
+        cid = futures[future]
+        try:
+            results = future.result()
+        except Exception as e:
+            print(f"❌ Query failed for collection {cid}: {e}")
+            continue
+        merged.extend(dict(r, collection_id=cid) for r in results)
+
+    merged.sort(key=lambda x: x["score"])
+    final_results = []
+    for r in merged:
+        # The same file uploaded into two collections yields the same chunk twice
+        if r["content"] in seen:
+            continue
+        seen.add(r["content"])
+        final_results.append(r)
+        if len(final_results) == k:
+            break
+
+    print(f"✅ Found {len(final_results)} relevant results across {len(done)}/{len(collection_ids)} collections")
+    return final_results
+
+
+# ────────────────────────────────────────────────
+# Named collection groups
+# ────────────────────────────────────────────────
+def _load_groups() -> Dict[str, List[str]]:
+    try:
+        with open(GROUPS_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def create_group(collection_ids: List[str], name: Optional[str] = None) -> str:
+    """Store a named set of collections (one multi-file upload); returns the group name."""
+    name = name or str(uuid.uuid4())
+    with _groups_lock:
+        groups = _load_groups()
+        groups[name] = list(dict.fromkeys(collection_ids))
+        tmp = f"{GROUPS_FILE}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(groups, f)
+        os.replace(tmp, GROUPS_FILE)
+    return name
+
+
+def resolve_collections(
+    collection_id: Optional[str] = None,
+    collection_ids: Optional[List[str]] = None,
+    group: Optional[str] = None,
+) -> List[str]:
+    """Collection ids a chat turn should search (single id, explicit list and/or group)."""
+    ids = [collection_id] if collection_id else []
+    ids.extend(collection_ids or [])
+    if group:
+        ids.extend(_load_groups().get(group, []))
+    return list(dict.fromkeys(ids))
 
 
 def delete_collection(collection_id: str) -> bool:
     """Delete a RAG collection"""
     collection_dir = os.path.join(RAG_BASE_DIR, collection_id)
-    
+
+    # Wait for in-flight queries, then close the pooled handle so no file stays open
+    if not collection_pool.invalidate(collection_id):
+        print(f"⚠️  Collection {collection_id} still in use → not deleted")
+        return False
+
     if not os.path.exists(collection_dir):
         return True
 
-    gc.collect()
-    time.sleep(0.2)
-
-    for attempt in range(5):
-        try:
-            shutil.rmtree(collection_dir)
-            print(f"✅ Deleted collection: {collection_id}")
-            return True
-        except PermissionError:
-            gc.collect()
-            time.sleep(0.5)
-        except Exception as e:
-            print(f"❌ Delete failed (attempt {attempt + 1}): {e}")
-            return False
+    try:
+        shutil.rmtree(collection_dir)
+    except PermissionError:
+        # Something outside the pool still holds a file (Windows): hide it now, purge on next start
+        os.replace(collection_dir, os.path.join(RAG_BASE_DIR, f"{TRASH_PREFIX}{collection_id}"))
+    except Exception as e:
+        print(f"❌ Delete failed: {e}")
+        return False
 
-    print(f"⚠️  Could not delete {collection_id} (files locked)")
+    print(f"✅ Deleted collection: {collection_id}")
     return True
 
 
@@ -219,7 +489,7 @@ def list_collections() -> List[str]:
     
     return [
         d for d in os.listdir(RAG_BASE_DIR) 
-        if os.path.isdir(os.path.join(RAG_BASE_DIR, d))
+        if os.path.isdir(os.path.join(RAG_BASE_DIR, d)) and not d.startswith((TRASH_PREFIX, BUILDING_PREFIX))
     ]
 
 
@@ -231,19 +501,15 @@ def get_collection_info(collection_id: str) -> Dict:
         return {"exists": False}
     
     try:
-        vectorstore = Chroma(
-            persist_directory=collection_dir,
-            embedding_function=embeddings,
-            collection_name="docs"
-        )
-        
-        collection = vectorstore._collection
-        count = collection.count()
+        with collection_pool.acquire(collection_id) as collection:
+            count = len(collection)
+            sources = list(collection.sources)
         
         return {
             "exists": True,
             "collection_id": collection_id,
             "document_count": count,
+            "sources": sources,
             "location": collection_dir
         }
         
@@ -251,4 +517,8 @@ def get_collection_info(collection_id: str) -> Dict:
         return {
             "exists": True,
             "error": str(e)
-        }
\ No newline at end of file
+        }
+
+
+if __name__ == "__main__":
+    print(f"✅ Migrated {migrate_chroma_collections()} Chroma collection(s)")
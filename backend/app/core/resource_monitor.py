@@ -0,0 +1,140 @@
+# backend/app/core/resource_monitor.py
+"""
+Background sampler of host resources and Ollama's model state.
+
+A task on the server loop samples RAM, CPU and the installed / loaded
+Ollama models every RESOURCE_SAMPLE_SECONDS and publishes the result as an
+immutable ResourceSnapshot. Readers (model selection on every chat turn)
+just take `resource_monitor.snapshot`: one attribute read, no lock, no
+psutil call and no HTTP request on the request path.
+
+CPU is measured over the interval since the previous sample
+(psutil.cpu_percent(interval=None)), so sampling never sleeps. The
+installed-model list changes rarely and is refreshed every
+RESOURCE_TAGS_SECONDS; the loaded set (/api/ps) on every sample. The last
+RESOURCE_HISTORY snapshots are kept for dashboards (/stats/resources).
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import psutil
+
+from app.core.ollama_client import OllamaError, ollama
+
+RESOURCE_SAMPLE_SECONDS = float(os.getenv("RESOURCE_SAMPLE_SECONDS", "2.0"))
+RESOURCE_TAGS_SECONDS = float(os.getenv("RESOURCE_TAGS_SECONDS", "30"))
+RESOURCE_HISTORY = int(os.getenv("RESOURCE_HISTORY", "900"))  # 30 min at 2 s
+
+_GB = 1024 ** 3
+
+
+class ResourceSnapshot(NamedTuple):
+    taken_at: float
+    ram_total_gb: float
+    ram_available_gb: float
+    ram_percent: float
+    cpu_count: int
+    cpu_percent: float
+    ollama_up: bool
+    installed_models: Tuple[str, ...]
+    loaded_models: Tuple[str, ...]
+
+    def as_dict(self) -> Dict:
+        d = self._asdict()
+        d["installed_models"] = list(self.installed_models)
+        d["loaded_models"] = list(self.loaded_models)
+        return d
+
+
+def sample_host() -> Dict:
+    """RAM / CPU right now (non-blocking; CPU is measured since the previous call)."""
+    vm = psutil.virtual_memory()
+    return {
+        "ram_total_gb": vm.total / _GB,
+        "ram_available_gb": vm.available / _GB,
+        "ram_percent": vm.percent,
+        "cpu_count": psutil.cpu_count(logical=True) or 1,
+        "cpu_percent": psutil.cpu_percent(interval=None),
+    }
+
+
+class ResourceMonitor:
+    def __init__(self, interval: float = RESOURCE_SAMPLE_SECONDS, history: int = RESOURCE_HISTORY):
+        self.interval = interval
+        self.snapshot: Optional[ResourceSnapshot] = None
+        self._history: Deque[ResourceSnapshot] = deque(maxlen=history)
+        self._installed: Tuple[str, ...] = ()
+        self._tags_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    # ------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------
+    async def start(self) -> None:
+        """Take a first sample (so readers never see None) and start the sampling task."""
+        if self._task is not None:
+            return
+        psutil.cpu_percent(interval=None)  # primes the CPU counter
+        await self.sample()
+        self._task = asyncio.create_task(self._loop(), name="resource-monitor")
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sample()
+            except Exception as e:
+                print(f"⚠️ Resource sample failed: {e}")
+
+    # ------------------------------------------------------------
+    # Sampling
+    # ------------------------------------------------------------
+    async def sample(self) -> ResourceSnapshot:
+        host = sample_host()
+        now = time.time()
+        ollama_up, loaded = True, ()
+        try:
+            if not self._installed or now - self._tags_at >= RESOURCE_TAGS_SECONDS:
+                self._installed = tuple(m["name"] for m in await ollama.tags(timeout=self.interval * 2))
+                self._tags_at = now
+            loaded = tuple(m["name"] for m in await ollama.ps(timeout=self.interval * 2))
+        except OllamaError:
+            # Keep the last known installed list; nothing is loaded if Ollama is down
+            ollama_up = False
+
+        snapshot = ResourceSnapshot(taken_at=now, ollama_up=ollama_up, installed_models=self._installed,
+                                    loaded_models=loaded, **host)
+        self._history.append(snapshot)
+        self.snapshot = snapshot  # single reference swap: readers see the old or the new one
+        return snapshot
+
+    # ------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------
+    def history(self, limit: Optional[int] = None) -> List[ResourceSnapshot]:
+        items = list(self._history)
+        return items[-limit:] if limit else items
+
+    def stats(self, limit: Optional[int] = None) -> Dict:
+        current = self.snapshot
+        return {
+            "interval_seconds": self.interval,
+            "running": self._task is not None,
+            "current": current.as_dict() if current is not None else None,
+            "history": [s.as_dict() for s in self.history(limit)],
+        }
+
+
+resource_monitor = ResourceMonitor()
@@ -1,14 +1,18 @@
 # backend/app/core/vector.py
 import os
-import json
 import threading
-from typing import List, Dict, Any
+import uuid
+from typing import List, Dict, Any, Optional
 
 import numpy as np
-import faiss
 
 from app.db.database import SessionLocal
 from app.db.models import KnowledgeMemory
+from app.data_processing.columnar_store import ColumnarStore, migrate_legacy
+from app.data_processing.embed_dataset import search_user_uploads
+from app.data_processing.lexical_index import HYBRID_DENSE_K, LexicalIndex, lexical_candidates, rrf_fuse
+from app.core.embeddings import get_embedding_service
+from app.core.knowledge_index import KNOWLEDGE_DRAIN_TIMEOUT, KnowledgeIndex
 
 # =====================================================
 # PATHS (EXISTING + NEW)
@@ -21,7 +25,10 @@ DATA_DIR = os.path.join(BASE_DIR, "data")
 TEXTS_PATH = os.path.join(DATA_DIR, "texts.json")
 VECTORS_PATH = os.path.join(DATA_DIR, "vectors.npy")
 
-# NEW (KNOWLEDGE VECTORS)
+# Append-only segment store that replaces TEXTS_PATH / VECTORS_PATH on first load
+STORE_PATH = os.path.join(DATA_DIR, "store")
+
+# NEW (KNOWLEDGE VECTORS) — legacy inputs, migrated into the write-behind index
 K_TEXTS_PATH = os.path.join(DATA_DIR, "knowledge_texts.json")
 K_VECTORS_PATH = os.path.join(DATA_DIR, "knowledge_vectors.npy")
 
@@ -29,114 +36,84 @@ os.makedirs(DATA_DIR, exist_ok=True)
 
 
 # =====================================================
-# GLOBAL STATE - THREAD-SAFE SINGLETON MODEL
+# EMBEDDINGS - SHARED PROCESS-WIDE SERVICE
 # =====================================================
 
-_sentence_transformer = None
-_model_lock = threading.Lock()  # Ensures thread-safe lazy loading
-
-
 def get_sentence_transformer():
     """
-    Thread-safe singleton for SentenceTransformer.
-    Loads the model only once, even under concurrent requests.
-    Prints only in non-production environments.
+    The shared SentenceTransformer owned by app.core.embeddings.
+    Kept for callers that warm the model up at startup.
     """
-    global _sentence_transformer
-
-    if _sentence_transformer is not None:
-        return _sentence_transformer
-
-    with _model_lock:
-        if _sentence_transformer is None:
-            # Only show loading message in development
-            if os.getenv("ENV", "development") != "production":
-                print("🔥 Loading SentenceTransformer (first time only)...")
-
-            from sentence_transformers import SentenceTransformer
-
-            # Optional: specify device ("cuda" if available, else "cpu")
-            # You can also set cache_folder to avoid re-downloading
-            _sentence_transformer = SentenceTransformer(
-                "all-MiniLM-L6-v2",
-                device="cpu",  # Change to "cuda" if you have GPU support
-                cache_folder=os.path.join(BASE_DIR, "model_cache")
-            )
-
-            if os.getenv("ENV", "development") != "production":
-                print("✅ SentenceTransformer loaded successfully")
-
-    return _sentence_transformer
+    return get_embedding_service().model
 
 
 # ---- Legacy file vectors ----
-_index = None
-_documents: List[str] = []
-_vectors = None
+_store: ColumnarStore | None = None
+_lex: LexicalIndex | None = None
 _loaded = False
 
 # ---- Knowledge vectors ----
-_k_index = None
-_k_vectors = None
-_k_meta: List[Dict[str, Any]] = []
+_k_index: KnowledgeIndex | None = None
 _k_loaded = False
 
 _lock = threading.Lock()  # For file/vector modifications
 
 
-# =====================================================
-# UTILS
-# =====================================================
-
-def _normalize(v: np.ndarray) -> np.ndarray:
-    norm = np.linalg.norm(v, axis=1, keepdims=True)
-    norm[norm == 0] = 1.0
-    return v / norm
-
-
 # =====================================================
 # EXISTING FILE VECTOR STORE (UNCHANGED LOGIC)
 # =====================================================
 
 def load_vector_store():
-    global _index, _documents, _vectors, _loaded
+    global _store, _lex, _loaded
 
     if _loaded:
         return
 
-    if not os.path.exists(TEXTS_PATH) or not os.path.exists(VECTORS_PATH):
-        _loaded = True
-        return
-
     try:
-        with open(TEXTS_PATH, "r", encoding="utf-8") as f:
-            _documents = json.load(f)
-
-        _vectors = _normalize(np.load(VECTORS_PATH).astype("float32"))
-
-        dim = _vectors.shape[1]
-        _index = faiss.IndexFlatIP(dim)
-        _index.add(_vectors)
+        if ColumnarStore.exists(STORE_PATH):
+            _store = ColumnarStore(STORE_PATH)
+        elif os.path.exists(TEXTS_PATH) and os.path.exists(VECTORS_PATH):
+            _store = migrate_legacy(TEXTS_PATH, VECTORS_PATH, None, STORE_PATH)
+        if _store is not None:
+            _store.start_compactor()
+            _lex = LexicalIndex.for_store(_store)
     finally:
         _loaded = True
 
 
-def retrieve_context(query: str, k: int = 4) -> List[str]:
+def retrieve_context(query: str, k: int = 4, user_id: Optional[str] = None) -> List[str]:
+    """
+    Hybrid retrieval over the file store (dense + BM25, fused with RRF),
+    plus the caller's own uploads when user_id is given.
+    """
     if not _loaded:
         load_vector_store()
 
-    if _index is None:
+    has_store = _store is not None and len(_store) > 0
+    if not has_store and user_id is None:
         return []
 
-    model = get_sentence_transformer()
-    q_vec = _normalize(model.encode([query], convert_to_numpy=True).astype("float32"))
+    q_vec = get_embedding_service().encode_query(query)
+
+    rankings, texts = [], {}
+    if has_store:
+        if _store.refresh() and _lex is not None:
+            _lex.sync_in_background()
+        _, top = _store.search(q_vec, min(max(k, HYBRID_DENSE_K), len(_store)))
+        rankings.append([int(i) for i in top])
+        rankings.append(lexical_candidates(_store, _lex, query, q_vec))
+
+    if user_id is not None:
+        uploads = search_user_uploads(q_vec, user_id, k)
+        rankings.append([("upload", i) for i in range(len(uploads))])
+        texts.update({("upload", i): text for i, (_, text) in enumerate(uploads)})
 
-    D, I = _index.search(q_vec, min(k, len(_documents)))
-    return [_documents[i] for i in I[0] if i < len(_documents)]
+    fused = [key for key, _ in rrf_fuse(rankings)[:k]]
+    return [texts[key] if key in texts else _store.text(key) for key in fused]
 
 
 def append_documents(new_texts: List[str]) -> int:
-    global _vectors, _documents, _index, _loaded
+    global _store, _lex
 
     if not new_texts:
         return 0
@@ -144,24 +121,20 @@ def append_documents(new_texts: List[str]) -> int:
     if not _loaded:
         load_vector_store()
 
-    model = get_sentence_transformer()
-    vecs = _normalize(model.encode(new_texts, convert_to_numpy=True).astype("float32"))
+    vecs = get_embedding_service().encode(new_texts)
 
     with _lock:
-        if _vectors is None:
-            _vectors = vecs
-            _documents = list(new_texts)
-            dim = vecs.shape[1]
-            _index = faiss.IndexFlatIP(dim)
-            _index.add(vecs)
+        if _store is None:
+            _store = ColumnarStore.create(STORE_PATH, list(new_texts), vecs)
+            _store.start_compactor()
         else:
-            _vectors = np.vstack([_vectors, vecs])
-            _documents.extend(new_texts)
-            _index.add(vecs)
+            # One new segment per call — no full rewrite of texts/vectors
+            _store.append(list(new_texts), vecs)
 
-        with open(TEXTS_PATH, "w", encoding="utf-8") as f:
-            json.dump(_documents, f)
-        np.save(VECTORS_PATH, _vectors)
+        if _lex is None:
+            _lex = LexicalIndex.for_store(_store)
+        else:
+            _lex.sync_in_background()
 
     return len(new_texts)
 
@@ -171,84 +144,91 @@ def append_documents(new_texts: List[str]) -> int:
 # =====================================================
 
 def load_knowledge_vectors():
-    global _k_index, _k_vectors, _k_meta, _k_loaded
+    global _k_index, _k_loaded
 
     if _k_loaded:
         return
 
-    if not os.path.exists(K_TEXTS_PATH) or not os.path.exists(K_VECTORS_PATH):
-        _k_loaded = True
-        return
+    with _lock:
+        if not _k_loaded:
+            index = KnowledgeIndex(DATA_DIR, stats_fn=_knowledge_stats)
+            index.load(legacy_texts=K_TEXTS_PATH, legacy_vectors=K_VECTORS_PATH)
+            index.start_compactor()
+            _k_index = index
+            _k_loaded = True
 
-    with open(K_TEXTS_PATH, "r", encoding="utf-8") as f:
-        _k_meta = json.load(f)
 
-    _k_vectors = _normalize(np.load(K_VECTORS_PATH).astype("float32"))
+def _knowledge_stats(knowledge_ids: List[str]) -> Dict[str, tuple]:
+    """
+    (confidence, usage_count) from KnowledgeMemory for the compactor's
+    eviction policy. Ids missing from the result were deleted upstream.
+    """
+    out: Dict[str, tuple] = {}
+    db = SessionLocal()
+    try:
+        for lo in range(0, len(knowledge_ids), 1000):
+            batch = []
+            for kid in knowledge_ids[lo:lo + 1000]:
+                try:
+                    batch.append(uuid.UUID(kid))
+                except ValueError:
+                    continue
+            rows = (
+                db.query(KnowledgeMemory.id, KnowledgeMemory.confidence, KnowledgeMemory.usage_count)
+                .filter(KnowledgeMemory.id.in_(batch))
+                .all()
+            )
+            for kid, confidence, usage_count in rows:
+                out[str(kid)] = (confidence or 0.0, usage_count or 0)
+    finally:
+        db.close()
+    return out
 
-    dim = _k_vectors.shape[1]
-    _k_index = faiss.IndexFlatIP(dim)
-    _k_index.add(_k_vectors)
 
-    _k_loaded = True
+def index_knowledge_entry(knowledge_id: str, text: str, confidence: float):
+    """
+    Journal the entry and return; encoding, indexing and the disk flush
+    happen in the knowledge index's background worker.
+    """
+    if not _k_loaded:
+        load_knowledge_vectors()
 
+    _k_index.enqueue(knowledge_id, text, confidence)
 
-def index_knowledge_entry(knowledge_id: str, text: str, confidence: float):
-    global _k_vectors, _k_meta, _k_index, _k_loaded
 
+def delete_knowledge_entry(knowledge_id: str):
+    """Tombstone a knowledge entry; it stops matching immediately after the worker applies it."""
     if not _k_loaded:
         load_knowledge_vectors()
 
-    model = get_sentence_transformer()
-    vec = _normalize(model.encode([text], convert_to_numpy=True).astype("float32"))
+    _k_index.delete(knowledge_id)
 
-    meta = {
-        "knowledge_id": knowledge_id,
-        "confidence": confidence,
-    }
 
-    with _lock:
-        if _k_vectors is None:
-            _k_vectors = vec
-            _k_meta = [meta]
-            dim = vec.shape[1]
-            _k_index = faiss.IndexFlatIP(dim)
-            _k_index.add(vec)
-        else:
-            _k_vectors = np.vstack([_k_vectors, vec])
-            _k_meta.append(meta)
-            _k_index.add(vec)
+def update_knowledge_stats(knowledge_id: str, confidence: float = None, usage_count: int = None) -> bool:
+    """Push new confidence / usage_count into the index's side table (no re-embedding)."""
+    if not _k_loaded:
+        load_knowledge_vectors()
 
-        with open(K_TEXTS_PATH, "w", encoding="utf-8") as f:
-            json.dump(_k_meta, f)
-        np.save(K_VECTORS_PATH, _k_vectors)
+    return _k_index.update_stats(str(knowledge_id), confidence, usage_count)
+
+
+def flush_knowledge_index(timeout: Optional[float] = KNOWLEDGE_DRAIN_TIMEOUT) -> bool:
+    """Wait (up to `timeout`) for queued knowledge entries to be indexed and written (shutdown)."""
+    if _k_index is None:
+        return True
+    return _k_index.drain(timeout)
 
 
 def retrieve_knowledge(query: str, k: int = 5) -> List[Dict[str, Any]]:
     if not _k_loaded:
         load_knowledge_vectors()
 
-    if _k_index is None:
+    if len(_k_index) == 0:
         return []
 
-    model = get_sentence_transformer()
-    q_vec = _normalize(model.encode([query], convert_to_numpy=True).astype("float32"))
-
-    D, I = _k_index.search(q_vec, min(k, len(_k_meta)))
-
-    results = []
-    for score, idx in zip(D[0], I[0]):
-        if idx >= len(_k_meta):
-            continue
-        meta = _k_meta[idx]
-        final_score = float(score) * float(meta["confidence"])
-        results.append(
-            {
-                "knowledge_id": meta["knowledge_id"],
-                "score": final_score,
-            }
-        )
+    q_vec = get_embedding_service().encode_query(query)
 
-    return sorted(results, key=lambda x: x["score"], reverse=True)
+    return _k_index.search(q_vec, k)
 
 
 # =====================================================
@@ -259,7 +239,10 @@ __all__ = [
     "retrieve_context",
     "append_documents",
     "index_knowledge_entry",
+    "delete_knowledge_entry",
+    "update_knowledge_stats",
     "retrieve_knowledge",
+    "flush_knowledge_index",
     "load_vector_store",
     "get_sentence_transformer",  # Optional: expose if needed elsewhere
 ]
\ No newline at end of file
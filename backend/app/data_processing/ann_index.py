@@ -0,0 +1,256 @@
+# backend/app/data_processing/ann_index.py
+"""
+Approximate nearest-neighbour index over the columnar vector store.
+
+Engines (ANN_ENGINE):
+    flat      → exact scan only (no FAISS index is built)
+    ivf_flat  → IVF with full vectors, tuned by ANN_NPROBE
+    ivf_pq    → IVF with product-quantized codes, tuned by ANN_NPROBE
+    hnsw      → HNSW graph, tuned by ANN_EF_SEARCH
+
+The index is persisted next to the store's vectors with faiss.write_index.
+Row ids in the index are global row numbers in the store (segment
+compaction preserves them), so an index that lags behind the store (e.g.
+after a restart) is caught up by adding the tail.
+Corpora smaller than ANN_MIN_VECTORS keep using exact search.
+"""
+import math
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.data_processing.columnar_store import ColumnarStore
+
+ANN_ENGINE = os.getenv("ANN_ENGINE", "hnsw").lower()
+ANN_MIN_VECTORS = int(os.getenv("ANN_MIN_VECTORS", "20000"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "16"))
+ANN_EF_SEARCH = int(os.getenv("ANN_EF_SEARCH", "64"))
+ANN_HNSW_M = int(os.getenv("ANN_HNSW_M", "32"))
+ANN_PQ_SUBQUANTIZERS = int(os.getenv("ANN_PQ_SUBQUANTIZERS", "48"))
+
+# Rows added in memory before the index file is rewritten
+ANN_SAVE_EVERY = int(os.getenv("ANN_SAVE_EVERY", "5000"))
+
+INDEX_NAME = "index.faiss"
+ENGINES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+_ADD_BLOCK_ROWS = 65536
+
+
+# ================================================================
+# Helpers
+# ================================================================
+def _as_f32(block: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(block, dtype=np.float32)
+
+
+def _nlist_for(n: int) -> int:
+    return max(1, min(65536, int(4 * math.sqrt(n))))
+
+
+def _pq_m_for(dim: int) -> int:
+    """Largest sub-quantizer count <= ANN_PQ_SUBQUANTIZERS that divides dim."""
+    for m in range(min(ANN_PQ_SUBQUANTIZERS, dim), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def _new_index(engine: str, dim: int, n: int):
+    if engine == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, ANN_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = max(40, ANN_HNSW_M * 2)
+        return index
+
+    nlist = _nlist_for(n)
+    quantizer = faiss.IndexFlatIP(dim)
+    if engine == "ivf_flat":
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    if engine == "ivf_pq":
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, _pq_m_for(dim), 8, faiss.METRIC_INNER_PRODUCT)
+
+    raise ValueError(f"Unknown ANN engine '{engine}'. Use one of: {', '.join(ENGINES)}")
+
+
+# ================================================================
+# Index
+# ================================================================
+class AnnIndex:
+    def __init__(self, store: ColumnarStore, engine: str = ANN_ENGINE):
+        if engine not in ENGINES or engine == "flat":
+            raise ValueError(f"AnnIndex needs an approximate engine, got '{engine}'")
+        self.store = store
+        self.engine = engine
+        self.path = os.path.join(store.root, INDEX_NAME)
+        self.index = None
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------
+    # Build / load
+    # ------------------------------------------------------------
+    @classmethod
+    def for_store(cls, store: ColumnarStore, engine: str = ANN_ENGINE) -> Optional["AnnIndex"]:
+        """
+        Open (or train) the ANN index for a store, or return None when exact
+        search should be used instead.
+        """
+        if engine == "flat" or len(store) < ANN_MIN_VECTORS:
+            return None
+
+        ann = cls(store, engine)
+        if os.path.exists(ann.path):
+            try:
+                ann._load()
+                return ann
+            except Exception as e:
+                print(f"⚠️ ANN index unusable ({e}) → retraining")
+
+        ann.build()
+        return ann
+
+    def _load(self) -> None:
+        index = faiss.read_index(self.path)
+        if index.d != self.store.dim or index.ntotal > len(self.store):
+            raise ValueError("index does not match the vector store")
+        self.index = index
+        self._configure()
+
+        missing = len(self.store) - index.ntotal
+        if missing:
+            print(f"➕ ANN index catching up on {missing:,} rows")
+            self._add_rows(index.ntotal, len(self.store))
+            self.save()
+        print(f"→ ANN index loaded ({self.engine}, {self.index.ntotal:,} vectors)")
+
+    def build(self) -> None:
+        n, dim = len(self.store), self.store.dim
+        print(f"🧭 Training {self.engine} ANN index over {n:,} vectors...")
+        start = time.time()
+
+        index = _new_index(self.engine, dim, n)
+        if not index.is_trained:
+            nlist = _nlist_for(n)
+            sample_n = min(n, max(nlist * 64, 10000))
+            sample_ids = np.sort(np.random.default_rng(0).choice(n, size=sample_n, replace=False))
+            index.train(self.store.take(sample_ids))
+
+        self.index = index
+        self._configure()
+        self._add_rows(0, n)
+        self.save()
+        print(f"✅ ANN index ready in {time.time() - start:.1f}s")
+
+    def _configure(self) -> None:
+        if self.engine == "hnsw":
+            self.index.hnsw.efSearch = ANN_EF_SEARCH
+        else:
+            self.index.nprobe = ANN_NPROBE
+
+    def _add_rows(self, start: int, end: int) -> None:
+        for lo in range(start, end, _ADD_BLOCK_ROWS):
+            self.index.add(self.store.rows(lo, min(end, lo + _ADD_BLOCK_ROWS)))
+
+    def save(self) -> None:
+        # Unique temp name: several workers may save the same index at once
+        tmp = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        faiss.write_index(self.index, tmp)
+        os.replace(tmp, self.path)
+        self._unsaved = 0
+
+    # ------------------------------------------------------------
+    # Incremental updates
+    # ------------------------------------------------------------
+    def sync(self) -> int:
+        """Add every store row the index has not seen yet. Returns rows added."""
+        with self._lock:
+            start, end = self.index.ntotal, len(self.store)
+            if end <= start:
+                return 0
+            self._add_rows(start, end)
+            self._unsaved += end - start
+            if self._unsaved >= ANN_SAVE_EVERY:
+                self.save()
+            return end - start
+
+    # ------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------
+    def search(self, q_vec: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        q = _as_f32(q_vec).reshape(1, -1)
+        # sync() adds rows under the same lock; FAISS add and search must not overlap
+        with self._lock:
+            scores, ids = self.index.search(q, k)
+        valid = ids[0] >= 0
+        return scores[0][valid], ids[0][valid].astype(np.int64)
+
+
+# ================================================================
+# Recall@k report (ANN vs exact)
+# ================================================================
+def recall_report(store: ColumnarStore, ann: AnnIndex, k: int = 10, queries: int = 200) -> Dict:
+    """
+    Use stored vectors as queries and compare ANN results with exact search.
+    Reports recall@k and mean per-query latency of both paths.
+    """
+    n = len(store)
+    if n == 0:
+        return {"queries": 0}
+
+    rng = np.random.default_rng(1)
+    sample = rng.choice(n, size=min(queries, n), replace=False)
+
+    hits = 0
+    exact_time = ann_time = 0.0
+    for idx in sample:
+        q = store.take([idx])[0]
+
+        t0 = time.perf_counter()
+        _, exact_ids = store.search(q, k)
+        t1 = time.perf_counter()
+        _, ann_ids = ann.search(q, k)
+        t2 = time.perf_counter()
+
+        exact_time += t1 - t0
+        ann_time += t2 - t1
+        hits += len(set(exact_ids.tolist()) & set(ann_ids.tolist()))
+
+    total = len(sample) * min(k, n)
+    return {
+        "engine": ann.engine,
+        "nprobe": ANN_NPROBE if ann.engine != "hnsw" else None,
+        "ef_search": ANN_EF_SEARCH if ann.engine == "hnsw" else None,
+        "k": k,
+        "queries": len(sample),
+        "recall_at_k": round(hits / total, 4) if total else 0.0,
+        "exact_ms": round(exact_time / len(sample) * 1000, 3),
+        "ann_ms": round(ann_time / len(sample) * 1000, 3),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app.data_processing.embed_dataset import STORE_DIR
+
+    parser = argparse.ArgumentParser(description="Build the ANN index and report recall@k against exact search")
+    parser.add_argument("--engine", default=ANN_ENGINE if ANN_ENGINE != "flat" else "hnsw", choices=ENGINES[1:])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+
+    store = ColumnarStore(STORE_DIR)
+    ann = AnnIndex(store, args.engine)
+    if args.rebuild or not os.path.exists(ann.path):
+        ann.build()
+    else:
+        ann._load()
+
+    for key, value in recall_report(store, ann, k=args.k, queries=args.queries).items():
+        print(f"{key:>12}: {value}")
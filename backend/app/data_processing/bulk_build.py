@@ -0,0 +1,300 @@
+# backend/app/data_processing/bulk_build.py
+"""
+Parallel, resumable bulk build of the dataset vector store.
+
+Pipeline:
+    sources  → work units (byte ranges of qa_part_*.jsonl files, or record
+               batches streamed from a Hugging Face dataset)
+    parse    → process pool: JSON decode, clean, chunk, hash
+    dedup    → parent, in source order (same result as a serial build)
+    encode   → BUILD_ENCODE_WORKERS processes, large batches
+    write    → every BUILD_SHARD_ROWS chunks become one store segment,
+               followed by a checkpoint
+
+The build happens in STORE_DIR + ".building" and is renamed into place when
+complete. An interrupted build resumes after the last checkpointed unit;
+chunks already in a segment are skipped by the store's digest check.
+"""
+import collections
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.data_processing.columnar_store import ColumnarStore
+from app.data_processing.embed_dataset import chunk_text, compute_digest, is_clean_text
+
+BUILD_PARSE_WORKERS = int(os.getenv("BUILD_PARSE_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+BUILD_ENCODE_WORKERS = int(os.getenv("BUILD_ENCODE_WORKERS", "1"))
+BUILD_ENCODE_BATCH = int(os.getenv("BUILD_ENCODE_BATCH", "256"))
+BUILD_SHARD_ROWS = int(os.getenv("BUILD_SHARD_ROWS", "50000"))
+BUILD_BLOCK_BYTES = int(os.getenv("BUILD_BLOCK_BYTES", str(32 * 1024 * 1024)))
+
+# Optional streaming source, e.g. BUILD_HF_DATASET=squad BUILD_HF_SPLIT=train
+BUILD_HF_DATASET = os.getenv("BUILD_HF_DATASET", "")
+BUILD_HF_CONFIG = os.getenv("BUILD_HF_CONFIG") or None
+BUILD_HF_SPLIT = os.getenv("BUILD_HF_SPLIT", "train")
+BUILD_HF_QUESTION_FIELD = os.getenv("BUILD_HF_QUESTION_FIELD", "question")
+BUILD_HF_ANSWER_FIELD = os.getenv("BUILD_HF_ANSWER_FIELD", "answer")
+BUILD_HF_UNIT_ROWS = int(os.getenv("BUILD_HF_UNIT_ROWS", "20000"))
+
+CHECKPOINT_NAME = "build_checkpoint.json"
+
+
+# ================================================================
+# Parse workers
+# ================================================================
+def _chunks_for_item(item: Dict, q_field: str = "question", a_field: str = "answer") -> List[str]:
+    q = str(item.get(q_field) or "").strip()
+    a = item.get(a_field) or ""
+    if isinstance(a, dict):  # e.g. SQuAD-style {"text": [...]}
+        a = " ".join(map(str, a.get("text") or []))
+    elif isinstance(a, list):
+        a = " ".join(map(str, a))
+    merged = f"{q}\n\n{str(a).strip()}".strip()
+    if not merged or not is_clean_text(merged):
+        return []
+    return chunk_text(merged)
+
+
+def _dedup_unit(chunks: List[str]) -> List[Tuple[int, str]]:
+    seen, out = set(), []
+    for chunk in chunks:
+        d = compute_digest(chunk)
+        if d not in seen:
+            seen.add(d)
+            out.append((d, chunk))
+    return out
+
+
+def _parse_file_range(path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    """Parse the lines whose first byte falls in [start, end)."""
+    chunks = []
+    with open(path, "rb") as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()  # the line straddling `start` belongs to the previous range
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            try:
+                chunks.extend(_chunks_for_item(json.loads(line)))
+            except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+                continue
+    return _dedup_unit(chunks)
+
+
+def _parse_records(records: List[Dict], q_field: str, a_field: str) -> List[Tuple[int, str]]:
+    chunks = []
+    for item in records:
+        chunks.extend(_chunks_for_item(item, q_field, a_field))
+    return _dedup_unit(chunks)
+
+
+# ================================================================
+# Encode workers
+# ================================================================
+_encoder = None
+
+
+def _encoder_init(threads: int) -> None:
+    global _encoder
+    from app.core.embeddings import EmbeddingService
+
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _encoder = EmbeddingService()
+    _encoder.warm_up()
+
+
+def _encode_block(texts: List[str]) -> np.ndarray:
+    return _encoder.encode_direct(texts, batch_size=BUILD_ENCODE_BATCH)
+
+
+# ================================================================
+# Work units
+# ================================================================
+def _file_units(paths: List[str]) -> List[Tuple]:
+    units = []
+    for path in paths:
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), BUILD_BLOCK_BYTES):
+            units.append(("file", path, start, min(size, start + BUILD_BLOCK_BYTES)))
+    return units
+
+
+def _hf_units(skip_units: int) -> Iterator[Tuple]:
+    """Stream record batches from a Hugging Face dataset without materializing it."""
+    from datasets import load_dataset
+
+    ds = load_dataset(BUILD_HF_DATASET, BUILD_HF_CONFIG, split=BUILD_HF_SPLIT, streaming=True)
+    if skip_units:
+        ds = ds.skip(skip_units * BUILD_HF_UNIT_ROWS)
+
+    batch = []
+    for record in ds:
+        batch.append(record)
+        if len(batch) >= BUILD_HF_UNIT_ROWS:
+            yield ("hf", batch)
+            batch = []
+    if batch:
+        yield ("hf", batch)
+
+
+def _run_unit(unit: Tuple) -> List[Tuple[int, str]]:
+    if unit[0] == "file":
+        return _parse_file_range(unit[1], unit[2], unit[3])
+    return _parse_records(unit[1], BUILD_HF_QUESTION_FIELD, BUILD_HF_ANSWER_FIELD)
+
+
+def _signature(paths: List[str]) -> Dict:
+    return {
+        "files": [[os.path.basename(p), os.path.getsize(p)] for p in paths],
+        "block_bytes": BUILD_BLOCK_BYTES,
+        "hf": [BUILD_HF_DATASET, BUILD_HF_CONFIG, BUILD_HF_SPLIT, BUILD_HF_UNIT_ROWS] if BUILD_HF_DATASET else None,
+    }
+
+
+# ================================================================
+# Builder
+# ================================================================
+class BulkBuilder:
+    def __init__(self, source_files: List[str], store_dir: str):
+        self.source_files = sorted(source_files)
+        self.store_dir = store_dir
+        self.build_dir = f"{store_dir}.building"
+        self.checkpoint_path = os.path.join(self.build_dir, CHECKPOINT_NAME)
+        self.signature = _signature(self.source_files)
+
+        self.store: Optional[ColumnarStore] = None
+        self.units_done = 0
+        self._encode_pool: Optional[ProcessPoolExecutor] = None
+
+    # ------------------------------------------------------------
+    # Checkpoints
+    # ------------------------------------------------------------
+    def _resume_or_start(self) -> None:
+        checkpoint = None
+        if os.path.exists(self.checkpoint_path) and ColumnarStore.exists(self.build_dir):
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+            if checkpoint.get("signature") != self.signature:
+                print("⚠️ Sources changed since the interrupted build → starting over")
+                checkpoint = None
+
+        if checkpoint is None:
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+            self.store = ColumnarStore.create(self.build_dir, [], np.zeros((0, 0), dtype=np.float32))
+            self._write_checkpoint()
+            return
+
+        self.store = ColumnarStore(self.build_dir)
+        self.units_done = int(checkpoint["units_done"])
+        print(f"↩️ Resuming build after unit {self.units_done:,} ({len(self.store):,} rows already stored)")
+
+    def _write_checkpoint(self) -> None:
+        tmp = f"{self.checkpoint_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"signature": self.signature, "units_done": self.units_done, "rows": len(self.store)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_path)
+
+    # ------------------------------------------------------------
+    # Encode + write
+    # ------------------------------------------------------------
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        if BUILD_ENCODE_WORKERS <= 1:
+            from app.core.embeddings import get_embedding_service
+
+            return get_embedding_service().encode_direct(texts, batch_size=BUILD_ENCODE_BATCH)
+
+        if self._encode_pool is None:
+            threads = max(1, (os.cpu_count() or 1) // BUILD_ENCODE_WORKERS)
+            self._encode_pool = ProcessPoolExecutor(
+                max_workers=BUILD_ENCODE_WORKERS, initializer=_encoder_init, initargs=(threads,),
+            )
+        step = max(BUILD_ENCODE_BATCH, -(-len(texts) // BUILD_ENCODE_WORKERS))
+        blocks = [texts[i:i + step] for i in range(0, len(texts), step)]
+        return np.concatenate(list(self._encode_pool.map(_encode_block, blocks)))
+
+    def _flush(self, pending: List[Tuple[int, str]]) -> None:
+        if pending:
+            t0 = time.time()
+            texts = [chunk for _, chunk in pending]
+            vectors = self._encode(texts)
+            self.store.append(texts, vectors, new_digests=[d for d, _ in pending])
+            print(f"  💾 Shard of {len(texts):,} chunks in {time.time() - t0:.1f}s → {len(self.store):,} total")
+        self._write_checkpoint()
+
+    # ------------------------------------------------------------
+    # Run
+    # ------------------------------------------------------------
+    def _units(self) -> Iterator[Tuple]:
+        file_units = _file_units(self.source_files)
+        yield from file_units[self.units_done:]
+        if BUILD_HF_DATASET:
+            yield from _hf_units(max(0, self.units_done - len(file_units)))
+
+    def run(self) -> ColumnarStore:
+        self._resume_or_start()
+        started = time.time()
+        pending: List[Tuple[int, str]] = []
+        pending_digests: set = set()  # only the unflushed shard; older rows are checked on disk
+
+        try:
+            with ProcessPoolExecutor(max_workers=BUILD_PARSE_WORKERS) as pool:
+                inflight = collections.deque()
+                units = self._units()
+
+                def _submit_next() -> bool:
+                    unit = next(units, None)
+                    if unit is None:
+                        return False
+                    inflight.append(pool.submit(_run_unit, unit))
+                    return True
+
+                # Keep the parse pool ahead of the encoder without buffering the whole corpus
+                for _ in range(BUILD_PARSE_WORKERS * 2):
+                    if not _submit_next():
+                        break
+
+                while inflight:
+                    parsed = inflight.popleft().result()
+                    stored = self.store.contains(np.array([d for d, _ in parsed], dtype=np.uint64))
+                    for (d, chunk), in_store in zip(parsed, stored):
+                        if not in_store and d not in pending_digests:
+                            pending_digests.add(d)
+                            pending.append((d, chunk))
+                    self.units_done += 1
+                    _submit_next()
+
+                    if len(pending) >= BUILD_SHARD_ROWS:
+                        self._flush(pending)
+                        pending, pending_digests = [], set()
+
+            self._flush(pending)
+        finally:
+            if self._encode_pool is not None:
+                self._encode_pool.shutdown()
+                self._encode_pool = None
+
+        # Publish the finished store (drop our mappings first so the rename works on Windows)
+        self.store = None
+        os.remove(self.checkpoint_path)
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+        os.replace(self.build_dir, self.store_dir)
+        print(f"🏁 Bulk build finished in {time.time() - started:.1f}s")
+        return ColumnarStore(self.store_dir)
+
+
+def build_store(source_files: List[str], store_dir: str) -> ColumnarStore:
+    return BulkBuilder(source_files, store_dir).run()
@@ -0,0 +1,662 @@
+# backend/app/data_processing/columnar_store.py
+"""
+Memory-mapped, columnar on-disk format for the Nexora vector DB.
+
+A store is an append-only log of immutable segments:
+    manifest.json          → {"version", "dim", "dtype", "segments": [{"name", "count"}]}
+    seg-<seq>-<id>/        → one immutable segment
+        vectors.bin        → raw row-major float16/float32 matrix (count x dim)
+        offsets.bin        → raw int64 array, count + 1 entries, byte offsets into texts.bin
+        texts.bin          → every chunk text, utf-8, concatenated
+        digests.bin        → sorted uint64 array, first 8 bytes of each row's SHA-256 (dedup)
+
+Vectors and offsets are opened with np.memmap, so opening a store is O(1),
+lookups only touch the rows that are returned, and every uvicorn worker
+shares the same OS page cache. Dedup checks binary-search the digest
+arrays, 8 bytes per row, also memory-mapped.
+
+An append writes one new segment (fsync + rename) and then swaps the
+manifest (fsync + rename), so its cost depends on the upload size only and
+a crash leaves either the old or the new manifest. Searches fan out over
+the segments; a background compactor merges runs of small neighbouring
+segments, which keeps global row numbers stable for the ANN index.
+
+Several worker processes may share one store. Every manifest change
+(append, compaction, garbage collection) holds an exclusive lock on
+<root>/.lock and re-reads the manifest from disk before merging its own
+change into it, so no process commits over segments it has not seen.
+Only one process per store runs the background compactor
+(<root>/.compactor.lock). Segment files stay memory-mapped once opened,
+so a reader whose view predates a compaction keeps working until it
+refresh()es.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+FORMAT_VERSION = 2
+
+MANIFEST_NAME = "manifest.json"
+VECTORS_NAME = "vectors.bin"
+OFFSETS_NAME = "offsets.bin"
+TEXTS_NAME = "texts.bin"
+DIGESTS_NAME = "digests.bin"
+HASHES_NAME = "hashes.json"  # pre-digest segments; converted on first use
+SEGMENT_PREFIX = "seg-"
+LOCK_NAME = ".lock"
+COMPACTOR_LOCK_NAME = ".compactor.lock"
+
+DEFAULT_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float32")
+
+# Compaction policy: runs of at least COMPACT_MIN_RUN neighbouring segments
+# smaller than COMPACT_SMALL_ROWS are merged into one segment.
+COMPACT_SMALL_ROWS = int(os.getenv("SEGMENT_COMPACT_SMALL_ROWS", "8192"))
+COMPACT_MIN_RUN = int(os.getenv("SEGMENT_COMPACT_MIN_RUN", "4"))
+COMPACT_INTERVAL = float(os.getenv("SEGMENT_COMPACT_INTERVAL", "300"))
+
+# Rows scored per block during exact search (bounds the float32 working set)
+SEARCH_BLOCK_ROWS = 65536
+
+
+# ================================================================
+# Helpers
+# ================================================================
+def _fsync_dir(path: str) -> None:
+    # Directory fsync makes renames durable; not supported on Windows
+    if os.name == "nt":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _atomic_write_json(path: str, data) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(os.path.dirname(path) or ".")
+
+
+def _write_file(path: str, payload: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class FileLock:
+    """
+    Exclusive advisory lock on a file, shared by every process that opens
+    the same path (flock; msvcrt on Windows). Released when the holder
+    exits. Not re-entrant and not thread-safe: pair it with a threading lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            else:
+                msvcrt.locking(fd, msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            os.close(fd)
+            if blocking:
+                raise
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def hex_to_digests(hashes: Iterable[str]) -> np.ndarray:
+    """Hex SHA-256 strings → uint64 digests (the first 8 bytes, big-endian)."""
+    return np.array([int(h[:16], 16) for h in hashes], dtype=np.uint64)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without a full sort."""
+    if k >= len(scores):
+        return np.argsort(scores)[::-1]
+    part = np.argpartition(scores, -k)[-k:]
+    return part[np.argsort(scores[part])[::-1]]
+
+
+# ================================================================
+# Segment (immutable)
+# ================================================================
+class Segment:
+    def __init__(self, path: str, count: int, dim: int, dtype: np.dtype):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.count = count
+        self.dim = dim
+        self.dtype = dtype
+
+        if count == 0 or dim == 0:
+            self.vectors = np.zeros((0, dim), dtype=dtype)
+        else:
+            self.vectors = np.memmap(
+                os.path.join(path, VECTORS_NAME), dtype=dtype, mode="r", shape=(count, dim),
+            )
+        self.offsets = np.memmap(
+            os.path.join(path, OFFSETS_NAME), dtype=np.int64, mode="r", shape=(count + 1,),
+        )
+        # Mapped up front: the mapping outlives the files if another process compacts them away
+        texts_path = os.path.join(path, TEXTS_NAME)
+        self._texts = np.memmap(texts_path, dtype=np.uint8, mode="r") if os.path.getsize(texts_path) else b""
+        self._digests: Optional[np.ndarray] = None
+        if os.path.exists(os.path.join(path, DIGESTS_NAME)):
+            self.digests
+
+    @staticmethod
+    def write(
+        root: str,
+        seq: int,
+        texts: List[str],
+        vectors: np.ndarray,
+        dtype: np.dtype,
+        digests: Iterable[int] = (),
+    ) -> str:
+        """Write a complete segment under a temp name, then rename it into place."""
+        name = f"{SEGMENT_PREFIX}{seq:08d}-{uuid.uuid4().hex[:8]}"
+        tmp_dir = os.path.join(root, f".{name}.tmp")
+        os.makedirs(tmp_dir)
+
+        encoded = [t.encode("utf-8") for t in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        if encoded:
+            offsets[1:] = np.cumsum([len(b) for b in encoded])
+
+        _write_file(os.path.join(tmp_dir, VECTORS_NAME), np.ascontiguousarray(vectors, dtype=dtype).tobytes())
+        _write_file(os.path.join(tmp_dir, OFFSETS_NAME), offsets.tobytes())
+        _write_file(os.path.join(tmp_dir, TEXTS_NAME), b"".join(encoded))
+        _write_file(os.path.join(tmp_dir, DIGESTS_NAME), np.unique(np.asarray(list(digests), dtype=np.uint64)).tobytes())
+        _fsync_dir(tmp_dir)
+
+        os.rename(tmp_dir, os.path.join(root, name))
+        _fsync_dir(root)
+        return name
+
+    def read_texts(self, local_ids: Iterable[int]) -> List[str]:
+        out = []
+        for idx in local_ids:
+            start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+            out.append(bytes(self._texts[start:end]).decode("utf-8"))
+        return out
+
+    def read_all_texts(self) -> List[str]:
+        return self.read_texts(range(self.count))
+
+    @property
+    def digests(self) -> np.ndarray:
+        """Sorted uint64 dedup digests of this segment (memory-mapped)."""
+        if self._digests is None:
+            path = os.path.join(self.path, DIGESTS_NAME)
+            if not os.path.exists(path):
+                self._convert_hashes(path)
+            if os.path.getsize(path) == 0:
+                self._digests = np.zeros(0, dtype=np.uint64)
+            else:
+                self._digests = np.memmap(path, dtype=np.uint64, mode="r")
+        return self._digests
+
+    def _convert_hashes(self, path: str) -> None:
+        legacy = os.path.join(self.path, HASHES_NAME)
+        hashes = []
+        if os.path.exists(legacy):
+            with open(legacy, "r", encoding="utf-8") as f:
+                hashes = json.load(f)
+        tmp = f"{path}.tmp"
+        _write_file(tmp, np.unique(hex_to_digests(hashes)).tobytes())
+        os.replace(tmp, path)
+
+    def contains(self, digests: np.ndarray) -> np.ndarray:
+        own = self.digests
+        if len(own) == 0:
+            return np.zeros(len(digests), dtype=bool)
+        pos = np.minimum(np.searchsorted(own, digests), len(own) - 1)
+        return own[pos] == digests
+
+
+# ================================================================
+# Store (append-only segment log)
+# ================================================================
+class ColumnarStore:
+    def __init__(self, root: str):
+        self.root = root
+        self._write_lock = threading.Lock()
+        self._file_lock = FileLock(os.path.join(root, LOCK_NAME))
+        self._manifest_stat: Optional[Tuple[int, int, int]] = None
+        self._view: Tuple[Tuple[Segment, ...], np.ndarray] = ((), np.zeros(1, dtype=np.int64))
+        self._compactor: Optional[threading.Thread] = None
+
+        with self._write_lock, self._file_lock:
+            _upgrade_v1(root)
+            self._load_manifest()
+            self._collect_garbage()
+
+    # ------------------------------------------------------------
+    # Creation / opening
+    # ------------------------------------------------------------
+    @staticmethod
+    def exists(root: str) -> bool:
+        return os.path.exists(os.path.join(root, MANIFEST_NAME))
+
+    @classmethod
+    def create(
+        cls,
+        root: str,
+        texts: List[str],
+        vectors: np.ndarray,
+        dtype: str = DEFAULT_DTYPE,
+        digests: Iterable[int] = (),
+    ) -> "ColumnarStore":
+        if len(texts) != len(vectors):
+            raise ValueError("texts and vectors must have the same length")
+
+        os.makedirs(root, exist_ok=True)
+        vectors = np.asarray(vectors)
+        dim = int(vectors.shape[1]) if vectors.ndim == 2 else 0
+
+        segments = []
+        if texts:
+            name = Segment.write(root, 1, texts, vectors, np.dtype(dtype), digests)
+            segments.append({"name": name, "count": len(texts)})
+
+        _atomic_write_json(
+            os.path.join(root, MANIFEST_NAME),
+            {"version": FORMAT_VERSION, "dim": dim, "dtype": np.dtype(dtype).name,
+             "next_seq": 2, "segments": segments},
+        )
+        return cls(root)
+
+    def _manifest_signature(self) -> Tuple[int, int, int]:
+        # A commit replaces the file (new inode), so this changes even within one mtime tick
+        st = os.stat(os.path.join(self.root, MANIFEST_NAME))
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _load_manifest(self) -> None:
+        """(Re)read the manifest from disk; segments already open are reused."""
+        path = os.path.join(self.root, MANIFEST_NAME)
+        signature = self._manifest_signature()
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        if manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported store version: {manifest.get('version')}")
+
+        self.dim: int = int(manifest["dim"])
+        self.dtype = np.dtype(manifest["dtype"])
+        self._next_seq: int = int(manifest.get("next_seq", len(manifest["segments"]) + 1))
+        self._manifest_stat = signature
+        opened = {seg.name: seg for seg in self.segments}
+        self._set_segments([
+            opened.get(s["name"]) or Segment(os.path.join(self.root, s["name"]), int(s["count"]), self.dim, self.dtype)
+            for s in manifest["segments"]
+        ])
+
+    def _set_segments(self, segments: List[Segment]) -> None:
+        # Readers take one snapshot of (segments, starts); both are replaced together
+        starts = np.zeros(len(segments) + 1, dtype=np.int64)
+        if segments:
+            starts[1:] = np.cumsum([s.count for s in segments])
+        self._view = (tuple(segments), starts)
+
+    def _commit_manifest(self, segments: List[Segment]) -> None:
+        """Caller holds both locks and built `segments` from a manifest re-read under them."""
+        _atomic_write_json(
+            os.path.join(self.root, MANIFEST_NAME),
+            {"version": FORMAT_VERSION, "dim": self.dim, "dtype": self.dtype.name,
+             "next_seq": self._next_seq,
+             "segments": [{"name": s.name, "count": s.count} for s in segments]},
+        )
+        self._manifest_stat = self._manifest_signature()
+        self._set_segments(segments)
+
+    def refresh(self) -> bool:
+        """Pick up segments committed by another worker process."""
+        try:
+            signature = self._manifest_signature()
+        except OSError:
+            return False
+        if signature == self._manifest_stat:
+            return False
+        with self._write_lock:
+            self._load_manifest()
+        return True
+
+    def _collect_garbage(self) -> None:
+        """Remove temp dirs and segments that are no longer in the manifest; caller holds both locks."""
+        live = {s.name for s in self.segments}
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path):
+                continue
+            if name.endswith(".tmp") or (name.startswith(SEGMENT_PREFIX) and name not in live):
+                shutil.rmtree(path, ignore_errors=True)
+
+    # ------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------
+    @property
+    def segments(self) -> Tuple[Segment, ...]:
+        return self._view[0]
+
+    def __len__(self) -> int:
+        return int(self._view[1][-1])
+
+    def snapshot(self) -> Tuple[Tuple[Segment, ...], np.ndarray]:
+        """(segments, global start row of each segment + total), taken atomically."""
+        return self._view
+
+    def _locate(self, idx: int) -> Tuple[Segment, int]:
+        segments, starts = self._view
+        seg_no = int(np.searchsorted(starts, idx, side="right")) - 1
+        return segments[seg_no], idx - int(starts[seg_no])
+
+    def text(self, idx: int) -> str:
+        segment, local = self._locate(idx)
+        return segment.read_texts([local])[0]
+
+    def texts(self, indices: Iterable[int]) -> List[str]:
+        return [self.text(int(i)) for i in indices]
+
+    def rows(self, start: int, end: int) -> np.ndarray:
+        """Vectors for global rows [start, end) as float32."""
+        segments, starts = self._view
+        parts = []
+        for seg, seg_start in zip(segments, starts[:-1]):
+            lo, hi = max(start, int(seg_start)), min(end, int(seg_start) + seg.count)
+            if lo < hi:
+                parts.append(np.asarray(seg.vectors[lo - seg_start:hi - seg_start], dtype=np.float32))
+        if not parts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+    def take(self, indices: Iterable[int]) -> np.ndarray:
+        """Vectors for arbitrary global rows as float32."""
+        out = []
+        for idx in indices:
+            segment, local = self._locate(int(idx))
+            out.append(np.asarray(segment.vectors[local], dtype=np.float32))
+        return np.stack(out) if out else np.zeros((0, self.dim), dtype=np.float32)
+
+    def contains(self, digests: Iterable[int]) -> np.ndarray:
+        """Boolean mask: which digests already belong to a row in the store."""
+        if not isinstance(digests, np.ndarray):
+            digests = list(digests)
+        digests = np.asarray(digests, dtype=np.uint64)
+        found = np.zeros(len(digests), dtype=bool)
+        for segment in self.segments:
+            if found.all():
+                break
+            found |= segment.contains(digests)
+        return found
+
+    def search(self, q_vec: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact inner-product search fanned out over every segment, scanned
+        block by block so float16 stores never get materialized as one
+        float32 copy. Returns (scores, global indices), best first.
+        """
+        segments, starts = self._view
+        if k <= 0 or not segments:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        q = np.asarray(q_vec, dtype=np.float32).reshape(-1)
+        cand_scores, cand_idx = [], []
+
+        for seg, seg_start in zip(segments, starts[:-1]):
+            for lo in range(0, seg.count, SEARCH_BLOCK_ROWS):
+                block = np.asarray(seg.vectors[lo:lo + SEARCH_BLOCK_ROWS], dtype=np.float32)
+                scores = block @ q
+                top = _top_k(scores, k)
+                cand_scores.append(scores[top])
+                cand_idx.append(top.astype(np.int64) + lo + int(seg_start))
+
+        all_scores = np.concatenate(cand_scores)
+        all_idx = np.concatenate(cand_idx)
+        order = _top_k(all_scores, k)
+        return all_scores[order], all_idx[order]
+
+    # ------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------
+    def append(self, texts: List[str], vectors: np.ndarray, new_digests: Iterable[int] = ()) -> int:
+        """Append rows as one new immutable segment. Existing data is never rewritten."""
+        if not texts:
+            return 0
+        vectors = np.asarray(vectors)
+        if len(texts) != len(vectors):
+            raise ValueError("texts and vectors must have the same length")
+
+        with self._write_lock, self._file_lock:
+            # Another process may have committed since we last looked: build on its manifest
+            self._load_manifest()
+            if self.dim == 0:
+                self.dim = int(vectors.shape[1])
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Vector dim {vectors.shape[1]} does not match store dim {self.dim}")
+
+            seq = self._next_seq
+            self._next_seq += 1
+            name = Segment.write(self.root, seq, texts, vectors, self.dtype, new_digests)
+            segment = Segment(os.path.join(self.root, name), len(texts), self.dim, self.dtype)
+            self._commit_manifest(list(self.segments) + [segment])
+
+        return len(texts)
+
+    # ------------------------------------------------------------
+    # Compaction
+    # ------------------------------------------------------------
+    def _small_runs(self, segments: Tuple[Segment, ...]) -> List[Tuple[int, int]]:
+        runs, start = [], None
+        for i, seg in enumerate(list(segments) + [None]):
+            small = seg is not None and seg.count < COMPACT_SMALL_ROWS
+            if small and start is None:
+                start = i
+            elif not small and start is not None:
+                if i - start >= COMPACT_MIN_RUN:
+                    runs.append((start, i))
+                start = None
+        return runs
+
+    def compact(self) -> int:
+        """
+        Merge runs of small neighbouring segments. Reading the runs happens
+        outside the locks (segments are immutable); writing the merged
+        segments and the manifest swap are done under them, against the
+        manifest as it is on disk then. A run that changed meanwhile (e.g.
+        another process compacted it) is left alone. Returns the number of
+        segments removed.
+        """
+        self.refresh()
+        snapshot = self.segments
+        runs = [tuple(snapshot[start:end]) for start, end in self._small_runs(snapshot)]
+        if not runs:
+            return 0
+
+        payloads = []
+        for run in runs:
+            texts, vectors, digests = [], [], []
+            for seg in run:
+                texts.extend(seg.read_all_texts())
+                vectors.append(np.asarray(seg.vectors))
+                digests.append(np.asarray(seg.digests))
+            payloads.append((texts, np.concatenate(vectors), np.concatenate(digests)))
+
+        replaced = []
+        with self._write_lock, self._file_lock:
+            self._load_manifest()
+            current = list(self.segments)
+            names = [seg.name for seg in current]
+
+            spans = []
+            for run, (texts, vectors, digests) in zip(runs, payloads):
+                run_names = [seg.name for seg in run]
+                pos = names.index(run_names[0]) if run_names[0] in names else -1
+                if pos < 0 or names[pos:pos + len(run)] != run_names:
+                    continue
+                seq = self._next_seq
+                self._next_seq += 1
+                # Written under the lock: garbage collection in another process must not see it uncommitted
+                name = Segment.write(self.root, seq, texts, vectors, self.dtype, digests)
+                spans.append((pos, pos + len(run), Segment(os.path.join(self.root, name), len(texts), self.dim, self.dtype)))
+                replaced.extend(run)
+            if not spans:
+                return 0
+
+            new_segments, pos = [], 0
+            for start, end, segment in sorted(spans, key=lambda span: span[0]):
+                new_segments.extend(current[pos:start])
+                new_segments.append(segment)
+                pos = end
+            new_segments.extend(current[pos:])
+            self._commit_manifest(new_segments)
+
+        for seg in replaced:
+            # Windows keeps mapped files locked; leftovers are collected on next open
+            shutil.rmtree(seg.path, ignore_errors=True)
+
+        removed = len(replaced) - len(spans)
+        print(f"🧱 Compacted {len(replaced)} segments into {len(spans)} → {len(self.segments)} total")
+        return removed
+
+    def start_compactor(self, interval: float = COMPACT_INTERVAL) -> None:
+        """Background compaction; only the process holding .compactor.lock runs it."""
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        owner = FileLock(os.path.join(self.root, COMPACTOR_LOCK_NAME))
+
+        def _loop():
+            while True:
+                time.sleep(interval)
+                # Kept for the life of the process; the others retry in case the owner exits
+                if not owner.held and not owner.acquire(blocking=False):
+                    continue
+                try:
+                    self.compact()
+                except Exception as e:
+                    print(f"⚠️ Segment compaction failed: {e}")
+
+        self._compactor = threading.Thread(target=_loop, name="segment-compactor", daemon=True)
+        self._compactor.start()
+
+
+def _upgrade_v1(root: str) -> None:
+    """Move a single-file (version 1) store into its first segment in place."""
+    path = os.path.join(root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != 1:
+        return
+
+    name = f"{SEGMENT_PREFIX}{1:08d}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(os.path.join(root, name))
+    for fname in (VECTORS_NAME, OFFSETS_NAME, TEXTS_NAME, HASHES_NAME):
+        src = os.path.join(root, fname)
+        if os.path.exists(src):
+            os.replace(src, os.path.join(root, name, fname))
+
+    count = int(manifest["count"])
+    _atomic_write_json(path, {
+        "version": FORMAT_VERSION, "dim": manifest["dim"], "dtype": manifest["dtype"],
+        "next_seq": 2, "segments": [{"name": name, "count": count}] if count else [],
+    })
+
+
+# ================================================================
+# One-shot migrator for texts.json / vectors.npy / hashes.json
+# ================================================================
+def migrate_legacy(
+    texts_file: str,
+    vectors_file: str,
+    hashes_file: Optional[str],
+    root: str,
+    dtype: str = DEFAULT_DTYPE,
+) -> ColumnarStore:
+    print(f"🔁 Migrating {os.path.basename(texts_file)} + {os.path.basename(vectors_file)} → {root}")
+
+    with open(texts_file, "r", encoding="utf-8") as f:
+        texts = json.load(f)
+    vectors = np.load(vectors_file, mmap_mode="r")
+
+    if len(texts) != len(vectors):
+        raise ValueError(f"Legacy DB is inconsistent: {len(texts)} texts vs {len(vectors)} vectors")
+
+    # Legacy loaders normalized on every load; the store is searched by raw inner product
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+
+    digests = np.zeros(0, dtype=np.uint64)
+    if hashes_file and os.path.exists(hashes_file):
+        with open(hashes_file, "r", encoding="utf-8") as f:
+            digests = hex_to_digests(json.load(f))
+
+    store = ColumnarStore.create(root, texts, vectors, dtype=dtype, digests=digests)
+    print(f"✅ Migrated {len(store):,} rows ({store.dtype.name})")
+    return store
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app.data_processing.embed_dataset import HASHES_FILE, STORE_DIR, TEXTS_FILE, VECTORS_FILE
+
+    parser = argparse.ArgumentParser(description="Migrate texts.json/vectors.npy/hashes.json to the columnar store")
+    parser.add_argument("--texts", default=TEXTS_FILE)
+    parser.add_argument("--vectors", default=VECTORS_FILE)
+    parser.add_argument("--hashes", default=HASHES_FILE)
+    parser.add_argument("--out", default=STORE_DIR)
+    parser.add_argument("--dtype", default=DEFAULT_DTYPE, choices=["float16", "float32"])
+    args = parser.parse_args()
+
+    migrate_legacy(args.texts, args.vectors, args.hashes, args.out, dtype=args.dtype)
@@ -0,0 +1,122 @@
+# backend/app/data_processing/content_store.py
+"""
+Content-addressed storage for uploaded files and what is derived from them.
+
+    uploads/blobs/<h[:2]>/<h>        → the uploaded bytes, stored once per SHA-256
+    uploads/derived/<h>/text.txt     → extracted text (only when extraction was complete)
+    uploads/derived/<h>/chunks.npz   → chunk digest → embedding, for every chunk seen so far
+    uploads/derived/<h>/analysis-<k>.txt → Ollama analysis per (model, question)
+
+FileUpload rows point at the blob, so re-uploading a known document costs
+one hash: extraction, embedding and analysis are read back instead of
+recomputed. RAG collections use collection_id_for(h), so the same document
+always maps to the same collection.
+
+Every write goes to a temp file and is renamed into place; concurrent
+writers of the same hash produce identical content, so the last rename wins
+harmlessly.
+"""
+import hashlib
+import os
+import uuid
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+UPLOAD_DIR = "uploads"
+BLOBS_DIR = os.path.join(UPLOAD_DIR, "blobs")
+DERIVED_DIR = os.path.join(UPLOAD_DIR, "derived")
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _atomic_write(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# ================================================================
+# Blobs
+# ================================================================
+def blob_path(digest: str) -> str:
+    return os.path.join(BLOBS_DIR, digest[:2], digest)
+
+
+def store_blob(content: bytes) -> Tuple[str, str]:
+    """(sha256, path) of the stored bytes; known content is not written again."""
+    digest = content_hash(content)
+    path = blob_path(digest)
+    if not os.path.exists(path):
+        _atomic_write(path, content)
+    return digest, path
+
+
+def collection_id_for(digest: str) -> str:
+    """Stable RAG collection id for a document (UUID-shaped, like the generated ones)."""
+    return str(uuid.UUID(digest[:32]))
+
+
+# ================================================================
+# Derived artifacts
+# ================================================================
+def _derived(digest: str, name: str) -> str:
+    return os.path.join(DERIVED_DIR, digest, name)
+
+
+def read_text(digest: str) -> Optional[str]:
+    try:
+        with open(_derived(digest, "text.txt"), "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_text(digest: str, text: str) -> None:
+    _atomic_write(_derived(digest, "text.txt"), text.encode("utf-8"))
+
+
+def load_vectors(digest: str) -> Dict[int, np.ndarray]:
+    """Cached chunk embeddings of a document, keyed by chunk digest."""
+    path = _derived(digest, "chunks.npz")
+    if not os.path.exists(path):
+        return {}
+    try:
+        with np.load(path) as data:
+            return {int(d): v for d, v in zip(data["digests"], data["vectors"])}
+    except Exception as e:
+        print(f"⚠️ Ignoring unreadable embedding cache {path}: {e}")
+        return {}
+
+
+def save_vectors(digest: str, vectors: Dict[int, np.ndarray]) -> None:
+    if not vectors:
+        return
+    digests = np.fromiter(vectors.keys(), dtype=np.uint64, count=len(vectors))
+    matrix = np.stack([np.asarray(v, dtype=np.float32) for v in vectors.values()])
+    path = _derived(digest, "chunks.npz")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp.npz"
+    np.savez(tmp, digests=digests, vectors=matrix)
+    os.replace(tmp, path)
+
+
+def _analysis_key(model: str, query: Optional[str]) -> str:
+    question = " ".join((query or "").lower().split())
+    return hashlib.sha256(f"{model}\n{question}".encode("utf-8")).hexdigest()[:16]
+
+
+def read_analysis(digest: str, model: str, query: Optional[str]) -> Optional[str]:
+    try:
+        with open(_derived(digest, f"analysis-{_analysis_key(model, query)}.txt"), "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_analysis(digest: str, model: str, query: Optional[str], analysis: str) -> None:
+    _atomic_write(_derived(digest, f"analysis-{_analysis_key(model, query)}.txt"), analysis.encode("utf-8"))
@@ -1,11 +1,20 @@
 # backend/app/data_processing/embed_dataset.py
-import json
 import os
-import numpy as np
-from sentence_transformers import SentenceTransformer
 import re
 import hashlib
-from typing import List
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.data_processing.columnar_store import ColumnarStore, FileLock, migrate_legacy
+from app.data_processing.ann_index import AnnIndex
+from app.data_processing.lexical_index import (
+    HYBRID_DENSE_K,
+    LexicalIndex,
+    lexical_candidates,
+    rrf_fuse,
+)
+from app.data_processing.partitions import PartitionSet
+from app.core.embeddings import get_embedding_service
 
 # ================================================================
 # Path Configuration
@@ -19,21 +28,25 @@ TEXTS_FILE = os.path.join(DATA_DIR, "texts.json")
 VECTORS_FILE = os.path.join(DATA_DIR, "vectors.npy")
 HASHES_FILE = os.path.join(DATA_DIR, "hashes.json")
 
+# Memory-mapped, append-only segment store (texts.json / vectors.npy are legacy inputs only)
+STORE_DIR = os.path.join(DATA_DIR, "store")
+
+# Uploaded content: one partition per owner, searched only for that owner
+PARTITIONS_DIR = os.path.join(DATA_DIR, "partitions")
+# Written once the upload rows of the shared store have been copied into partitions
+LEGACY_UPLOADS_MARKER = os.path.join(PARTITIONS_DIR, ".legacy_uploads_migrated")
+
 # ================================================================
-# Global state + lazy model loading
+# Global state (the embedding model is owned by app.core.embeddings)
 # ================================================================
-_model = None
-clean_docs: List[str] = []
-vectors: np.ndarray | None = None
-text_hashes: set[str] = set()
-
-def get_model() -> SentenceTransformer:
-    global _model
-    if _model is None:
-        print("🔥 Loading embedding model (all-MiniLM-L6-v2)...")
-        _model = SentenceTransformer("all-MiniLM-L6-v2")
-        print("✅ Model loaded")
-    return _model
+_store: ColumnarStore | None = None
+_ann: AnnIndex | None = None  # None → exact search (small corpus or ANN_ENGINE=flat)
+_lex: LexicalIndex | None = None  # BM25 side of hybrid retrieval (None → dense only)
+_partitions = PartitionSet(PARTITIONS_DIR)
+
+def get_model():
+    """Shared SentenceTransformer (one copy per process)."""
+    return get_embedding_service().model
 
 # ================================================================
 # Helpers
@@ -42,6 +55,11 @@ def compute_hash(text: str) -> str:
     return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
 
 
+def compute_digest(text: str) -> int:
+    """First 8 bytes of the chunk's SHA-256 as an unsigned int (the store's dedup key)."""
+    return int.from_bytes(hashlib.sha256(text.encode("utf-8", errors="ignore")).digest()[:8], "big")
+
+
 def is_clean_text(text: str) -> bool:
     text = text.strip()
     if len(text) < 60:
@@ -72,34 +90,62 @@ def chunk_text(text: str, max_chars: int = 1800) -> List[str]:
     return [c for c in chunks if len(c.strip()) >= 60]
 
 
+_LEGACY_UPLOAD_RE = re.compile(r"\[Source: (.*?)\] \[Uploaded file: \1\] ", re.S)
+
+
+def _is_legacy_upload(text: str) -> bool:
+    # Uploads used to go into the global store, tagged only by these prefixes
+    return text.startswith("[Source: ") and "[Uploaded file: " in text[:600]
+
+
 # ================================================================
 # Initial Load / Build from QA dataset files
 # ================================================================
+def _open_ann_index():
+    global _ann, _lex
+    _store.start_compactor()
+    try:
+        _ann = AnnIndex.for_store(_store)
+    except Exception as e:
+        print(f"⚠️ ANN index unavailable: {e} → exact search")
+        _ann = None
+
+    if _lex is None:
+        try:
+            _lex = LexicalIndex.for_store(_store)
+        except Exception as e:
+            print(f"⚠️ Lexical index unavailable: {e} → dense retrieval only")
+
+
 def load_or_build_db():
-    global clean_docs, vectors, text_hashes
+    global _store
 
     print("🔍 Loading/Building Nexora Vector DB...")
 
-    # Try to load existing database
-    if all(os.path.exists(f) for f in [TEXTS_FILE, VECTORS_FILE]):
-        print("📦 Loading existing vector database...")
+    # Open the memory-mapped store (O(1), pages are shared between workers)
+    if ColumnarStore.exists(STORE_DIR):
         try:
-            with open(TEXTS_FILE, "r", encoding="utf-8") as f:
-                clean_docs = json.load(f)
-
-            vectors = np.load(VECTORS_FILE)
-
-            if os.path.exists(HASHES_FILE):
-                with open(HASHES_FILE, "r", encoding="utf-8") as f:
-                    text_hashes = set(json.load(f))
+            _store = ColumnarStore(STORE_DIR)
+            print(f"→ Opened {len(_store):,} documents ({_store.dtype.name}, mmap)")
+            _open_ann_index()
+            return
+        except Exception as e:
+            print(f"⚠️ Failed to open vector store: {e}. Will rebuild.")
 
-            print(f"→ Loaded {len(clean_docs):,} documents")
+    # One-shot migration from the legacy texts.json / vectors.npy format
+    if all(os.path.exists(f) for f in [TEXTS_FILE, VECTORS_FILE]):
+        print("📦 Migrating existing vector database...")
+        try:
+            _store = migrate_legacy(TEXTS_FILE, VECTORS_FILE, HASHES_FILE, STORE_DIR)
+            print(f"→ Loaded {len(_store):,} documents")
+            _open_ann_index()
             return
         except Exception as e:
             print(f"⚠️ Failed to load existing DB: {e}. Will rebuild.")
 
-    # Build from source qa_part_*.jsonl files
+    # Build from source qa_part_*.jsonl files (and BUILD_HF_DATASET, if set)
     print("⚙️ Building new vector database from qa_part_*.jsonl files...")
+    from app.data_processing.bulk_build import build_store
 
     source_files = [
         os.path.join(DATA_DIR, fname)
@@ -107,86 +153,58 @@ def load_or_build_db():
         if fname.startswith("qa_part_") and fname.endswith(".jsonl")
     ]
 
-    all_chunks = []
-
-    for path in source_files:
-        print(f"  Reading: {os.path.basename(path)}")
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                for line in f:
-                    try:
-                        item = json.loads(line.strip())
-                        q = (item.get("question") or "").strip()
-                        a = (item.get("answer") or "").strip()
-
-                        merged = f"{q}\n\n{a}".strip()
-                        if not merged or not is_clean_text(merged):
-                            continue
-
-                        chunks = chunk_text(merged)
-                        for chunk in chunks:
-                            h = compute_hash(chunk)
-                            if h not in text_hashes:
-                                text_hashes.add(h)
-                                all_chunks.append(chunk)
-
-                    except json.JSONDecodeError:
-                        continue
-                    except Exception as e:
-                        print(f"  Skipping bad line: {e}")
-        except Exception as e:
-            print(f"  Failed to read file {path}: {e}")
-
-    clean_docs = all_chunks
-    print(f"🧹 Cleaned chunks: {len(clean_docs):,}")
+    _store = build_store(source_files, STORE_DIR)
 
-    if not clean_docs:
+    if len(_store) == 0:
         print("⚠️ No valid content found → empty database")
-        vectors = np.array([])
         return
 
-    # Embed
-    print("🧠 Embedding dataset...")
-    model = get_model()
-    vectors = model.encode(
-        clean_docs,
-        batch_size=32,
-        show_progress_bar=True,
-        normalize_embeddings=True,
-        convert_to_numpy=True
-    )
-
-    # Save
-    with open(TEXTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(clean_docs, f, ensure_ascii=False, indent=1)
-
-    with open(HASHES_FILE, "w", encoding="utf-8") as f:
-        json.dump(list(text_hashes), f)
+    _open_ann_index()
 
-    np.save(VECTORS_FILE, vectors)
-
-    print(f"🎉 Vector DB ready → {len(clean_docs):,} items")
+    print(f"🎉 Vector DB ready → {len(_store):,} items")
 
 
 # ================================================================
 # Append new content (used by file upload)
 # ================================================================
-def embed_new_content(new_texts: List[str], source: str = "file_upload"):
-    global clean_docs, vectors, text_hashes
-
-    if vectors is None:
+def embed_new_content(
+    new_texts: List[str],
+    source: str = "file_upload",
+    owner: Optional[str] = None,
+    upload_id: Optional[str] = None,
+    vector_cache: Optional[Dict[int, np.ndarray]] = None,
+):
+    """
+    Chunk, dedup and embed new content. With an owner (user id or guest
+    chat id) the chunks go to that owner's partition, tagged with source / upload_id;
+    without one they join the shared corpus.
+
+    `vector_cache` (digest of the embedded text → vector, e.g. a document's
+    cached embeddings) is consulted before encoding and receives every
+    vector that had to be computed.
+    """
+    if _store is None:
         load_or_build_db()
 
-    new_chunks = []
+    candidates = {}  # digest → chunk, first occurrence wins
 
     for text in new_texts:
         for chunk in chunk_text(text):
             if len(chunk.strip()) < 60:
                 continue
-            h = compute_hash(chunk)
-            if h not in text_hashes:
-                text_hashes.add(h)
-                new_chunks.append(f"[Source: {source}] {chunk}")
+            candidates.setdefault(compute_digest(chunk), chunk)
+
+    # Dedup is per partition: the same document uploaded by two users is stored for both
+    target = _store if owner is None else _partitions.get(owner)
+    target.refresh()
+    digests = np.fromiter(candidates.keys(), dtype=np.uint64, count=len(candidates))
+    known = target.contains(digests)
+
+    new_digests = [int(d) for d, seen in zip(digests, known) if not seen]
+    if owner is None:
+        new_chunks = [f"[Source: {source}] {candidates[d]}" for d in new_digests]
+    else:
+        new_chunks = [candidates[d] for d in new_digests]  # source lives in the metadata columns
 
     if not new_chunks:
         print("ℹ️  No new meaningful content to embed.")
@@ -195,35 +213,36 @@ def embed_new_content(new_texts: List[str], source: str = "file_upload"):
     print(f"➕ Embedding {len(new_chunks)} new chunks...")
 
     try:
-        model = get_model()
-        new_vecs = model.encode(
-            new_chunks,
-            batch_size=16,
-            show_progress_bar=False,
-            normalize_embeddings=True,
-            convert_to_numpy=True
-        )
+        if vector_cache is None:
+            new_vecs = get_embedding_service().encode(new_chunks, batch_size=16)
+        else:
+            keys = [compute_digest(c) for c in new_chunks]
+            missing = [i for i, key in enumerate(keys) if key not in vector_cache]
+            if missing:
+                fresh = get_embedding_service().encode([new_chunks[i] for i in missing], batch_size=16)
+                vector_cache.update((keys[i], vec) for i, vec in zip(missing, fresh))
+            new_vecs = np.stack([vector_cache[key] for key in keys])
 
         if len(new_vecs) == 0:
             return 0
 
-        if vectors.size == 0:
-            vectors = new_vecs
-        else:
-            vectors = np.vstack([vectors, new_vecs])
-
-        clean_docs.extend(new_chunks)
+        if owner is not None:
+            target.append(new_chunks, new_vecs, new_digests, source=source, upload_id=upload_id)
+            print(f"✅ Added {len(new_chunks)} chunks to partition '{target.owner}' → {len(target):,} rows")
+            return len(new_chunks)
 
-        # Save updated state
-        with open(TEXTS_FILE, "w", encoding="utf-8") as f:
-            json.dump(clean_docs, f, ensure_ascii=False)
+        # One new immutable segment: cost depends on the upload, not the corpus
+        _store.append(new_chunks, new_vecs, new_digests=new_digests)
 
-        with open(HASHES_FILE, "w", encoding="utf-8") as f:
-            json.dump(list(text_hashes), f)
-
-        np.save(VECTORS_FILE, vectors)
+        # Keep the ANN index in step (or train it once the corpus is big enough)
+        if _ann is not None:
+            _ann.sync()
+        else:
+            _open_ann_index()
+        if _lex is not None:
+            _lex.sync_in_background()
 
-        print(f"✅ Added {len(new_chunks)} new chunks → total: {len(clean_docs):,}")
+        print(f"✅ Added {len(new_chunks)} new chunks → total: {len(_store):,}")
         return len(new_chunks)
 
     except Exception as e:
@@ -232,36 +251,160 @@ def embed_new_content(new_texts: List[str], source: str = "file_upload"):
 
 
 # ================================================================
-# Retrieval (used in normal chat / context augmentation)
+# Legacy uploads → partitions (one-shot)
 # ================================================================
-def retrieve_context(query: str, k: int = 5, min_similarity: float = 0.32) -> List[str]:
-    global vectors, clean_docs
+def _legacy_upload_owners() -> Dict[str, Tuple[str, Optional[str]]]:
+    """filename → (user id, upload id) for filenames that exactly one user uploaded."""
+    from app.db.database import SessionLocal
+    from app.db.models import FileUpload
 
+    seen: Dict[str, Dict[str, List[str]]] = {}
+    db = SessionLocal()
+    try:
+        for filename, user_id, upload_id in db.query(FileUpload.filename, FileUpload.user_id, FileUpload.id):
+            if user_id is not None:
+                seen.setdefault(filename, {}).setdefault(str(user_id), []).append(str(upload_id))
+    finally:
+        db.close()
+    return {
+        filename: (user_id, uploads[0] if len(uploads) == 1 else None)
+        for filename, users in seen.items() if len(users) == 1
+        for user_id, uploads in users.items()
+    }
+
+
+def migrate_legacy_uploads(owners: Optional[Dict[str, Tuple[str, Optional[str]]]] = None) -> Tuple[int, int]:
+    """
+    Copy the upload rows that used to live in the shared store (hidden from
+    retrieval by _is_legacy_upload) into their owner's partition, reusing
+    their vectors. The owner is the only user with a FileUpload of that
+    filename; rows whose file cannot be attributed (guest uploads, a name
+    several users uploaded) are left hidden. Runs once per data dir, in one
+    process. Returns (rows migrated, rows left behind).
+    """
+    if _store is None or os.path.exists(LEGACY_UPLOADS_MARKER):
+        return 0, 0
+    os.makedirs(PARTITIONS_DIR, exist_ok=True)
+    lock = FileLock(LEGACY_UPLOADS_MARKER + ".lock")
+    if not lock.acquire(blocking=False):
+        return 0, 0  # another worker is on it
+    try:
+        if os.path.exists(LEGACY_UPLOADS_MARKER):
+            return 0, 0
+        owners = _legacy_upload_owners() if owners is None else owners
+
+        migrated, orphaned = 0, 0
+        segments, starts = _store.snapshot()
+        for seg, seg_start in zip(segments, starts[:-1]):
+            groups: Dict[Tuple[str, str], List[Tuple[int, str]]] = {}
+            for local, text in enumerate(seg.read_all_texts()):
+                match = _LEGACY_UPLOAD_RE.match(text) if _is_legacy_upload(text) else None
+                if match is None:
+                    continue
+                if match.group(1) not in owners:
+                    orphaned += 1
+                    continue
+                groups.setdefault((owners[match.group(1)][0], match.group(1)), []).append(
+                    (int(seg_start) + local, text[match.end():])
+                )
+
+            for (owner, filename), rows in groups.items():
+                part = _partitions.get(owner)
+                chunks = [chunk for _, chunk in rows]
+                digests = np.array([compute_digest(c) for c in chunks], dtype=np.uint64)
+                new = ~part.contains(digests)
+                if not new.any():
+                    continue
+                vectors = _store.take([row for (row, _), keep in zip(rows, new) if keep])
+                part.append(
+                    [c for c, keep in zip(chunks, new) if keep], vectors, [int(d) for d in digests[new]],
+                    source=filename, upload_id=owners[filename][1],
+                )
+                migrated += int(new.sum())
+
+        with open(LEGACY_UPLOADS_MARKER, "w", encoding="utf-8") as f:
+            f.write(f"{migrated} {orphaned}\n")
+        if migrated or orphaned:
+            print(f"🔁 Moved {migrated:,} legacy upload rows into partitions ({orphaned:,} unattributable, left hidden)")
+        return migrated, orphaned
+    finally:
+        lock.release()
+
+
+# ================================================================
+# Retrieval (used in normal chat / context augmentation)
+# ================================================================
+def search_user_uploads(
+    q_vec: np.ndarray,
+    user_id: Optional[str],
+    k: int,
+    sources: Optional[Iterable[str]] = None,
+    upload_ids: Optional[Iterable[str]] = None,
+) -> List[Tuple[float, str]]:
+    """(score, text) hits from the caller's own upload partition, labelled with their source."""
+    try:
+        hits = _partitions.search(q_vec, user_id, k, sources=sources, upload_ids=upload_ids)
+    except Exception as e:
+        print(f"Partition search failed: {e}")
+        return []
+    return [(score, f"[Source: {meta['source']}] {text}") for score, text, meta in hits]
+
+
+def retrieve_context(
+    query: str,
+    k: int = 5,
+    min_similarity: float = 0.32,
+    user_id: Optional[str] = None,
+    sources: Optional[Iterable[str]] = None,
+) -> List[str]:
+    """
+    Shared QA corpus + the caller's own uploads (user_id is the partition
+    owner, see partitions.upload_owner). Other partitions are never scanned.
+    `sources` restricts the search to those uploaded files (the shared
+    corpus is skipped).
+    """
     # ❌ DO NOT load DB here
     # DB must be loaded once at startup
-    if vectors is None:
+    if _store is None:
         raise RuntimeError("Vector DB not initialized. Call load_or_build_db() at startup.")
 
     try:
-        model = get_model()
-        q_vec = model.encode(
-            [query],
-            normalize_embeddings=True,
-            convert_to_numpy=True
-        )
-
-        similarities = np.dot(vectors, q_vec.T).flatten()
-
-        top_indices = np.argsort(similarities)[::-1][:k * 2]
-
-        results = []
-        for idx in top_indices:
-            sim = similarities[idx]
-            if sim >= min_similarity:
-                results.append(clean_docs[idx])
-
-        return results[:k]
+        # Pick up segments appended by other workers
+        if _store.refresh() and _ann is not None:
+            _ann.sync()
+
+        q_vec = get_embedding_service().encode_query(query)
+
+        # Rankings fused with RRF: dense, lexical (BM25), then the caller's uploads
+        rankings, texts = [], {}
+        if not sources and len(_store):
+            if _lex is not None and _lex.pending:
+                _lex.sync_in_background()
+
+            dense_k = max(k * 2, HYBRID_DENSE_K)
+            if _ann is not None:
+                scores, top_indices = _ann.search(q_vec, dense_k)
+            else:
+                scores, top_indices = _store.search(q_vec, dense_k)
+
+            rankings.append([int(idx) for sim, idx in zip(scores, top_indices) if sim >= min_similarity])
+            rankings.append(lexical_candidates(_store, _lex, query, q_vec))
+
+        if user_id is not None:
+            uploads = [h for h in search_user_uploads(q_vec, user_id, k, sources=sources) if h[0] >= min_similarity]
+            rankings.append([("upload", i) for i in range(len(uploads))])
+            texts.update({("upload", i): text for i, (_, text) in enumerate(uploads)})
+
+        out = []
+        for key, _ in rrf_fuse(rankings):
+            # Only the returned rows are read from the text blob
+            text = texts[key] if key in texts else _store.text(key)
+            if not _is_legacy_upload(text):
+                out.append(text)
+            if len(out) == k:
+                break
+        return out
 
     except Exception as e:
         print(f"Retrieval failed: {e}")
-        return []
\ No newline at end of file
+        return []
@@ -0,0 +1,216 @@
+# backend/app/data_processing/extraction.py
+"""
+Page-parallel text extraction for uploaded documents (used by
+api/file_router.py and core/rag.py).
+
+PDFs are split into ranges of EXTRACT_PAGES_PER_TASK pages that are
+extracted in a process pool (pypdf is pure Python, threads would serialize
+on the GIL). Pages with (almost) no text layer are treated as scans: their
+embedded images are OCR'd in the same worker, after downscaling
+(OCR_MAX_SIDE) and Otsu binarization (OCR_BINARIZE), which cuts tesseract
+time on large scans and helps on grey or noisy backgrounds.
+
+iter_pdf_pages() yields (page index, text) in page order as soon as the
+leading ranges are done, so callers chunk and embed while later pages are
+still being extracted. Each document gets EXTRACT_TIME_BUDGET seconds;
+pages not extracted by then are skipped and reported instead of stalling
+the upload; so are the pages of a range whose worker raised.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+EXTRACT_PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "8"))
+EXTRACT_INLINE_MAX_PAGES = int(os.getenv("EXTRACT_INLINE_MAX_PAGES", "8"))  # below this the pool is not worth the IPC
+EXTRACT_TIME_BUDGET = float(os.getenv("EXTRACT_TIME_BUDGET", "180"))
+
+OCR_ENABLED = os.getenv("OCR_ENABLED", "true").lower() == "true"
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_MIN_TEXT_CHARS = int(os.getenv("OCR_MIN_TEXT_CHARS", "25"))  # less text than this → scanned page
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2400"))            # 0 disables downscaling
+OCR_BINARIZE = os.getenv("OCR_BINARIZE", "true").lower() == "true"
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: never fork a process that holds the embedding model and worker threads
+            _pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def _reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def shutdown_extraction_pool() -> None:
+    _reset_pool()
+
+
+# ================================================================
+# OCR
+# ================================================================
+def _otsu_threshold(gray: np.ndarray) -> int:
+    """Grey level that best separates ink from background (Otsu's method)."""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    w0 = np.cumsum(hist)
+    w1 = gray.size - w0
+    cum_mean = np.cumsum(hist * np.arange(256))
+    mu0 = cum_mean / np.maximum(w0, 1)
+    mu1 = (cum_mean[-1] - cum_mean) / np.maximum(w1, 1)
+    between = w0 * w1 * (mu0 - mu1) ** 2
+    return int(np.argmax(between))
+
+
+def prepare_for_ocr(img):
+    """Greyscale, cap the longest side at OCR_MAX_SIDE, then binarize."""
+    from PIL import Image
+
+    img = img.convert("L")
+    if OCR_MAX_SIDE and max(img.size) > OCR_MAX_SIDE:
+        scale = OCR_MAX_SIDE / max(img.size)
+        img = img.resize((max(1, int(img.width * scale)), max(1, int(img.height * scale))), Image.LANCZOS)
+    if OCR_BINARIZE:
+        threshold = _otsu_threshold(np.asarray(img))
+        img = img.point(lambda p: 255 if p > threshold else 0)
+    return img
+
+
+def ocr_image(img, timeout: float = 0) -> str:
+    import pytesseract
+
+    return pytesseract.image_to_string(prepare_for_ocr(img), lang=OCR_LANG, timeout=timeout).strip()
+
+
+def _ocr_page_images(page) -> str:
+    texts = []
+    try:
+        images = page.images
+    except Exception:
+        return ""
+    for image in images:
+        try:
+            text = ocr_image(image.image)
+        except Exception:
+            continue
+        if text:
+            texts.append(text)
+    return "\n".join(texts)
+
+
+# ================================================================
+# PDF pages (runs in the worker processes)
+# ================================================================
+def _extract_range(path: str, start: int, end: int) -> List[Tuple[int, str]]:
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    out = []
+    for i in range(start, end):
+        page = reader.pages[i]
+        try:
+            text = page.extract_text() or ""
+        except Exception:
+            text = ""
+        if OCR_ENABLED and len(text.strip()) < OCR_MIN_TEXT_CHARS:
+            text = _ocr_page_images(page) or text
+        out.append((i, text))
+    return out
+
+
+def pdf_page_count(path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(path).pages)
+
+
+def iter_pdf_pages(
+    path: str,
+    budget: float = EXTRACT_TIME_BUDGET,
+    progress: Optional[Callable[[float], None]] = None,
+    report: Optional[Dict] = None,
+) -> Iterator[Tuple[int, str]]:
+    """
+    (page index, text) for every page of the PDF at `path`, in page order,
+    produced while later ranges are still being extracted. If given,
+    `report["skipped"]` is set to the number of pages lost to the budget
+    or to a failed range.
+    """
+    report = report if report is not None else {}
+    report["skipped"] = 0
+    n = pdf_page_count(path)
+    if n == 0:
+        return
+    progress = progress or (lambda fraction: None)
+    deadline = time.monotonic() + budget
+    ranges = [(s, min(n, s + EXTRACT_PAGES_PER_TASK)) for s in range(0, n, EXTRACT_PAGES_PER_TASK)]
+
+    if n <= EXTRACT_INLINE_MAX_PAGES or EXTRACT_WORKERS <= 1:
+        for start, end in ranges:
+            if time.monotonic() > deadline:
+                report["skipped"] = n - start
+                print(f"⏱️ Extraction budget ({budget:g}s) exhausted: pages {start + 1}-{n} of {n} skipped")
+                return
+            yield from _extract_range(path, start, end)
+            progress(end / n)
+        return
+
+    pool = _get_pool()
+    futures = {pool.submit(_extract_range, path, s, e): s for s, e in ranges}
+    pending = set(futures)
+    finished: Dict[int, List[Tuple[int, str]]] = {}
+    next_start, pages_done = 0, 0
+
+    try:
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                report["skipped"] = n - pages_done - sum(len(r) for r in finished.values())
+                print(f"⏱️ Extraction budget ({budget:g}s) exhausted: {report['skipped']} of {n} pages skipped")
+                break
+            for future in done:
+                start = futures[future]
+                try:
+                    finished[start] = future.result()
+                except BrokenProcessPool:
+                    _reset_pool()
+                    raise
+                except Exception as e:
+                    end = min(n, start + EXTRACT_PAGES_PER_TASK)
+                    print(f"⚠️ Pages {start + 1}-{end} failed: {e}")
+                    # Lost like budget-skipped pages: the text is incomplete and must not be cached
+                    report["skipped"] += end - start
+                    finished[start] = []
+
+            # Hand over the contiguous prefix: page order is kept for the chunker
+            while next_start in finished:
+                pages = finished.pop(next_start)
+                pages_done += len(pages)
+                yield from pages
+                next_start += EXTRACT_PAGES_PER_TASK
+                progress(min(next_start, n) / n)
+
+        # Budget hit: still return what finished after the gap
+        for start in sorted(finished):
+            yield from finished[start]
+    finally:
+        for future in pending:
+            future.cancel()
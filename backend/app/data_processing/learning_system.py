@@ -116,6 +116,31 @@ class AI1LearningSystem:
         
         return adjustment
 
+    def refresh_confidence(self, db: Session, knowledge_id) -> Optional[float]:
+        """
+        Recompute a knowledge entry's confidence after new feedback and push
+        it to the vector index's side table (no re-embedding).
+        """
+        knowledge = db.query(KnowledgeMemory).filter(KnowledgeMemory.id == knowledge_id).first()
+        if not knowledge:
+            return None
+
+        base_quality = self._source_quality.get(knowledge.source, 0.7)
+        raw_confidence = base_quality + self._refine_confidence_from_feedback(db, knowledge.id)
+        knowledge.confidence = max(0.0, min(1.0, raw_confidence))
+        db.commit()
+
+        self._push_index_stats(knowledge)
+        return knowledge.confidence
+
+    def _push_index_stats(self, knowledge: KnowledgeMemory) -> None:
+        try:
+            from app.core.vector import update_knowledge_stats
+
+            update_knowledge_stats(str(knowledge.id), knowledge.confidence, knowledge.usage_count)
+        except Exception as e:
+            print("[LEARNING WARNING] Knowledge index stats not updated:", e)
+
     # =====================================================
     # MAIN LEARNING ENTRYPOINT
     # =====================================================
@@ -182,6 +207,7 @@ class AI1LearningSystem:
             knowledge.confidence = max(0.0, min(1.0, raw_confidence))
 
             db.commit()
+            self._push_index_stats(knowledge)
 
             # =================================================
             # SQLITE — LEGACY MIRROR (UNCHANGED BEHAVIOR)
@@ -0,0 +1,363 @@
+# backend/app/data_processing/lexical_index.py
+"""
+BM25 inverted index over a columnar vector store, for hybrid retrieval.
+
+MiniLM is weak on exact identifiers, error codes and version strings
+("E0425", "numpy 2.1.3", "ECONNREFUSED"); a lexical stage catches those and
+reciprocal rank fusion (rrf_fuse) merges it with the dense results.
+
+The index mirrors the store's segment log: every immutable store segment
+gets one immutable lexical segment, built on sync() after appends and
+compactions, so indexing cost follows the new data only.
+
+    <store>/lexical/<segment name>/
+        terms.bin     → sorted uint64 term hashes
+        offsets.bin   → int64, len(terms) + 1 entries, into the postings
+        docs.bin      → segment-local row ids (uint16 when the segment fits, else uint32)
+        impacts.bin   → uint8 quantized BM25 term weight (tf and length norm, no idf)
+        meta.json     → {"rows", "avgdl", "id_dtype", "k1", "b"}
+
+A term's postings are sorted by impact, best first, so a query reads only
+the top LEXICAL_TERM_POSTINGS entries per term, split over the segments by
+size. idf is
+computed at query time from the document frequencies of all segments,
+and terms found in more than LEXICAL_MAX_DF of the rows are treated as
+stopwords. That bounds query work regardless of corpus size.
+
+    python -m app.data_processing.lexical_index    # index the dataset store, report query latency
+"""
+import array
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.data_processing.columnar_store import ColumnarStore, _fsync_dir, _top_k, _write_file
+
+LEXICAL_ENABLED = os.getenv("LEXICAL_ENABLED", "true").lower() == "true"
+LEXICAL_K1 = float(os.getenv("LEXICAL_K1", "1.2"))
+LEXICAL_B = float(os.getenv("LEXICAL_B", "0.75"))
+LEXICAL_TERM_POSTINGS = int(os.getenv("LEXICAL_TERM_POSTINGS", "2000"))
+LEXICAL_MAX_DF = float(os.getenv("LEXICAL_MAX_DF", "0.25"))
+
+# Per-stage candidate counts and the fusion constant
+HYBRID_DENSE_K = int(os.getenv("HYBRID_DENSE_K", "50"))
+HYBRID_LEXICAL_K = int(os.getenv("HYBRID_LEXICAL_K", "50"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+# Lexical-only hits must still be at least this close in embedding space
+HYBRID_LEXICAL_MIN_SIMILARITY = float(os.getenv("HYBRID_LEXICAL_MIN_SIMILARITY", "0.15"))
+
+LEXICAL_DIR = "lexical"
+FORMAT_VERSION = 1
+
+_TOKEN_RE = re.compile(r"[a-z0-9_]+(?:[.\-/:][a-z0-9_]+)*")
+_SUBTOKEN_RE = re.compile(r"[._\-/:]+")
+
+
+# ================================================================
+# Tokenization
+# ================================================================
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens. Compound tokens ("v2.1.3", "connection_refused",
+    "org/repo") are kept whole and also split into their parts.
+    """
+    tokens = []
+    for tok in _TOKEN_RE.findall(text.lower()):
+        tokens.append(tok)
+        parts = _SUBTOKEN_RE.split(tok)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p)
+    return tokens
+
+
+def term_hash(term: str) -> int:
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+# ================================================================
+# Segment (immutable)
+# ================================================================
+class LexicalSegment:
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported lexical segment version: {meta.get('version')}")
+        self.rows = int(meta["rows"])
+
+        def _map(name, dtype):
+            path = os.path.join(self.path, name)
+            if os.path.getsize(path) == 0:
+                return np.zeros(0, dtype=dtype)
+            # Plain ndarray view of the mapping: slicing an np.memmap subclass is slow on the query path
+            return np.memmap(path, dtype=dtype, mode="r").view(np.ndarray)
+
+        self.terms = _map("terms.bin", np.uint64)
+        self.offsets = _map("offsets.bin", np.int64)
+        self.docs = _map("docs.bin", np.dtype(meta["id_dtype"]))
+        self.impacts = _map("impacts.bin", np.uint8)
+
+    def lookup(self, hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(postings start, document frequency) per hash; df is 0 when the term is absent."""
+        if len(self.terms) == 0:
+            zeros = np.zeros(len(hashes), dtype=np.int64)
+            return zeros, zeros
+        pos = np.minimum(np.searchsorted(self.terms, hashes), len(self.terms) - 1)
+        hit = self.terms[pos] == hashes
+        start = self.offsets[pos]
+        return start, np.where(hit, self.offsets[pos + 1] - start, 0)
+
+    @staticmethod
+    def build(root: str, name: str, texts: Sequence[str], k1: float = LEXICAL_K1, b: float = LEXICAL_B) -> str:
+        """Write the lexical segment for one store segment (temp dir + rename)."""
+        vocab: Dict[str, int] = {}
+        doc_ids, term_ids, tfs = array.array("I"), array.array("I"), array.array("H")
+        doc_len = np.zeros(len(texts), dtype=np.float32)
+
+        for doc, text in enumerate(texts):
+            counts: Dict[int, int] = {}
+            tokens = tokenize(text)
+            for tok in tokens:
+                tid = vocab.setdefault(tok, len(vocab))
+                counts[tid] = counts.get(tid, 0) + 1
+            doc_len[doc] = len(tokens)
+            doc_ids.extend([doc] * len(counts))
+            term_ids.extend(counts.keys())
+            tfs.extend(min(c, 65535) for c in counts.values())
+
+        docs = np.frombuffer(doc_ids, dtype=np.uint32).astype(np.int64)
+        tids = np.frombuffer(term_ids, dtype=np.uint32).astype(np.int64)
+        tf = np.frombuffer(tfs, dtype=np.uint16).astype(np.float32)
+
+        avgdl = float(doc_len.mean()) if len(texts) and doc_len.mean() > 0 else 1.0
+        weight = tf * (k1 + 1) / (tf + k1 * (1 - b + b * doc_len[docs] / avgdl)) if len(tf) else tf
+        impacts = np.clip(np.ceil(weight / (k1 + 1) * 255), 1, 255).astype(np.uint8)
+
+        hashes = np.array([term_hash(t) for t in vocab], dtype=np.uint64)
+        posting_hash = hashes[tids] if len(tids) else np.zeros(0, dtype=np.uint64)
+        order = np.lexsort((-impacts.astype(np.int16), posting_hash))
+        terms, starts = np.unique(posting_hash[order], return_index=True)
+        offsets = np.append(starts, len(order)).astype(np.int64)
+
+        id_dtype = np.dtype(np.uint16 if len(texts) <= 65536 else np.uint32)
+
+        tmp_dir = os.path.join(root, f".{name}.{uuid.uuid4().hex[:8]}.tmp")
+        os.makedirs(tmp_dir)
+        _write_file(os.path.join(tmp_dir, "terms.bin"), terms.tobytes())
+        _write_file(os.path.join(tmp_dir, "offsets.bin"), offsets.tobytes())
+        _write_file(os.path.join(tmp_dir, "docs.bin"), docs[order].astype(id_dtype).tobytes())
+        _write_file(os.path.join(tmp_dir, "impacts.bin"), impacts[order].tobytes())
+        _write_file(os.path.join(tmp_dir, "meta.json"), json.dumps({
+            "version": FORMAT_VERSION, "rows": len(texts), "avgdl": avgdl,
+            "id_dtype": id_dtype.name, "k1": k1, "b": b,
+        }).encode("utf-8"))
+        _fsync_dir(tmp_dir)
+
+        target = os.path.join(root, name)
+        try:
+            os.rename(tmp_dir, target)
+        except OSError:
+            # Another worker built the same segment first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        _fsync_dir(root)
+        return target
+
+
+# ================================================================
+# Index (one lexical segment per store segment)
+# ================================================================
+class LexicalIndex:
+    def __init__(self, store: ColumnarStore):
+        self.store = store
+        self.root = os.path.join(store.root, LEXICAL_DIR)
+        self._segments: Dict[str, LexicalSegment] = {}
+        self._lock = threading.Lock()
+        self._builder: Optional[threading.Thread] = None
+        os.makedirs(self.root, exist_ok=True)
+
+    @classmethod
+    def for_store(cls, store: ColumnarStore, background: bool = True) -> Optional["LexicalIndex"]:
+        """
+        Open the lexical index of a store. Segments that are not indexed yet
+        are built in a background thread (first start over a big corpus);
+        until then only the indexed part is searched lexically.
+        """
+        if not LEXICAL_ENABLED:
+            return None
+        lex = cls(store)
+        lex._open_existing()
+        if background:
+            lex.sync_in_background()
+        else:
+            lex.sync()
+        return lex
+
+    def _open_existing(self) -> None:
+        live = {seg.name for seg in self.store.segments}
+        for name in os.listdir(self.root):
+            if name in live:
+                try:
+                    self._segments[name] = LexicalSegment(os.path.join(self.root, name))
+                except Exception as e:
+                    print(f"⚠️ Lexical segment {name} unusable ({e}) → rebuilding")
+                    shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for seg in self.store.segments if seg.name not in self._segments)
+
+    # ------------------------------------------------------------
+    # Incremental build
+    # ------------------------------------------------------------
+    def sync(self) -> int:
+        """Index store segments that have no lexical segment yet; drop stale ones. Returns segments built."""
+        with self._lock:
+            segments = self.store.segments
+            built = 0
+            for seg in segments:
+                if seg.name in self._segments:
+                    continue
+                path = os.path.join(self.root, seg.name)
+                if not os.path.exists(path):
+                    LexicalSegment.build(self.root, seg.name, seg.read_all_texts())
+                    built += 1
+                self._segments[seg.name] = LexicalSegment(path)
+
+            live = {seg.name for seg in segments}
+            for name in list(self._segments):
+                if name not in live:
+                    del self._segments[name]
+            # Only drop files whose store segment is gone (another worker may be ahead of our view)
+            for name in os.listdir(self.root):
+                if name.startswith(".") or name in live:
+                    continue
+                if not os.path.exists(os.path.join(self.store.root, name)):
+                    shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            return built
+
+    def sync_in_background(self) -> None:
+        if self._builder is not None and self._builder.is_alive():
+            return
+        if not self.pending:
+            return
+
+        def _build():
+            start = time.time()
+            try:
+                built = self.sync()
+                if built:
+                    print(f"🔤 Lexical index: {built} segment(s) indexed in {time.time() - start:.1f}s")
+            except Exception as e:
+                print(f"⚠️ Lexical index build failed: {e}")
+
+        self._builder = threading.Thread(target=_build, name="lexical-index-build", daemon=True)
+        self._builder.start()
+
+    # ------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------
+    def search(self, query: str, k: int = HYBRID_LEXICAL_K) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25 top-k over the indexed segments. Returns (scores, global row ids), best first."""
+        empty = np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        hashes = np.unique(np.array([term_hash(t) for t in set(tokenize(query))], dtype=np.uint64))
+        segments, starts = self.store.snapshot()
+        indexed = [(self._segments.get(seg.name), int(start)) for seg, start in zip(segments, starts[:-1])]
+        indexed = [(lseg, start) for lseg, start in indexed if lseg is not None]
+        if k <= 0 or len(hashes) == 0 or not indexed:
+            return empty
+
+        n = sum(lseg.rows for lseg, _ in indexed)
+        found = [lseg.lookup(hashes) for lseg, _ in indexed]
+        df = np.sum([seg_df for _, seg_df in found], axis=0)
+        keep = (df > 0) & (df <= LEXICAL_MAX_DF * n)
+        if not keep.any() and (df > 0).any():
+            keep = df == df[df > 0].min()  # only common terms: use the rarest one
+        if not keep.any():
+            return empty
+        idf = np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        terms = np.flatnonzero(keep).tolist()
+
+        ids, weights = [], []
+        for (lseg, start), (pos, seg_df) in zip(indexed, found):
+            limit = max(32, -(-LEXICAL_TERM_POSTINGS * lseg.rows // n))
+            pos, seg_df = pos.tolist(), seg_df.tolist()
+            for t in terms:
+                if seg_df[t]:
+                    lo = pos[t]
+                    hi = lo + min(seg_df[t], limit)
+                    ids.append(lseg.docs[lo:hi].astype(np.int64) + start)
+                    weights.append(lseg.impacts[lo:hi] * idf[t])
+        if not ids:
+            return empty
+
+        uniq, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights)).astype(np.float32)
+        scores *= (LEXICAL_K1 + 1) / 255.0
+        top = _top_k(scores, k)
+        return scores[top], uniq[top]
+
+
+# ================================================================
+# Fusion
+# ================================================================
+def rrf_fuse(rankings: Sequence[Sequence[Hashable]], k: int = HYBRID_RRF_K) -> List[Tuple[Hashable, float]]:
+    """Reciprocal rank fusion: score(d) = Σ 1 / (k + rank). Best first."""
+    scores: Dict[Hashable, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+
+
+def lexical_candidates(
+    store: ColumnarStore,
+    lex: Optional[LexicalIndex],
+    query: str,
+    q_vec: np.ndarray,
+    k: int = HYBRID_LEXICAL_K,
+    min_similarity: float = HYBRID_LEXICAL_MIN_SIMILARITY,
+) -> List[int]:
+    """Lexical top-k row ids, dropping rows that are unrelated in embedding space."""
+    if lex is None:
+        return []
+    _, ids = lex.search(query, k)
+    if len(ids) == 0:
+        return []
+    sims = store.take(ids) @ np.asarray(q_vec, dtype=np.float32).reshape(-1)
+    return [int(i) for i, s in zip(ids, sims) if s >= min_similarity]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app.data_processing.embed_dataset import STORE_DIR
+
+    parser = argparse.ArgumentParser(description="Build the lexical index and report BM25 query latency")
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=HYBRID_LEXICAL_K)
+    args = parser.parse_args()
+
+    store = ColumnarStore(args.store)
+    lex = LexicalIndex(store)
+    lex._open_existing()
+    t0 = time.time()
+    built = lex.sync()
+    print(f"indexed segments: {built} new in {time.time() - t0:.1f}s, {len(store):,} rows")
+
+    rng = np.random.default_rng(2)
+    sample = rng.choice(len(store), size=min(args.queries, len(store)), replace=False)
+    queries = [" ".join(tokenize(store.text(int(i)))[:6]) for i in sample]
+    t0 = time.perf_counter()
+    for q in queries:
+        lex.search(q, args.k)
+    print(f"mean query: {(time.perf_counter() - t0) / max(1, len(queries)) * 1000:.3f} ms")
@@ -0,0 +1,288 @@
+# backend/app/data_processing/partitions.py
+"""
+Per-owner partitions for uploaded content.
+
+Every owner gets its own ColumnarStore, so a query only scans the shared
+QA corpus plus the caller's partition: latency does not grow with the
+number of users and one user's uploads are never returned to another.
+The owner is the user id, or for anonymous sessions the guest chat id
+("guest-..."), see upload_owner(); guests never share a partition.
+
+Chunk metadata is kept column-wise next to each partition's store:
+    partitions/<owner>/
+        manifest.json, seg-*   → the partition's ColumnarStore
+        rows.bin               → one (upload code int32, timestamp float64) record per store row
+        uploads.jsonl          → upload dictionary: {"code", "upload_id", "source", "owner", "timestamp"}
+
+rows.bin is aligned with the store's global row numbers (segment
+compaction preserves them). Records are written at their row position
+before the store's manifest commits, so a crash can only leave records past
+the store's end, which the next append overwrites and readers never map.
+Appends hold <owner>/.partition.lock and re-read the on-disk store length
+and upload dictionary first, so worker processes never hand out the same
+upload code or row position twice.
+Source / upload filters become a boolean mask over the upload column that
+is applied before the top-k.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from app.data_processing.columnar_store import COMPACT_MIN_RUN, SEARCH_BLOCK_ROWS, ColumnarStore, FileLock, _top_k
+
+PARTITION_CACHE_SIZE = int(os.getenv("PARTITION_CACHE_SIZE", "256"))
+
+GUEST_OWNER = "guest"
+GUEST_CHAT_PREFIX = "guest-"
+ROWS_NAME = "rows.bin"
+UPLOADS_NAME = "uploads.jsonl"
+LOCK_NAME = ".partition.lock"
+
+ROW_DTYPE = np.dtype([("upload", "<i4"), ("ts", "<f8")])
+
+
+def owner_key(user_id: Optional[str]) -> str:
+    """Directory-safe partition name for a user id (None → guest)."""
+    if not user_id:
+        return GUEST_OWNER
+    return re.sub(r"[^A-Za-z0-9_-]", "_", str(user_id))
+
+
+def upload_owner(user_id: Optional[str], chat_id: Optional[str] = None) -> Optional[str]:
+    """Partition owner of a request: the user id, else the guest chat id; None → no uploads."""
+    if user_id and str(user_id) != GUEST_OWNER:
+        return str(user_id)
+    if chat_id and str(chat_id).startswith(GUEST_CHAT_PREFIX):
+        return str(chat_id)
+    return None
+
+
+def _write_at(path: str, offset: int, payload: bytes) -> None:
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.seek(offset)
+        f.write(payload)
+        f.truncate()
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# ================================================================
+# Partition (one owner)
+# ================================================================
+class Partition:
+    def __init__(self, root: str, owner: str):
+        self.root = root
+        self.owner = owner
+        self.rows_path = os.path.join(root, ROWS_NAME)
+        self.uploads_path = os.path.join(root, UPLOADS_NAME)
+
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(os.path.join(root, LOCK_NAME))
+        self.store: Optional[ColumnarStore] = None
+        self.uploads: List[Dict] = []
+        self._uploads_bytes = 0
+        self._rows = np.zeros(0, dtype=ROW_DTYPE)
+
+        if ColumnarStore.exists(root):
+            self.store = ColumnarStore(root)
+            self._load_meta()
+
+    def __len__(self) -> int:
+        return len(self.store) if self.store is not None else 0
+
+    # ------------------------------------------------------------
+    # Metadata columns
+    # ------------------------------------------------------------
+    def _load_meta(self) -> None:
+        n = len(self.store)
+        if n and os.path.exists(self.rows_path) and os.path.getsize(self.rows_path) >= n * ROW_DTYPE.itemsize:
+            self._rows = np.memmap(self.rows_path, dtype=ROW_DTYPE, mode="r", shape=(n,))
+        else:
+            self._rows = np.zeros(0, dtype=ROW_DTYPE)
+
+        self.uploads, self._uploads_bytes = [], 0
+        if os.path.exists(self.uploads_path):
+            with open(self.uploads_path, "rb") as f:
+                for line in f:
+                    try:
+                        self.uploads.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        break  # torn last line, overwritten by the next upload
+                    self._uploads_bytes += len(line)
+
+    def refresh(self) -> None:
+        """Pick up appends made by another worker process."""
+        if self.store is None:
+            if ColumnarStore.exists(self.root):
+                with self._lock:
+                    self.store = ColumnarStore(self.root)
+                    self._load_meta()
+            return
+        if self.store.refresh() or len(self._rows) != len(self.store):
+            with self._lock:
+                self._load_meta()
+
+    def _codes_for(self, sources: Optional[Iterable[str]], upload_ids: Optional[Iterable[str]]) -> np.ndarray:
+        sources = set(sources) if sources else None
+        upload_ids = {str(u) for u in upload_ids} if upload_ids else None
+        return np.array([
+            u["code"] for u in self.uploads
+            if (sources is None or u["source"] in sources)
+            and (upload_ids is None or u["upload_id"] in upload_ids)
+        ], dtype=np.int32)
+
+    def contains(self, digests: np.ndarray) -> np.ndarray:
+        if self.store is None:
+            return np.zeros(len(digests), dtype=bool)
+        return self.store.contains(digests)
+
+    # ------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------
+    def append(
+        self,
+        texts: List[str],
+        vectors: np.ndarray,
+        digests: Iterable[int],
+        source: str,
+        upload_id: Optional[str] = None,
+        timestamp: Optional[float] = None,
+    ) -> int:
+        if not texts:
+            return 0
+        timestamp = time.time() if timestamp is None else timestamp
+
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, self._file_lock:
+            # Another process may have appended or created the store: continue from what is on disk
+            if self.store is None:
+                if ColumnarStore.exists(self.root):
+                    self.store = ColumnarStore(self.root)
+                else:
+                    self.store = ColumnarStore.create(self.root, [], np.zeros((0, 0), dtype=np.float32))
+            self.store.refresh()
+            self._load_meta()
+
+            upload = {
+                "code": len(self.uploads),
+                "upload_id": str(upload_id) if upload_id is not None else f"{source}@{timestamp:.0f}",
+                "source": source,
+                "owner": self.owner,
+                "timestamp": timestamp,
+            }
+            _write_at(self.uploads_path, self._uploads_bytes, (json.dumps(upload) + "\n").encode("utf-8"))
+            self.uploads.append(upload)
+
+            rows = np.zeros(len(texts), dtype=ROW_DTYPE)
+            rows["upload"] = upload["code"]
+            rows["ts"] = timestamp
+            _write_at(self.rows_path, len(self.store) * ROW_DTYPE.itemsize, rows.tobytes())
+
+            # The store's manifest swap is the commit point for the rows above
+            self.store.append(texts, vectors, new_digests=digests)
+            self._load_meta()
+
+        # One segment per upload: merge small ones inline, partitions are small
+        if len(self.store.segments) >= COMPACT_MIN_RUN * 2:
+            self.store.compact()
+        return len(texts)
+
+    # ------------------------------------------------------------
+    # Reads
+    # ------------------------------------------------------------
+    def search(
+        self,
+        q_vec: np.ndarray,
+        k: int,
+        sources: Optional[Iterable[str]] = None,
+        upload_ids: Optional[Iterable[str]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact search over this partition, optionally prefiltered by source / upload id."""
+        store, rows = self.store, self._rows
+        if store is None or len(store) == 0 or k <= 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        if not sources and not upload_ids:
+            return store.search(q_vec, k)
+
+        allowed = np.isin(rows["upload"], self._codes_for(sources, upload_ids))
+        if not allowed.any():
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        q = np.asarray(q_vec, dtype=np.float32).reshape(-1)
+        n = min(len(store), len(rows))
+        cand_scores, cand_idx = [], []
+        for lo in range(0, n, SEARCH_BLOCK_ROWS):
+            hi = min(n, lo + SEARCH_BLOCK_ROWS)
+            mask = allowed[lo:hi]
+            if not mask.any():
+                continue
+            idx = np.flatnonzero(mask) + lo
+            scores = store.take(idx) @ q if len(idx) < (hi - lo) // 4 else (store.rows(lo, hi) @ q)[mask]
+            top = _top_k(scores, k)
+            cand_scores.append(scores[top])
+            cand_idx.append(idx[top])
+
+        all_scores, all_idx = np.concatenate(cand_scores), np.concatenate(cand_idx)
+        order = _top_k(all_scores, k)
+        return all_scores[order], all_idx[order]
+
+    def metadata(self, idx: int) -> Dict:
+        row = self._rows[idx]
+        upload = self.uploads[int(row["upload"])] if 0 <= int(row["upload"]) < len(self.uploads) else {}
+        return {
+            "owner": self.owner,
+            "source": upload.get("source"),
+            "upload_id": upload.get("upload_id"),
+            "timestamp": float(row["ts"]),
+        }
+
+
+# ================================================================
+# Partition set (lazy, LRU-bounded)
+# ================================================================
+class PartitionSet:
+    def __init__(self, root: str, cache_size: int = PARTITION_CACHE_SIZE):
+        self.root = root
+        self.cache_size = cache_size
+        self._open: "OrderedDict[str, Partition]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: Optional[str]) -> Partition:
+        key = owner_key(user_id)
+        with self._lock:
+            part = self._open.get(key)
+            if part is not None:
+                self._open.move_to_end(key)
+                return part
+        # Opening maps files; do it outside the set-wide lock
+        part = Partition(os.path.join(self.root, key), key)
+        with self._lock:
+            part = self._open.setdefault(key, part)
+            self._open.move_to_end(key)
+            while len(self._open) > self.cache_size:
+                self._open.popitem(last=False)
+        return part
+
+    def search(
+        self,
+        q_vec: np.ndarray,
+        user_id: Optional[str],
+        k: int,
+        sources: Optional[Iterable[str]] = None,
+        upload_ids: Optional[Iterable[str]] = None,
+    ) -> List[Tuple[float, str, Dict]]:
+        """(score, text, metadata) hits from the caller's own partition only."""
+        part = self.get(user_id)
+        part.refresh()
+        scores, idx = part.search(q_vec, k, sources=sources, upload_ids=upload_ids)
+        if len(idx) == 0:
+            return []
+        texts = part.store.texts(idx)
+        return [(float(s), t, part.metadata(int(i))) for s, i, t in zip(scores, idx, texts)]
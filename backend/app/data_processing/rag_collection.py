@@ -0,0 +1,191 @@
+# backend/app/data_processing/rag_collection.py
+"""
+On-disk format of one RAG collection (used by core/rag.py).
+
+    rag_collections/<id>/
+        manifest.json, seg-*/  → ColumnarStore: chunk texts + vectors, memory-mapped
+        chunks.npy             → int32 (count x 2): source number, page (-1 = none)
+        collection.json        → {"version", "sources": [filename, ...]}
+        index.faiss            → HNSW index, only for collections of ANN_MIN_VECTORS+ chunks
+
+Opening a collection maps a few files and reads one small JSON, so a cold
+query costs no client start-up and no SQLite; small collections are
+searched exactly, large ones through the shared ANN engine.
+
+Collections written by the former Chroma backend (chroma.sqlite3) are read
+with read_chroma_collection(): documents and metadata live in plain SQLite
+tables, the vectors are recomputed by the caller with the same model.
+"""
+import json
+import os
+import sqlite3
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.data_processing.ann_index import AnnIndex
+from app.data_processing.columnar_store import ColumnarStore, _atomic_write_json
+
+COLLECTION_VERSION = 1
+META_NAME = "collection.json"
+CHUNKS_NAME = "chunks.npy"
+CHROMA_DB_NAME = "chroma.sqlite3"
+
+RAG_VECTOR_DTYPE = os.getenv("RAG_VECTOR_DTYPE", "float16")
+RAG_ANN_ENGINE = os.getenv("RAG_ANN_ENGINE", "hnsw").lower()  # "flat" → always exact
+
+# Splitter settings (former RecursiveCharacterTextSplitter configuration)
+RAG_CHUNK_SIZE = int(os.getenv("RAG_CHUNK_SIZE", "800"))
+RAG_CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "150"))
+SEPARATORS = ("\n\n", "\n", ". ", "! ", "? ", " ", "")
+
+
+# ================================================================
+# Splitter
+# ================================================================
+def _merge(pieces: List[str], sep: str, chunk_size: int, overlap: int) -> List[str]:
+    """Pack pieces into chunks of at most chunk_size, repeating ~overlap chars."""
+    chunks, window, total = [], [], 0
+    for piece in pieces:
+        joiner = len(sep) if window else 0
+        if window and total + joiner + len(piece) > chunk_size:
+            chunks.append(sep.join(window))
+            # Keep a tail of the previous chunk as the overlap
+            while window and (total > overlap or total + len(sep) + len(piece) > chunk_size):
+                total -= len(window[0]) + (len(sep) if len(window) > 1 else 0)
+                window.pop(0)
+        total += (len(sep) if window else 0) + len(piece)
+        window.append(piece)
+    if window:
+        chunks.append(sep.join(window))
+    return chunks
+
+
+def split_text(
+    text: str,
+    chunk_size: int = RAG_CHUNK_SIZE,
+    overlap: int = RAG_CHUNK_OVERLAP,
+    separators: Tuple[str, ...] = SEPARATORS,
+) -> List[str]:
+    """
+    Recursive character split: cut on the coarsest separator present
+    (paragraph → line → sentence → word → character) and split only the
+    pieces that are still too long with the finer ones.
+    """
+    sep, finer = separators[-1], ()
+    for i, candidate in enumerate(separators):
+        if candidate == "" or candidate in text:
+            sep, finer = candidate, separators[i + 1:]
+            break
+
+    pieces = text.split(sep) if sep else list(text)
+    chunks, fitting = [], []
+    for piece in pieces:
+        if not piece:
+            continue
+        if len(piece) <= chunk_size:
+            fitting.append(piece)
+            continue
+        if fitting:
+            chunks.extend(_merge(fitting, sep, chunk_size, overlap))
+            fitting = []
+        chunks.extend(split_text(piece, chunk_size, overlap, finer) if finer else [piece])
+    if fitting:
+        chunks.extend(_merge(fitting, sep, chunk_size, overlap))
+    return [c.strip() for c in chunks if c.strip()]
+
+
+# ================================================================
+# Collection
+# ================================================================
+class RagCollection:
+    def __init__(self, root: str):
+        self.root = root
+        with open(os.path.join(root, META_NAME), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != COLLECTION_VERSION:
+            raise ValueError(f"Unsupported collection version: {meta.get('version')}")
+
+        self.sources: List[str] = meta["sources"]
+        self.store: Optional[ColumnarStore] = ColumnarStore(root)
+        self.chunks = np.load(os.path.join(root, CHUNKS_NAME), mmap_mode="r")
+        self.ann: Optional[AnnIndex] = AnnIndex.for_store(self.store, RAG_ANN_ENGINE) if len(self.store) else None
+
+    @staticmethod
+    def exists(root: str) -> bool:
+        return os.path.exists(os.path.join(root, META_NAME))
+
+    @staticmethod
+    def is_chroma(root: str) -> bool:
+        return not RagCollection.exists(root) and os.path.exists(os.path.join(root, CHROMA_DB_NAME))
+
+    @classmethod
+    def create(
+        cls,
+        root: str,
+        texts: List[str],
+        vectors: np.ndarray,
+        sources: List[str],
+        chunks: np.ndarray,
+    ) -> "RagCollection":
+        """Write a complete collection; `chunks` holds (source number, page) per text."""
+        if len(texts) != len(chunks):
+            raise ValueError("texts and chunk metadata must have the same length")
+        ColumnarStore.create(root, texts, vectors, dtype=RAG_VECTOR_DTYPE)
+        np.save(os.path.join(root, CHUNKS_NAME), np.asarray(chunks, dtype=np.int32).reshape(-1, 2))
+        # Written last: a collection without it is incomplete
+        _atomic_write_json(os.path.join(root, META_NAME), {"version": COLLECTION_VERSION, "sources": sources})
+        return cls(root)
+
+    def __len__(self) -> int:
+        return len(self.store) if self.store is not None else 0
+
+    def search(self, q_vec: np.ndarray, k: int) -> List[Dict]:
+        """Top-k chunks by inner product, best first: {"content", "source", "page", "ip"}."""
+        if self.store is None:
+            raise RuntimeError("collection is closed")
+        if self.ann is not None:
+            scores, ids = self.ann.search(q_vec, k)
+        else:
+            scores, ids = self.store.search(q_vec, k)
+
+        hits = []
+        for score, idx, text in zip(scores, ids, self.store.texts(int(i) for i in ids)):
+            source, page = (int(v) for v in self.chunks[idx])
+            hits.append({
+                "content": text,
+                "source": self.sources[source] if 0 <= source < len(self.sources) else "unknown",
+                "page": page if page >= 0 else None,
+                "ip": float(score),
+            })
+        return hits
+
+    def close(self) -> None:
+        # Drop every memmap so the files can be removed (Windows)
+        self.ann = None
+        self.store = None
+        self.chunks = None
+
+
+# ================================================================
+# Former Chroma collections
+# ================================================================
+def read_chroma_collection(root: str) -> Iterator[Tuple[str, str, Optional[int]]]:
+    """(document, source, page) of every chunk stored by the Chroma backend."""
+    conn = sqlite3.connect(f"file:{os.path.join(root, CHROMA_DB_NAME)}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT m.id, m.key, m.string_value, m.int_value FROM embedding_metadata m "
+            "WHERE m.key IN ('chroma:document', 'source', 'page') ORDER BY m.id"
+        )
+        current, fields = None, {}
+        for row_id, key, string_value, int_value in rows:
+            if row_id != current:
+                if fields.get("chroma:document"):
+                    yield fields["chroma:document"], fields.get("source") or "unknown", fields.get("page")
+                current, fields = row_id, {}
+            fields[key] = string_value if string_value is not None else int_value
+        if fields.get("chroma:document"):
+            yield fields["chroma:document"], fields.get("source") or "unknown", fields.get("page")
+    finally:
+        conn.close()
@@ -366,4 +366,47 @@ class RatedAnswer(Base):
 
     __table_args__ = (
         Index('idx_rated_user_question', "user_id", "question"),
-    )
\ No newline at end of file
+    )
+
+# ==========================================================
+# INGESTION JOB MODEL (BACKGROUND UPLOAD PROCESSING)
+# ==========================================================
+class IngestionJob(Base):
+    """
+    Durable queue entry for an uploaded file (see app/core/ingestion.py).
+    Workers claim rows with SELECT ... FOR UPDATE SKIP LOCKED; progress is
+    written back here so any process can report it.
+    """
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
+
+    kind = Column(String(20), nullable=False)                 # "upload" | "rag"
+    user_id = Column(String(64), nullable=True, index=True)   # owner key ("guest" for anonymous)
+    filename = Column(String(255), nullable=False)
+    file_path = Column(String(500), nullable=False)
+    payload = Column(Text, nullable=True)                     # JSON handler arguments
+
+    # queued → running → succeeded | failed
+    status = Column(String(20), default="queued", nullable=False, index=True)
+    stage = Column(String(20), nullable=True)                 # extract / chunk / embed / index / analyze
+    progress = Column(Float, default=0.0)
+
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    error = Column(Text, nullable=True)
+    result = Column(Text, nullable=True)                      # JSON
+
+    run_after = Column(DateTime(timezone=True), server_default=func.now())
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        Index("idx_ingestion_claim", "status", "run_after"),
+    )
+
+    def __repr__(self):
+        return f"<IngestionJob(id={self.id}, kind={self.kind}, status={self.status}, stage={self.stage})>"
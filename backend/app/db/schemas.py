@@ -101,6 +101,8 @@ class ChatMessageCreate(BaseModel):
     chat_id: Optional[str] = None
     message: str
     collection_id: Optional[str] = None
+    collection_ids: Optional[list[str]] = None   # searched together, merged top-k
+    collection_group: Optional[str] = None       # group name returned by /files/upload-rag
     conversation_history: Optional[list[str]] = None
     enable_web_search: bool = True  
     response_style: Optional[str] = "balanced"
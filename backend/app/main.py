@@ -1,7 +1,9 @@
 # backend/app/main.py
+import asyncio
 import random
 import secrets
 import os
+import threading
 from pathlib import Path
 from uuid import UUID
 from datetime import datetime, timedelta
@@ -135,17 +137,67 @@ app.add_middleware(
 
 @app.on_event("startup")
 async def startup_init():
-    from app.core.vector import get_sentence_transformer
-    from app.data_processing.embed_dataset import load_or_build_db
+    from app.core.embeddings import get_embedding_service
+    from app.data_processing.embed_dataset import load_or_build_db, migrate_legacy_uploads
 
+    # One shared model for vector.py, embed_dataset.py and rag.py
     print("🔥 Warming up embedding model...")
-    get_sentence_transformer()
+    get_embedding_service().warm_up()
 
     print("📦 Loading Nexora vector database...")
     load_or_build_db()
 
+    # Uploads that predate per-owner partitions move into them (once, in the background)
+    threading.Thread(target=migrate_legacy_uploads, name="legacy-upload-migration", daemon=True).start()
+
     print("✅ Model & Vector DB initialized (once)")
 
+    # One pooled Ollama client for every route and worker thread
+    from app.core.ollama_client import ollama
+    await ollama.open()
+
+    # RAM / CPU / loaded-model sampling for model selection (first sample taken here)
+    from app.core.resource_monitor import resource_monitor
+    await resource_monitor.start()
+
+    # Load the hot models in the background so the first chat does not pay the cold start
+    from app.core.llm_inference import select_optimal_model
+    from app.core.model_residency import model_residency
+    model_residency.start(default_model=select_optimal_model())
+
+    # Upload processing (also resumes jobs queued or interrupted before a restart)
+    from app.core.ingestion import ingestion_queue
+    ingestion_queue.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_flush():
+    from app.core.vector import flush_knowledge_index
+
+    # Queued knowledge entries are journaled; flushing here just skips the replay on next start.
+    # Off the event loop and bounded, so a failing batch cannot hold up the steps below
+    await asyncio.to_thread(flush_knowledge_index)
+
+    # Release pooled RAG collection handles (memory-mapped files)
+    from app.core.rag import collection_pool
+    collection_pool.close_all()
+
+    # Running ingestion jobs stop heartbeating and are picked up again after restart
+    from app.core.ingestion import ingestion_queue
+    ingestion_queue.stop()
+
+    from app.data_processing.extraction import shutdown_extraction_pool
+    shutdown_extraction_pool()
+
+    from app.core.model_residency import model_residency
+    await model_residency.stop()
+
+    from app.core.resource_monitor import resource_monitor
+    await resource_monitor.stop()
+
+    from app.core.ollama_client import ollama
+    await ollama.aclose()
+
 # =============================================================
 # 🔐 DEMO PROTECTION (SINGLE, CORRECT)
 # =============================================================
@@ -0,0 +1,181 @@
+# backend/test_generation_scheduler.py
+"""Generation admission: priority order, per-user round-robin, starvation override, cancellation."""
+import asyncio
+
+import pytest
+
+from app.core import generation_scheduler as gs
+from app.core.generation_scheduler import (
+    PRIORITY_API,
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    GenerationOverloaded,
+    GenerationScheduler,
+)
+
+MODEL = "m"
+
+
+def _scheduler() -> GenerationScheduler:
+    # One slot: every request after the first queues
+    return GenerationScheduler(slots_per_model=1, model_slots={}, max_active=1)
+
+
+async def _serve(sched: GenerationScheduler, requests, pause: float = 0.0):
+    """Queue `requests` ((priority, user, label), in order) behind a held slot; return service order."""
+    order, gate = [], asyncio.Event()
+
+    async def holder():
+        async with sched.slot(MODEL, PRIORITY_INTERACTIVE, "holder"):
+            await gate.wait()
+
+    async def request(priority, user, label):
+        async with sched.slot(MODEL, priority, user):
+            order.append(label)
+
+    tasks = [asyncio.create_task(holder())]
+    await asyncio.sleep(0)
+    for req in requests:
+        tasks.append(asyncio.create_task(request(*req)))
+        await asyncio.sleep(0)
+    await asyncio.sleep(pause)
+    gate.set()
+    await asyncio.gather(*tasks)
+    assert sched.stats()["active"] == 0
+    return order
+
+
+def test_priority_order():
+    order = asyncio.run(_serve(_scheduler(), [
+        (PRIORITY_BACKGROUND, "u1", "title"),
+        (PRIORITY_API, "u2", "api"),
+        (PRIORITY_INTERACTIVE, "u3", "chat"),
+        (PRIORITY_API, "u4", "api2"),
+    ]))
+    assert order == ["chat", "api", "api2", "title"]
+
+
+def test_round_robin_between_users():
+    order = asyncio.run(_serve(_scheduler(), [
+        (PRIORITY_INTERACTIVE, "burst", "b1"),
+        (PRIORITY_INTERACTIVE, "burst", "b2"),
+        (PRIORITY_INTERACTIVE, "burst", "b3"),
+        (PRIORITY_INTERACTIVE, "alice", "a1"),
+        (PRIORITY_INTERACTIVE, "bob", "c1"),
+    ]))
+    assert order == ["b1", "a1", "c1", "b2", "b3"]
+
+
+def test_starving_waiter_goes_first(monkeypatch):
+    requests = [(PRIORITY_BACKGROUND, "u1", "old title"), (PRIORITY_INTERACTIVE, "u2", "chat")]
+    assert asyncio.run(_serve(_scheduler(), requests)) == ["chat", "old title"]
+
+    monkeypatch.setattr(gs, "GEN_MAX_STARVATION", 0.05)
+    assert asyncio.run(_serve(_scheduler(), requests, pause=0.1)) == ["old title", "chat"]
+
+
+def test_cancelled_waiter_leaves_queue():
+    async def scenario():
+        sched = _scheduler()
+        order, gate = [], asyncio.Event()
+
+        async def holder():
+            async with sched.slot(MODEL, PRIORITY_INTERACTIVE, "holder"):
+                await gate.wait()
+
+        async def request(label):
+            async with sched.slot(MODEL, PRIORITY_INTERACTIVE, label):
+                order.append(label)
+
+        h = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        gone = asyncio.create_task(request("gone"))
+        kept = asyncio.create_task(request("kept"))
+        await asyncio.sleep(0)
+        assert sched.stats()["models"][MODEL]["queued"][PRIORITY_INTERACTIVE] == 2
+
+        gone.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await gone
+        assert sched.stats()["models"][MODEL]["queued"][PRIORITY_INTERACTIVE] == 1
+
+        gate.set()
+        await asyncio.gather(h, kept)
+        assert order == ["kept"]
+        assert sched.stats()["active"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_cancel_as_slot_is_granted_releases_it():
+    async def scenario():
+        sched = _scheduler()
+        held = sched.slot(MODEL, PRIORITY_INTERACTIVE, "holder")
+        await held.__aenter__()
+
+        entered = []
+
+        async def request():
+            async with sched.slot(MODEL, PRIORITY_INTERACTIVE, "u1"):
+                entered.append(True)
+                await asyncio.sleep(10)
+
+        task = asyncio.create_task(request())
+        await asyncio.sleep(0)
+
+        # Freeing the slot grants it to the waiter, which is cancelled before it resumes
+        await held.__aexit__(None, None, None)
+        assert sched.stats()["active"] == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert entered == []
+        assert sched.stats()["active"] == 0
+
+        # The slot is usable again
+        async with sched.slot(MODEL, PRIORITY_INTERACTIVE, "u2"):
+            assert sched.stats()["active"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_sheds(monkeypatch):
+    monkeypatch.setitem(gs.QUEUE_DEPTH, PRIORITY_API, 1)
+
+    async def scenario():
+        sched = _scheduler()
+        gate = asyncio.Event()
+
+        async def hold(priority):
+            async with sched.slot(MODEL, priority, "u"):
+                await gate.wait()
+
+        tasks = [asyncio.create_task(hold(PRIORITY_INTERACTIVE)), asyncio.create_task(hold(PRIORITY_API))]
+        await asyncio.sleep(0)
+        with pytest.raises(GenerationOverloaded) as exc:
+            sched.check(MODEL, PRIORITY_API)
+        assert exc.value.retry_after >= 1
+        sched.check(MODEL, PRIORITY_INTERACTIVE)  # other classes still admitted
+        gate.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_gives_up_the_place(monkeypatch):
+    monkeypatch.setitem(gs.QUEUE_TIMEOUT, PRIORITY_BACKGROUND, 0.05)
+
+    async def scenario():
+        sched = _scheduler()
+        held = sched.slot(MODEL, PRIORITY_INTERACTIVE, "holder")
+        await held.__aenter__()
+        with pytest.raises(GenerationOverloaded):
+            async with sched.slot(MODEL, PRIORITY_BACKGROUND, "u1"):
+                pass
+        stats = sched.stats()
+        assert stats["models"][MODEL]["queued"][PRIORITY_BACKGROUND] == 0
+        assert stats["timed_out"][PRIORITY_BACKGROUND] == 1
+        await held.__aexit__(None, None, None)
+        assert sched.stats()["active"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,153 @@
+# backend/test_ingestion.py
+"""Ingestion queue claims, fencing, retries and stale-job recovery against SQLite."""
+import os
+from datetime import timedelta
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.core import ingestion
+from app.core.ingestion import IngestionQueue, JobContext, JobLostError, PermanentJobError, _now
+from app.db.models import IngestionJob
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    IngestionJob.__table__.create(engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    monkeypatch.setattr(ingestion, "SessionLocal", factory)
+    session = factory()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _submit(db, queue: IngestionQueue, max_attempts: int = 3) -> IngestionJob:
+    job = queue.submit(db, kind="upload", filename="a.pdf", file_path="/tmp/a.pdf", user_id="u1",
+                       payload={"ext": "pdf"}, max_attempts=max_attempts)
+    # Due at once (SQLite's server default is only second-precise)
+    job.run_after = _now() - timedelta(seconds=1)
+    db.commit()
+    return job
+
+
+def _row(db, job) -> IngestionJob:
+    db.expire_all()
+    return db.query(IngestionJob).filter(IngestionJob.id == job.id).one()
+
+
+def _go_stale(db, job) -> None:
+    _row(db, job).heartbeat_at = _now() - timedelta(seconds=ingestion.INGEST_STALE_SECONDS + 5)
+    db.commit()
+
+
+def test_claim_compare_and_set(db):
+    a, b = IngestionQueue(), IngestionQueue()
+    job = _submit(db, a)
+
+    # B claims the job between A's read and A's update (SKIP LOCKED is not enforced on SQLite)
+    engine = db.get_bind()
+    raced = {}
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def race(conn, cursor, statement, params, context, executemany):
+        if statement.startswith("UPDATE ingestion_jobs") and not raced:
+            raced["b"] = None
+            raced["b"] = b._claim()
+
+    assert a._claim() is None
+    event.remove(engine, "before_cursor_execute", race)
+
+    assert raced["b"]["job_id"] == str(job.id) and raced["b"]["attempts"] == 1
+    row = _row(db, job)
+    assert (row.status, row.attempts) == ("running", 1)
+    assert a._claim() is None and b._claim() is None
+
+
+def test_update_is_fenced_on_attempt(db):
+    a, b = IngestionQueue(), IngestionQueue()
+    job = _submit(db, a)
+    first = a._claim()
+    _go_stale(db, job)
+    second = b._claim()
+    assert (first["attempts"], second["attempts"]) == (1, 2)
+
+    # The old owner's writes no longer land
+    assert not a._update(job.id, 1, stage="embed", progress=0.5)
+    with pytest.raises(JobLostError):
+        JobContext(a, job.id, 1).progress("embed", 0.5)
+    assert b._update(job.id, 2, stage="index", progress=0.25)
+    row = _row(db, job)
+    assert (row.stage, row.progress) == ("index", 0.25)
+
+
+def test_failure_retries_with_backoff(db, monkeypatch):
+    queue = IngestionQueue()
+    calls = []
+
+    def handler(job, ctx):
+        calls.append(job["attempts"])
+        if len(calls) < 3:
+            raise RuntimeError("ollama down")
+        return {"ok": True}
+
+    queue.register("upload", handler)
+    job = _submit(db, queue)
+
+    queue._run(queue._claim())
+    row = _row(db, job)
+    assert (row.status, row.error) == ("queued", "ollama down")
+    delay = (row.run_after.replace(tzinfo=None) - _now().replace(tzinfo=None)).total_seconds()
+    assert 0 < delay <= ingestion.INGEST_RETRY_BASE_SECONDS
+    assert queue._claim() is None  # not due yet
+
+    row.run_after = _now() - timedelta(seconds=1)
+    db.commit()
+    queue._run(queue._claim())
+    row = _row(db, job)
+    delay = (row.run_after.replace(tzinfo=None) - _now().replace(tzinfo=None)).total_seconds()
+    assert ingestion.INGEST_RETRY_BASE_SECONDS < delay <= 2 * ingestion.INGEST_RETRY_BASE_SECONDS
+
+    row.run_after = _now() - timedelta(seconds=1)
+    db.commit()
+    queue._run(queue._claim())
+    row = _row(db, job)
+    assert calls == [1, 2, 3]
+    assert (row.status, row.progress, row.error) == ("succeeded", 1.0, None)
+
+
+def test_last_attempt_and_permanent_errors_fail(db):
+    queue = IngestionQueue()
+    queue.register("upload", lambda job, ctx: (_ for _ in ()).throw(RuntimeError("boom")))
+    job = _submit(db, queue, max_attempts=1)
+    queue._run(queue._claim())
+    assert _row(db, job).status == "failed"
+
+    queue.register("upload", lambda job, ctx: (_ for _ in ()).throw(PermanentJobError("no text")))
+    job = _submit(db, queue)
+    queue._run(queue._claim())
+    row = _row(db, job)
+    assert (row.status, row.attempts, row.error) == ("failed", 1, "no text")
+
+
+def test_stale_heartbeat_is_reclaimed(db):
+    queue = IngestionQueue()
+    job = _submit(db, queue, max_attempts=2)
+    assert queue._claim()["attempts"] == 1
+
+    # A live heartbeat keeps the job with its owner
+    assert queue._claim() is None
+
+    _go_stale(db, job)
+    reclaimed = queue._claim()
+    assert reclaimed["attempts"] == 2 and reclaimed["payload"] == {"ext": "pdf"}
+
+    # Interrupted once too often: failed instead of claimed again
+    _go_stale(db, job)
+    assert queue._claim() is None
+    row = _row(db, job)
+    assert (row.status, row.error) == ("failed", "Interrupted too many times")
@@ -0,0 +1,300 @@
+# backend/test_knowledge_index.py
+"""Write-behind knowledge index: journal recovery and worker resilience."""
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+import numpy as np
+import pytest
+
+from app.core import embeddings, knowledge_index
+from app.core.embeddings import EmbeddingService, set_embedding_service
+from app.core.knowledge_index import KnowledgeIndex
+
+DIM = 16
+
+
+class FakeEmbeddings(EmbeddingService):
+    """Deterministic vectors per text; `failures` encodes raise before it starts working."""
+
+    def __init__(self, failures: int = 0):
+        super().__init__()
+        self.failures = failures
+
+    @property
+    def dim(self) -> int:
+        return DIM
+
+    def encode_direct(self, texts, batch_size=32, normalize=True, show_progress_bar=False):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("encoder unavailable")
+        out = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+            v = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+            out.append(v / np.linalg.norm(v))
+        return np.stack(out)
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch):
+    monkeypatch.setattr(embeddings, "EMBED_MICROBATCH", False)
+    monkeypatch.setattr(knowledge_index, "KNOWLEDGE_RETRY_MAX_SECONDS", 0.05)
+    service = FakeEmbeddings()
+    set_embedding_service(service)
+    yield service
+    set_embedding_service(None)
+
+
+def _query(text: str) -> np.ndarray:
+    return FakeEmbeddings().encode_direct([text])[0]
+
+
+def _top(index: KnowledgeIndex, text: str) -> str:
+    return index.search(_query(text), 1)[0]["knowledge_id"]
+
+
+def test_journal_replay_after_crash(tmp_path, fake_embeddings, monkeypatch):
+    first = KnowledgeIndex(str(tmp_path))
+    first.load()
+    first.enqueue("k1", "alpha", 0.9)
+    first.drain()  # k1 is in the manifest, the journal is trimmed
+    first.close()
+
+    # Crash before the worker got to the rest: only the journal has them
+    monkeypatch.setattr(KnowledgeIndex, "_start_worker", lambda self: None)
+    crashed = KnowledgeIndex(str(tmp_path))
+    crashed.load()
+    crashed.enqueue("k2", "bravo", 0.8)
+    crashed.enqueue("k3", "charlie", 0.7)
+    crashed.delete("k1")
+    with open(crashed.journal_path, "ab") as f:
+        f.write(b'{"op": "add", "knowledge_id": "torn"')  # never acknowledged
+    crashed._writer_lock.release()  # the process is gone
+    monkeypatch.undo()
+    monkeypatch.setattr(embeddings, "EMBED_MICROBATCH", False)
+
+    recovered = KnowledgeIndex(str(tmp_path))
+    recovered.load()
+    recovered.drain()
+
+    assert len(recovered) == 2
+    assert _top(recovered, "bravo") == "k2"
+    assert _top(recovered, "charlie") == "k3"
+    assert all(hit["knowledge_id"] != "k1" for hit in recovered.search(_query("alpha"), 5))
+    assert os.path.getsize(recovered.journal_path) == 0
+
+
+def test_torn_flush_is_cut_off(tmp_path, fake_embeddings):
+    index = KnowledgeIndex(str(tmp_path))
+    index.load()
+    index.enqueue("k1", "alpha", 0.9)
+    index.close()
+
+    # Rows written after the last manifest commit must not be loaded
+    vectors_path, meta_path, _, _ = index._files()
+    with open(vectors_path, "ab") as f:
+        f.write(np.zeros(DIM, dtype=np.float32).tobytes())
+    with open(meta_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"knowledge_id": "ghost", "confidence": 1.0}) + "\n")
+
+    reopened = KnowledgeIndex(str(tmp_path))
+    reopened.load()
+    assert len(reopened) == 1
+    assert os.path.getsize(vectors_path) == DIM * 4
+
+
+def test_failed_batch_is_retried(tmp_path, fake_embeddings):
+    fake_embeddings.failures = 2
+    index = KnowledgeIndex(str(tmp_path))
+    index.load()
+    index.enqueue("k1", "alpha", 0.9)
+    index.drain()
+
+    assert index._worker.is_alive()
+    assert fake_embeddings.failures == 0
+    assert _top(index, "alpha") == "k1"
+
+    # The worker keeps serving later entries
+    index.enqueue("k2", "bravo", 0.9)
+    index.drain()
+    assert _top(index, "bravo") == "k2"
+
+
+def test_failed_batch_stays_in_journal(tmp_path, fake_embeddings):
+    fake_embeddings.failures = 10 ** 6
+    os.makedirs(tmp_path / "index")
+    index = KnowledgeIndex(str(tmp_path / "index"))
+    index.load()
+    index.enqueue("k1", "alpha", 0.9)
+    index._maybe_flush(force=True)
+
+    with open(index.journal_path, "r", encoding="utf-8") as f:
+        assert [json.loads(line)["knowledge_id"] for line in f] == ["k1"]
+    assert index._applied_seq == 0
+
+    # A restart with a working encoder picks it up from the journal (on a copy: the
+    # worker above is still retrying against the original directory)
+    restarted = tmp_path / "restarted"
+    shutil.copytree(tmp_path / "index", restarted)
+    set_embedding_service(FakeEmbeddings())
+    recovered = KnowledgeIndex(str(restarted))
+    recovered.load()
+    recovered.drain()
+    assert _top(recovered, "alpha") == "k1"
+
+    # ...and the original worker gets through once the encoder is back
+    index.drain()
+    assert _top(index, "alpha") == "k1"
+
+
+def test_drain_gives_up_on_a_stuck_batch(tmp_path, fake_embeddings):
+    fake_embeddings.failures = 10 ** 6
+    index = KnowledgeIndex(str(tmp_path))
+    index.load()
+    index.enqueue("k1", "alpha", 0.9)
+
+    start = time.monotonic()
+    assert index.drain(timeout=0.2) is False
+    assert time.monotonic() - start < 2
+    with open(index.journal_path, "r", encoding="utf-8") as f:
+        assert [json.loads(line)["knowledge_id"] for line in f] == ["k1"]
+
+    fake_embeddings.failures = 0
+    assert index.drain(timeout=10) is True
+    assert _top(index, "alpha") == "k1"
+
+
+def _fill(index: KnowledgeIndex, n: int) -> None:
+    for i in range(n):
+        index.enqueue(f"k{i}", f"text {i}", 0.5)
+    index.drain()
+
+
+def test_compaction_keeps_live_rows(tmp_path, fake_embeddings):
+    index = KnowledgeIndex(str(tmp_path))
+    index.load()
+    _fill(index, 40)
+    for i in range(0, 40, 4):
+        index.delete(f"k{i}")
+    index.update_stats("k1", confidence=0.9, usage_count=7)
+    index.drain()
+
+    # Writes that land while compaction copies outside the lock go into the tail / tombstones
+    choose = index._choose_evictions
+
+    def during_copy(live, meta):
+        index._apply_batch([
+            {"op": "add", "knowledge_id": "late", "text": "late text", "confidence": 0.5, "seq": 10 ** 6},
+            {"op": "delete", "knowledge_id": "k2", "seq": 10 ** 6 + 1},
+        ])
+        return choose(live, meta)
+
+    index._choose_evictions = during_copy
+    removed = index.compact()
+    expected = {f"k{i}" for i in range(40) if i % 4 and i != 2} | {"late"}
+
+    # The ten earlier deletes are dropped; k2, deleted mid-copy, stays as a tombstone
+    assert removed == 10
+    assert index._tombstones == [index._meta.index({"knowledge_id": "k2", "confidence": 0.5})]
+    assert len(index) == len(expected)
+    for kid in expected:
+        text = "late text" if kid == "late" else f"text {kid[1:]}"
+        # k1's boosted stats may outrank the exact match
+        assert kid in {hit["knowledge_id"] for hit in index.search(_query(text), 2)}
+    row = index._id_to_row["k1"]
+    assert (index._confidence[row], index._usage[row]) == (pytest.approx(0.9), 7)
+
+    index.close()
+    reopened = KnowledgeIndex(str(tmp_path))
+    reopened.load()
+    assert len(reopened) == len(expected)
+    assert set(reopened._id_to_row) == expected
+    assert reopened._usage[reopened._id_to_row["k1"]] == 7
+
+
+def test_capacity_eviction_drops_weakest(tmp_path, fake_embeddings, monkeypatch):
+    monkeypatch.setattr(knowledge_index, "KNOWLEDGE_MAX_ROWS", 10)
+    monkeypatch.setattr(knowledge_index, "KNOWLEDGE_EVICT_HEADROOM", 0.2)
+    index = KnowledgeIndex(str(tmp_path))
+    index.load()
+    _fill(index, 12)
+    for i in range(12):
+        index.update_stats(f"k{i}", confidence=0.1 if i < 4 else 0.9)
+
+    index.compact()
+
+    assert set(index._id_to_row) == {f"k{i}" for i in range(4, 12)}
+
+
+def test_reindex_keeps_learned_stats(tmp_path, fake_embeddings):
+    index = KnowledgeIndex(str(tmp_path))
+    index.load()
+    index.enqueue("k1", "alpha", 0.5)
+    index.drain()
+    index.update_stats("k1", confidence=0.95, usage_count=12)
+
+    # The orchestrator re-indexes with its base confidence
+    index.enqueue("k1", "alpha, revised", 0.5)
+    index.drain()
+
+    row = index._id_to_row["k1"]
+    assert row == 1 and len(index) == 1
+    assert (index._confidence[row], index._usage[row]) == (pytest.approx(0.95), 12)
+
+
+def test_reader_entries_survive_writer_commits(tmp_path, fake_embeddings):
+    writer = KnowledgeIndex(str(tmp_path))
+    writer.load()
+    writer.enqueue("k1", "alpha", 0.9)
+    writer.drain()
+
+    reader = KnowledgeIndex(str(tmp_path))
+    reader.load()
+    assert writer.writer and not reader.writer
+    reader.enqueue("kb", "bravo", 0.9)
+    reader.drain()
+    assert reader.compact() == 0
+
+    # The writer commits before it has read kb: the journal must keep it
+    writer.update_stats("k1", usage_count=3)
+    writer.flush_to_disk()
+    with open(writer.journal_path, "r", encoding="utf-8") as f:
+        assert [json.loads(line)["knowledge_id"] for line in f] == ["kb"]
+
+    # The writer picks it up with its next entry, in journal order
+    writer.enqueue("k2", "charlie", 0.9)
+    writer.drain()
+    assert {_top(writer, "bravo"), _top(writer, "charlie")} == {"kb", "k2"}
+    assert os.path.getsize(writer.journal_path) == 0
+    assert _top(reader, "bravo") == "kb" and _top(reader, "alpha") == "k1"
+
+
+def _worker_enqueue(root: str, tag: str, n: int) -> None:
+    index = KnowledgeIndex(root)
+    index.load()
+    for i in range(n):
+        index.enqueue(f"{tag}-{i}", f"{tag} text {i}", 0.5)
+    index.drain(10)
+
+
+def test_concurrent_process_journals(tmp_path, fake_embeddings):
+    root = str(tmp_path)
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_worker_enqueue, args=(root, f"p{i}", 20)) for i in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+
+    # Whatever the writer process had not committed is replayed from the journal
+    index = KnowledgeIndex(root)
+    index.load()
+    index.drain()
+    assert set(index._id_to_row) == {f"p{i}-{j}" for i in range(3) for j in range(20)}
+    assert len(index) == 60
@@ -0,0 +1,32 @@
+# backend/test_model_router.py
+"""Model routing: failed models are skipped, then tried again once their failures age out."""
+from app.core import model_router as mr
+from app.core.model_router import ModelRouter
+
+
+def test_failures_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(mr.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(mr, "ROUTER_FAILURE_WINDOW_SECONDS", 60)
+    router = ModelRouter()
+
+    # One failure on its first request: skipped for now
+    router.record_failure("big")
+    assert router.choose(["big", "small"]) == "small"
+
+    now[0] += 30
+    assert router.choose(["big", "small"]) == "small"
+
+    # Nothing new was recorded for it, but the failure aged out
+    now[0] += 31
+    assert router.choose(["big", "small"]) == "big"
+    assert router.stats["big"].as_dict()["samples"] == 1
+
+
+def test_recent_successes_outweigh_an_old_failure():
+    router = ModelRouter()
+    router.record_failure("big")
+    for _ in range(4):
+        router.observe("big", 0.1, {})
+    assert router.stats["big"].failure_rate == 0.2
+    assert router.choose(["big", "small"]) == "big"
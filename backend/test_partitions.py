@@ -0,0 +1,108 @@
+# backend/test_partitions.py
+"""Per-owner upload partitions: concurrent appends, guest keys, legacy upload migration."""
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from app.data_processing import embed_dataset
+from app.data_processing.columnar_store import ColumnarStore
+from app.data_processing.partitions import Partition, PartitionSet, upload_owner
+
+DIM = 8
+
+
+def _upload(tag: str, n: int):
+    texts = [f"{tag} chunk {i}" for i in range(n)]
+    vectors = np.random.default_rng(len(tag) * 31 + n).standard_normal((n, DIM)).astype(np.float32)
+    return texts, vectors, [embed_dataset.compute_digest(t) for t in texts]
+
+
+def _append(part: Partition, tag: str, n: int = 3) -> None:
+    texts, vectors, digests = _upload(tag, n)
+    part.append(texts, vectors, digests, source=f"{tag}.pdf", upload_id=tag)
+
+
+def _worker(root: str, tag: str, uploads: int) -> None:
+    part = Partition(root, "u1")
+    for i in range(uploads):
+        _append(part, f"{tag}-{i}")
+
+
+def _check_consistent(part: Partition) -> None:
+    part.refresh()
+    assert [u["code"] for u in part.uploads] == list(range(len(part.uploads)))
+    for row in range(len(part)):
+        # Every row is labelled with the upload its text came from
+        assert part.store.text(row).startswith(part.metadata(row)["upload_id"] + " chunk")
+
+
+def test_two_instances_append(tmp_path):
+    root = str(tmp_path / "u1")
+    a, b = Partition(root, "u1"), Partition(root, "u1")
+    _append(a, "a0")
+    _append(b, "b0")  # b has not seen a's upload
+    _append(a, "a1", 2)
+
+    reopened = Partition(root, "u1")
+    assert len(reopened) == 8
+    assert [u["upload_id"] for u in reopened.uploads] == ["a0", "b0", "a1"]
+    _check_consistent(reopened)
+
+
+def test_concurrent_process_appends(tmp_path):
+    root = str(tmp_path / "u1")
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_worker, args=(root, f"p{i}", 6)) for i in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+
+    part = Partition(root, "u1")
+    assert len(part) == 3 * 6 * 3
+    assert sorted(u["upload_id"] for u in part.uploads) == sorted(f"p{i}-{j}" for i in range(3) for j in range(6))
+    _check_consistent(part)
+
+
+def test_guests_do_not_share_a_partition(tmp_path):
+    assert upload_owner("42", "guest-abc") == "42"
+    assert upload_owner("guest", "guest-abc") == "guest-abc"
+    assert upload_owner(None, "guest-abc") == "guest-abc"
+    assert upload_owner("guest", None) is None
+    assert upload_owner("guest", "not-a-guest-chat") is None
+
+    parts = PartitionSet(str(tmp_path))
+    _append(parts.get(upload_owner("guest", "guest-one")), "secret")
+    q = _upload("secret", 3)[1][0]
+    assert parts.search(q, "guest-one", 3)
+    assert parts.search(q, "guest-two", 3) == []
+
+
+def test_legacy_uploads_move_to_owner_partition(tmp_path, monkeypatch):
+    chunks = ["alpha " * 12, "beta " * 12, "gamma " * 12]
+    texts = [
+        f"[Source: report.pdf] [Uploaded file: report.pdf] {chunks[0]}",
+        "An ordinary QA row from the shared corpus",
+        f"[Source: report.pdf] [Uploaded file: report.pdf] {chunks[1]}",
+        f"[Source: shared.pdf] [Uploaded file: shared.pdf] {chunks[2]}",
+    ]
+    vectors = np.eye(4, DIM, dtype=np.float32)
+    store = ColumnarStore.create(str(tmp_path / "store"), texts, vectors)
+    parts = PartitionSet(str(tmp_path / "partitions"))
+    monkeypatch.setattr(embed_dataset, "_store", store)
+    monkeypatch.setattr(embed_dataset, "_partitions", parts)
+    monkeypatch.setattr(embed_dataset, "PARTITIONS_DIR", str(tmp_path / "partitions"))
+    monkeypatch.setattr(embed_dataset, "LEGACY_UPLOADS_MARKER", str(tmp_path / "partitions" / ".migrated"))
+
+    # shared.pdf was uploaded by several users: it cannot be attributed
+    assert embed_dataset.migrate_legacy_uploads({"report.pdf": ("u1", "f1")}) == (2, 1)
+
+    hits = parts.search(vectors[2], "u1", 5)
+    assert [text for _, text, _ in hits[:1]] == [chunks[1]]
+    assert {meta["source"] for _, _, meta in hits} == {"report.pdf"}
+    assert {meta["upload_id"] for _, _, meta in hits} == {"f1"}
+    # Runs once
+    assert embed_dataset.migrate_legacy_uploads({"report.pdf": ("u1", "f1")}) == (0, 0)
+    assert len(parts.get("u1")) == 2
@@ -0,0 +1,81 @@
+# backend/test_streaming_fallback.py
+"""TTFT fallback: the deadline runs from slot admission and a fallback is not a model failure."""
+import asyncio
+import os
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import pytest
+
+from app.core import llm_inference
+from app.core.llm_inference import generate_with_streaming_async
+from app.core.ollama_client import OllamaConnectionError, OllamaHTTPError
+
+DEADLINE = 0.1
+
+
+class FakeOllama:
+    """chat_stream that waits `queued` for its slot, then `ttft` for the first token."""
+
+    def __init__(self, timings, error=None):
+        self.timings = timings
+        self.error = error
+
+    async def chat_stream(self, model, messages, options=None, priority=None, user=None, on_admitted=None):
+        if self.error is not None:
+            raise self.error
+        queued, ttft = self.timings[model]
+        await asyncio.sleep(queued)
+        if on_admitted is not None:
+            on_admitted()
+        await asyncio.sleep(ttft)
+        yield {"message": {"role": "assistant", "content": model}, "done": False}
+        yield {"message": {"role": "assistant", "content": ""}, "done": True}
+
+
+@pytest.fixture
+def observed(monkeypatch):
+    calls = []
+    monkeypatch.setattr(llm_inference.model_router, "ttft_deadline", lambda *a, **k: DEADLINE)
+    monkeypatch.setattr(
+        llm_inference, "record_performance",
+        lambda model, ttft, final=None, success=True, style=None: calls.append((model, ttft, success)),
+    )
+    return calls
+
+
+def _run(monkeypatch, timings, error=None):
+    monkeypatch.setattr(llm_inference, "ollama", FakeOllama(timings, error))
+    used = {}
+
+    async def collect():
+        messages = [{"role": "user", "content": "hi"}]
+        return [piece async for piece in generate_with_streaming_async(
+            messages, "primary", {}, fallbacks=["fallback"], used=used,
+        )]
+
+    return asyncio.run(collect()), used
+
+
+def test_queue_time_does_not_trigger_fallback(monkeypatch, observed):
+    pieces, used = _run(monkeypatch, {"primary": (0.3, 0.01), "fallback": (0.0, 0.0)})
+    assert pieces == ["primary"] and used["model"] == "primary"
+    [(model, ttft, success)] = observed
+    # The recorded TTFT leaves out the time spent queued
+    assert (model, success) == ("primary", True) and ttft < DEADLINE
+
+
+def test_slow_first_token_falls_back_without_failure(monkeypatch, observed):
+    pieces, used = _run(monkeypatch, {"primary": (0.0, 1.0), "fallback": (0.0, 0.0)})
+    assert pieces == ["fallback"] and used["model"] == "fallback"
+    assert [(model, success) for model, _, success in observed] == [("fallback", True)]
+
+
+def test_unreachable_ollama_is_not_a_model_failure(monkeypatch, observed):
+    timings = {"primary": (0.0, 0.0), "fallback": (0.0, 0.0)}
+    pieces, _ = _run(monkeypatch, timings, OllamaConnectionError("connection refused"))
+    assert "Connection error" in pieces[0]
+    assert observed == []
+
+    _run(monkeypatch, timings, OllamaHTTPError(500, "model crashed"))
+    assert [(model, success) for model, _, success in observed] == [("primary", False)]
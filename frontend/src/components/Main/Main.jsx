@@ -662,6 +662,7 @@ const Main = ({
       const formData = new FormData();
       formData.append("file", selectedFile);
       if (currentMessage) formData.append("query", currentMessage);
+      formData.append("wait", "true");
       if (currentChat?.id) {
         formData.append("chat_id", currentChat.id);
       }